@@ -0,0 +1,208 @@
+import numpy as np
+from shifts import HOURS_PER_WEEK
+
+# Throughput is measured in pounds of finished goods per hour of calendar
+# time, so a stage's capacity is scaled by the share of the week its shift
+# calendar works and by the good fraction of every stage after it.
+#
+# Finite buffers are handled by decomposing the line into two-stage pairs,
+# each pair treated as an M/M/c/K queue: the upstream stage offers work at
+# its capacity to the c machines of the downstream stage, and the buffer
+# between them is the waiting room, counted in downstream batches. Upstream
+# work arriving to a full waiting room is lost to blocking. Exponential
+# process times, and ignoring the finished batches blocked machines hold,
+# make this pessimistic for the low variability machines of the plant, which
+# is the safe side for screening.
+#
+# Yields make the amounts in a buffer continuous, so a buffer can be left
+# holding less than a downstream batch with no room for the next upstream
+# batch. A buffer smaller than the two batches together can therefore
+# deadlock the line in simulation, and such a variant is flagged infeasible
+# with no throughput. The Start-Buffer is fed whole deliveries, so it must
+# hold a delivery and a batch of the first stage together.
+
+
+def stage_arrays(spec):
+    """Collects the per stage parameters of a line into numpy arrays
+
+    Parameters:
+    spec (line.LineSpec): The line
+
+    Returns:
+    dict: Arrays of length stages keyed by parameter name
+    """
+    stages = spec.stages
+    mtbf = np.array([stage.mtbf or 0 for stage in stages], dtype=float)
+    mttr = np.array([stage.mttr or 0 for stage in stages], dtype=float)
+    # a machine is up mtbf out of every mtbf + mttr hours, one without breakdowns is always up
+    with np.errstate(invalid="ignore", divide="ignore"):
+        availability = np.where((mtbf > 0) & np.isfinite(mtbf), mtbf / (mtbf + mttr), 1.0)
+    working_fraction = np.array([
+        1.0 if stage.calendar is None else stage.calendar.hours_per_week / HOURS_PER_WEEK
+        for stage in stages
+    ])
+    return {
+        "units": np.array([stage.units for stage in stages], dtype=float),
+        "batch_size": np.array([stage.batch_size for stage in stages], dtype=float),
+        "cycle_time": np.array([stage.cycle_time for stage in stages], dtype=float),
+        "availability": availability * working_fraction,
+        "good_fraction": np.array(
+            [stage.yield_rate * (1 - stage.batch_failure_rate) for stage in stages], dtype=float),
+        "buffer_capacity": np.array([stage.buffer_capacity for stage in stages], dtype=float),
+    }
+
+
+def _erlang_b(servers, load):
+    """Erlang's loss probability of servers parallel servers under an offered load, vectorized
+
+    The recursion B(n) = load B(n - 1) / (n + load B(n - 1)) runs up to the
+    largest server count and each entry keeps the value at its own count
+    """
+    blocking = np.ones_like(load)
+    for n in range(1, int(servers.max()) + 1):
+        step = load * blocking / (n + load * blocking)
+        blocking = np.where(n <= servers, step, blocking)
+    return blocking
+
+
+def _pair_throughput(upstream, downstream, servers, room):
+    """Throughput of a two-stage pair, vectorized M/M/c/K
+
+    Parameters:
+    upstream (numpy.ndarray): The rate the upstream stage offers
+    downstream (numpy.ndarray): The capacity of the downstream stage
+    servers (numpy.ndarray): The machines of the downstream stage, c
+    room (numpy.ndarray): The downstream batches the buffer holds, K - c, inf for no limit
+
+    Returns:
+    numpy.ndarray: The rate that gets through, the offered rate less what blocking loses
+    """
+    servers = np.maximum(servers, 1)
+    with np.errstate(invalid="ignore", divide="ignore", over="ignore"):
+        rho = upstream / downstream
+        loss = _erlang_b(servers, servers * rho)
+        # the probability that the waiting room is full, from the Erlang loss of the servers
+        # and the geometric tail rho ** j of the j waiting jobs, written for each side of rho = 1
+        below = loss * rho ** room / (1 + loss * rho * (1 - rho ** room) / (1 - rho))
+        above = loss / (rho ** -room + loss * rho * (1 - rho ** -room) / (rho - 1))
+        balanced = loss / (1 + loss * room)
+        full = np.where(np.isclose(rho, 1.0), balanced, np.where(rho < 1, below, above))
+        throughput = np.minimum(upstream * (1 - full), downstream)
+    return np.where(np.isinf(room), np.minimum(upstream, downstream), throughput)
+
+
+def deadlocks(spec, buffer_capacities):
+    """Flags the buffers small enough to deadlock the line
+
+    Parameters:
+    spec (line.LineSpec): The line supplying the batch and delivery sizes
+    buffer_capacities (numpy.ndarray): Capacity of the buffer feeding each stage, shape (candidates, stages)
+
+    Returns:
+    numpy.ndarray: Whether the buffer feeding each stage cannot hold what is put into it, a delivery for the
+    Start-Buffer and a batch of the stage before otherwise, together with a batch of the stage, same shape
+    """
+    batch_size = stage_arrays(spec)["batch_size"]
+    incoming = np.concatenate(([spec.delivery_size], batch_size[:-1]))
+    return buffer_capacities < incoming + batch_size
+
+
+def screen(spec, units=None, buffer_capacities=None):
+    """Estimates many variants of a line at once
+
+    Parameters:
+    spec (line.LineSpec): The line supplying everything but the varied values
+    units (numpy.ndarray): Machines per stage, shape (candidates, stages), the spec's when None
+    buffer_capacities (numpy.ndarray): Capacity of the buffer feeding each stage, same shape
+
+    Returns:
+    dict: Arrays over candidates of the throughput, 0 for infeasible candidates, the bottleneck stage
+    index, per stage capacities in finished pounds per hour and whether no buffer can deadlock the line,
+    see deadlocks
+    """
+    arrays = stage_arrays(spec)
+    units = np.atleast_2d(arrays["units"] if units is None else np.asarray(units, dtype=float))
+    if buffer_capacities is None:
+        buffer_capacities = arrays["buffer_capacity"]
+    buffer_capacities = np.broadcast_to(np.asarray(buffer_capacities, dtype=float), units.shape)
+    good_fraction = arrays["good_fraction"]
+    # the finished pounds one pound entering stage i turns into
+    downstream_yield = np.cumprod(good_fraction[::-1])[::-1]
+    # pounds per hour each stage can take in, then in finished pounds per hour
+    intake = units * arrays["batch_size"] / arrays["cycle_time"] * arrays["availability"]
+    capacity = intake * downstream_yield
+    supply = spec.delivery_size / spec.delivery_time * downstream_yield[0]
+    throughput = np.minimum(capacity.min(axis=1), supply)
+    batch_size = arrays["batch_size"]
+    feasible = ~deadlocks(spec, buffer_capacities).any(axis=1)
+    # the loss caused by each finite buffer between two stages
+    for i in range(1, units.shape[1]):
+        room = np.floor(buffer_capacities[:, i] / batch_size[i])
+        pair = _pair_throughput(capacity[:, i - 1], capacity[:, i], units[:, i], room)
+        throughput = np.minimum(throughput, pair)
+    return {
+        "throughput": np.where(feasible, throughput, 0.0),
+        "bottleneck": capacity.argmin(axis=1),
+        "capacity": capacity,
+        "supply": np.full(units.shape[0], supply),
+        "feasible": feasible,
+    }
+
+
+class LineEstimate(object):
+    """The analytical estimate of a line
+
+    Attributes:
+        names           The stage names in process order
+        intake          The pounds per hour each stage can take in
+        capacity        The finished pounds per hour each stage can support
+        bottleneck      The name of the stage with the lowest capacity
+        supply          The finished pounds per hour the deliveries can support
+        throughput      The estimated finished pounds per hour of the line, 0 when it deadlocks
+        deadlocks       The names of the stages whose in buffer can deadlock the line, see the deadlocks
+                        function, empty for a feasible line
+    """
+
+    def __init__(self, names, intake, capacity, bottleneck, supply, throughput, deadlocks):
+        self.names = names
+        self.intake = intake
+        self.capacity = capacity
+        self.bottleneck = bottleneck
+        self.supply = supply
+        self.throughput = throughput
+        self.deadlocks = deadlocks
+
+    @property
+    def feasible(self):
+        """Whether no buffer is small enough to deadlock the line"""
+        return not self.deadlocks
+
+    def __repr__(self):
+        if self.deadlocks:
+            return f'LineEstimate(infeasible, buffers too small before {", ".join(self.deadlocks)})'
+        return f'LineEstimate(throughput={self.throughput:.6g} lbs/h, bottleneck={self.bottleneck!r})'
+
+
+def estimate_line(spec):
+    """Estimates the capacity of each stage and the throughput of a line
+
+    Parameters:
+    spec (line.LineSpec): The line
+
+    Returns:
+    LineEstimate: The estimate
+    """
+    arrays = stage_arrays(spec)
+    result = screen(spec)
+    blocked = deadlocks(spec, arrays["buffer_capacity"][None, :])[0]
+    capacity = result["capacity"][0]
+    downstream_yield = np.cumprod(arrays["good_fraction"][::-1])[::-1]
+    return LineEstimate(
+        names = [stage.name for stage in spec.stages],
+        intake = (capacity / downstream_yield).tolist(),
+        capacity = capacity.tolist(),
+        bottleneck = spec.stages[int(result["bottleneck"][0])].name,
+        supply = float(result["supply"][0]),
+        throughput = float(result["throughput"][0]),
+        deadlocks = [stage.name for stage, stuck in zip(spec.stages, blocked) if stuck],
+    )
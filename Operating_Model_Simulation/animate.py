@@ -0,0 +1,246 @@
+import math
+import os
+import subprocess
+import numpy as np
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.patches import Rectangle
+from matplotlib.transforms import Bbox, TransformedBbox
+from metrics import state_matrix, BUSY, STARVED, BLOCKED, DOWN, OFF_SHIFT
+
+# RGBA colors of the machine states, the last row paints the unused cells of a stage grid
+STATE_COLORS = np.zeros((OFF_SHIFT + 2, 4), dtype=np.uint8)
+STATE_COLORS[BUSY] = (46, 160, 67, 255)
+STATE_COLORS[STARVED] = (60, 60, 60, 255)
+STATE_COLORS[BLOCKED] = (230, 140, 20, 255)
+STATE_COLORS[DOWN] = (210, 40, 40, 255)
+STATE_COLORS[OFF_SHIFT] = (150, 170, 200, 255)
+EMPTY_CELL = OFF_SHIFT + 1
+
+# the layout in data units, every stage gets a buffer column and a machine column
+BUFFER_WIDTH = 0.4
+STAGE_WIDTH = 1.0
+GAP = 0.2
+
+
+def _compact(level):
+    """Formats a buffer level short enough to fit under the buffer"""
+    if abs(level) >= 1e6:
+        return f'{level / 1e6:.1f}M'
+    if abs(level) >= 1e4:
+        return f'{level / 1e3:.0f}k'
+    return f'{level:.0f}'
+
+
+class LineRenderer(object):
+    """Draws a line.Line frame by frame, redrawing only what changed
+
+    The machines of a stage are the pixels of one image, so a stage of
+    hundreds of machines costs one array lookup per frame. The static parts
+    are drawn once, and for every frame only the stages and buffers whose
+    state changed since the last frame are restored from the background and
+    redrawn on the canvas. The figure draws on its own Agg canvas, so
+    rendering needs no display and leaves the pyplot backend alone
+
+    Attributes:
+        matrix      The metrics.StateMatrix being drawn
+        figure      The matplotlib figure
+        axes        The matplotlib axes
+        stages      The column slices of the machines of each stage in the matrix
+        shapes      The (rows, columns) of the machine grid of each stage
+        images      The image artist of each stage
+        bars        The fill rectangle of each buffer
+        labels      The level text of each buffer
+        scales      The level at which each buffer bar is full
+        clock       The time text
+    """
+
+    def __init__(self, line, matrix, width=12, height=5, dpi=100):
+        self.matrix = matrix
+        self.figure = Figure(figsize=(width, height), dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.axes = self.figure.add_axes((0.01, 0.01, 0.98, 0.9))
+        self.axes.set_axis_off()
+        columns = len(line.stages) * (BUFFER_WIDTH + STAGE_WIDTH + 2 * GAP) + BUFFER_WIDTH
+        self.axes.set_xlim(0, columns)
+        self.axes.set_ylim(0, 1.5)
+        self.stages = []
+        self.shapes = []
+        self.images = []
+        self.bars = []
+        self.labels = []
+        self._regions = []
+        self._boxes = []
+
+        start = 0
+        x = 0.0
+        for i, buffer in enumerate(line.buffers):
+            self._add_buffer(buffer, i, x)
+            x += BUFFER_WIDTH + GAP
+            if i < len(line.stages):
+                units = len(line.stages[i])
+                self.stages.append(slice(start, start + units))
+                start += units
+                self._add_stage(line.stages[i], x)
+                x += STAGE_WIDTH + GAP
+        self.clock = self.axes.text(0, 1.42, "", fontsize="medium", ha="left", va="center", animated=True)
+        finite = np.isfinite([buffer.capacity for buffer in line.buffers])
+        peaks = matrix.levels.max(axis=0) if len(matrix.times) else np.zeros(len(line.buffers))
+        self.scales = np.where(finite, [buffer.capacity for buffer in line.buffers], np.maximum(peaks, 1))
+        self._frame = None
+
+    def _add_buffer(self, buffer, index, x):
+        self.axes.add_patch(Rectangle((x, 0.2), BUFFER_WIDTH, 0.6, fill=False, linewidth=1))
+        bar = Rectangle((x, 0.2), BUFFER_WIDTH, 0, color="tab:blue", alpha=0.5, animated=True)
+        self.axes.add_patch(bar)
+        self.bars.append(bar)
+        self.labels.append(self.axes.text(
+            x + BUFFER_WIDTH / 2, 0.15, "", fontsize="xx-small", ha="center", va="top", animated=True))
+        self._boxes.append(("buffer", index, (x - GAP / 2, 0.0, x + BUFFER_WIDTH + GAP / 2, 0.81)))
+
+    def _add_stage(self, machines, x):
+        # lay the machines out in a grid about as wide as it is tall
+        units = max(len(machines), 1)
+        columns = max(1, math.ceil(math.sqrt(units * STAGE_WIDTH)))
+        rows = math.ceil(units / columns)
+        self.shapes.append((rows, columns))
+        extent = (x, x + STAGE_WIDTH, 0.0, 1.0)
+        image = self.axes.imshow(
+            np.zeros((rows, columns, 4), dtype=np.uint8), extent=extent,
+            interpolation="nearest", origin="upper", aspect="auto", animated=True)
+        self.images.append(image)
+        if machines:
+            self.axes.text(x, 1.01, machines[0].type, fontsize="xx-small", ha="left", va="bottom", rotation=25)
+        self._boxes.append(("stage", len(self.images) - 1, (x, 0.0, x + STAGE_WIDTH, 1.0)))
+
+    def _stage_pixels(self, stage, states):
+        rows, columns = self.shapes[stage]
+        cells = np.full(rows * columns, EMPTY_CELL, dtype=np.int8)
+        cells[:len(states)] = states
+        return STATE_COLORS[cells].reshape(rows, columns, 4)
+
+    def _draw_group(self, kind, index, frame):
+        if kind == "stage":
+            self.images[index].set_data(self._stage_pixels(index, self.matrix.states[frame, self.stages[index]]))
+            self.axes.draw_artist(self.images[index])
+        else:
+            level = self.matrix.levels[frame, index]
+            self.bars[index].set_height(0.6 * min(level / self.scales[index], 1.0))
+            self.labels[index].set_text(_compact(level))
+            self.axes.draw_artist(self.bars[index])
+            self.axes.draw_artist(self.labels[index])
+
+    def setup(self):
+        """Draws the static parts and saves the background of every changing region"""
+        canvas = self.figure.canvas
+        canvas.draw()
+        self._regions = []
+        for kind, index, (x0, y0, x1, y1) in self._boxes:
+            box = TransformedBbox(Bbox([[x0, y0], [x1, y1]]), self.axes.transData)
+            self._regions.append(canvas.copy_from_bbox(box))
+        clock_box = TransformedBbox(Bbox([[0, 1.36], [3, 1.48]]), self.axes.transData)
+        self._clock_region = canvas.copy_from_bbox(clock_box)
+        self._frame = None
+
+    def draw(self, frame):
+        """Brings the canvas to a frame, redrawing only the stages and buffers that changed"""
+        canvas = self.figure.canvas
+        states = self.matrix.states
+        levels = self.matrix.levels
+        previous = self._frame
+        for (kind, index, _), region in zip(self._boxes, self._regions):
+            if previous is not None:
+                if kind == "stage" and np.array_equal(states[frame, self.stages[index]], states[previous, self.stages[index]]):
+                    continue
+                if kind == "buffer" and levels[frame, index] == levels[previous, index]:
+                    continue
+            canvas.restore_region(region)
+            self._draw_group(kind, index, frame)
+        canvas.restore_region(self._clock_region)
+        self.clock.set_text(f'Time: {self.matrix.times[frame]:.1f} h')
+        self.axes.draw_artist(self.clock)
+        canvas.blit(self.figure.bbox)
+        self._frame = frame
+
+    def pixels(self):
+        """Returns the current canvas as an (height, width, 3) uint8 array"""
+        return np.asarray(self.figure.canvas.buffer_rgba())[:, :, :3]
+
+    def frames(self, frames=None):
+        """Yields the canvas pixels of every frame in turn"""
+        self.setup()
+        for frame in range(len(self.matrix.times)) if frames is None else frames:
+            self.draw(frame)
+            yield self.pixels()
+
+    def close(self):
+        self.figure.clear()
+
+
+def _write_gif(frames, path, fps):
+    """Writes frames to a GIF, mapping each frame as it arrives onto one palette
+    The palette is fitted once to the first frame and holds the state colors
+    exactly, which is far cheaper than fitting a palette to every frame
+    """
+    from PIL import Image
+
+    frames = iter(frames)
+    first = next(frames)
+    fitted = Image.fromarray(first).convert("P", palette=Image.ADAPTIVE, colors=256 - len(STATE_COLORS))
+    palette = Image.new("P", (1, 1))
+    palette.putpalette(fitted.getpalette()[:3 * (256 - len(STATE_COLORS))] + STATE_COLORS[:, :3].ravel().tolist())
+    images = (Image.fromarray(pixels).quantize(palette=palette, dither=Image.Dither.NONE) for pixels in frames)
+    Image.fromarray(first).quantize(palette=palette, dither=Image.Dither.NONE).save(
+        path, save_all=True, append_images=images, duration=int(1000 / fps), loop=0, optimize=False)
+
+
+def _write_video(frames, path, fps):
+    """Pipes raw frames into ffmpeg, so no more than one frame is held in memory"""
+    ffmpeg = matplotlib.rcParams["animation.ffmpeg_path"]
+    process = None
+    try:
+        for pixels in frames:
+            if process is None:
+                height, width = pixels.shape[:2]
+                process = subprocess.Popen(
+                    [ffmpeg, "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgb24",
+                     "-s", f'{width}x{height}', "-r", str(fps), "-i", "-",
+                     "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p", path],
+                    stdin=subprocess.PIPE)
+            process.stdin.write(np.ascontiguousarray(pixels).tobytes())
+    finally:
+        if process is not None:
+            process.stdin.close()
+            process.wait()
+
+
+def animate(line, path, step=0.1, start=0.0, end=None, fps=20, width=12, height=5, dpi=100, matrix=None):
+    """Renders a simulated line to a GIF or video without a display
+
+    Parameters:
+    line (line.Line): The line after env.run, its machines and buffers must keep histories
+    path (str): The output file, .gif is written with Pillow and anything else through ffmpeg
+    step (float): The simulation time between frames
+    start (float): The time of the first frame
+    end (float): The time of the last frame, the current simulation time when None
+    fps (int): The frames per second of the output
+    width (float): The figure width in inches
+    height (float): The figure height in inches
+    dpi (int): The dots per inch of the figure
+    matrix (metrics.StateMatrix): Precomputed states to draw instead of sampling the line
+
+    Returns:
+    int: The number of frames written
+    """
+    if matrix is None:
+        matrix = state_matrix(line.machines, line.buffers, step, start, end)
+    renderer = LineRenderer(line, matrix, width, height, dpi)
+    try:
+        if os.path.splitext(path)[1].lower() == ".gif":
+            _write_gif(renderer.frames(), path, fps)
+        else:
+            _write_video(renderer.frames(), path, fps)
+    finally:
+        renderer.close()
+    return len(matrix.times)
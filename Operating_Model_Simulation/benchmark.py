@@ -0,0 +1,257 @@
+"""Benchmarks the simulation and checks it against stored baselines
+
+Usage:
+    python benchmark.py             run and compare with benchmark_baseline.json
+    python benchmark.py --update    run and store the results as the baseline of this engine and machine
+    python benchmark.py --quick     skip the slow full plant cases
+    python benchmark.py --slow      add the plant-year cases, a year of the plant as the workbook sizes it
+    python benchmark.py --repeat 1  time each case once instead of the best of three
+    python benchmark.py --engine heap   run the cases on engine.Engine, the events must not change
+
+Every case runs with a fixed seed, so the number of simulation events is
+exact and any change to it means the model behaves differently. Wall time
+may grow by the tolerance before a case fails.
+
+The baseline keeps results per engine and per kind of machine, see
+machine_key. Event counts are checked against the results of any machine,
+wall time and memory only against those of the same kind of machine. A
+missing baseline, or a case without one, fails the check.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import simpy
+from engine import Engine, make_environment
+from line import Line, LineSpec, StageSpec
+from plant import plant_spec
+from specs import load_specs
+
+SEED = 12345
+HOURS_PER_YEAR = 8760
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+TOLERANCE = 0.25
+# the largest plant the workbook sizes, so the plant cases measure the engine at scale
+PLANT_TARGET_TONS = 20000
+# the seconds any case may slow down by, so millisecond cases do not fail on timer noise
+WALL_SLACK = 0.05
+SCALING_FRACTIONS = (0.0, 0.125, 0.25, 0.5, 1.0)
+# the pooled cases run every stage of at least this many units as one entities.MachinePool
+POOL_UNITS = 2
+
+
+class CountingEnvironment(simpy.Environment):
+    """A simpy.Environment that counts the events it processes"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.events = 0
+
+    def step(self):
+        self.events += 1
+        super().step()
+
+
+def sandbox_line():
+    """The three stage line of Sandbox/production-process.py in terms of entities.Machine"""
+    def stage(name, units, low, high, failure_rate):
+        return StageSpec(
+            name = name,
+            units = units,
+            cycle_time = (low + high) / 2,
+            cycle_time_sigma = (high - low) / math.sqrt(12),
+            yield_rate = 1,
+            yield_sigma = 0,
+            batch_failure_rate = failure_rate,
+            mtbf = None,
+            mttr = None,
+            repair_std_dev = None,
+            batch_size = 1,
+            buffer_capacity = 10,
+        )
+    return LineSpec(
+        [stage("MACHINE_1", 2, 1, 2, 0.15), stage("MACHINE_2", 4, 2, 4, 0.3), stage("MACHINE_3", 2, 1, 2, 0.15)],
+        delivery_size = 1,
+        delivery_time = 0.75,
+    )
+
+
+def process_line():
+    """The strip caster line of process.py"""
+    from process import process_line
+    return process_line()
+
+
+def scaled_plant(fraction):
+    """The full plant with each stage's machines scaled from 1 up to Number-Required"""
+    specs = load_specs(target_tons=PLANT_TARGET_TONS)
+    units = {spec.item: max(1, math.ceil(spec.number_required * fraction)) for spec in specs}
+    return plant_spec(specs, units=units)
+
+
+def cases(quick=False, slow=False):
+    """Returns (name, line factory, horizon, pool units) for every benchmark case, the slow ones when asked"""
+    cases = [
+        ("process-line-year", process_line, HOURS_PER_YEAR, None),
+        ("sandbox-line-year", sandbox_line, HOURS_PER_YEAR, None),
+    ]
+    if not quick:
+        cases.append(("plant-week", lambda: scaled_plant(1.0), 168, None))
+        cases.append(("plant-week-pooled", lambda: scaled_plant(1.0), 168, POOL_UNITS))
+        for fraction in SCALING_FRACTIONS:
+            cases.append((f'plant-scaling-{fraction:g}-day', lambda fraction=fraction: scaled_plant(fraction), 24, None))
+            cases.append((
+                f'plant-scaling-{fraction:g}-day-pooled',
+                lambda fraction=fraction: scaled_plant(fraction),
+                24,
+                POOL_UNITS,
+            ))
+    if slow:
+        # the default plant over the horizon the optimizer and the adaptive runs simulate
+        cases.append(("plant-year", plant_spec, HOURS_PER_YEAR, None))
+        cases.append(("plant-year-pooled", plant_spec, HOURS_PER_YEAR, POOL_UNITS))
+    return cases
+
+
+def history_bytes(line):
+    """Returns the bytes held by the machine and buffer histories of a line, state changes included"""
+    total = 0
+    for machine in line.machines:
+        for times in (machine.start_times, machine.finish_times, machine.fail_times, machine.breakdown_times):
+            total += sys.getsizeof(times) + 24 * len(times)
+        # a metrics.PoolClock keeps no changes of state
+        if machine.state_clock.history:
+            total += _array_bytes(machine.state_clock.times) + _array_bytes(machine.state_clock.states)
+    for buffer in line.buffers:
+        total += _array_bytes(buffer.record.times) + _array_bytes(buffer.record.levels)
+    return total
+
+
+def _array_bytes(values):
+    """Returns the bytes of the items of an array.array"""
+    return values.buffer_info()[1] * values.itemsize
+
+
+def run_case(factory, horizon, repeat=3, pool_units=None, engine="simpy"):
+    """Runs one case repeat times for the best wall time, then under tracemalloc for memory
+
+    Returns:
+    dict: The wall time, the events processed, events per second, machines,
+    peak traced memory and the bytes held in histories
+    """
+    spec = factory()
+    wall = math.inf
+    for _ in range(repeat):
+        started = time.perf_counter()
+        # an engine.Engine counts its events itself
+        env = CountingEnvironment() if engine == "simpy" else Engine()
+        line = Line(env, spec, seed=SEED, pool_units=pool_units)
+        env.run(until=horizon)
+        wall = min(wall, time.perf_counter() - started)
+
+    tracemalloc.start()
+    env = make_environment(engine)
+    traced_line = Line(env, spec, seed=SEED, pool_units=pool_units)
+    env.run(until=horizon)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "wall": wall,
+        "events": line.env.events,
+        "events_per_second": line.env.events / wall if wall > 0 else 0.0,
+        "machines": sum(machine.units for machine in line.machines),
+        "peak_memory": peak,
+        "history_bytes": history_bytes(traced_line),
+    }
+
+
+def machine_key():
+    """Names the kind of machine the results are taken on, wall times only compare within one kind"""
+    return f'{platform.system()}-{platform.machine()}-{os.cpu_count()}cpu-python{sys.version_info[0]}.{sys.version_info[1]}'
+
+
+def compare(results, baseline, machine, tolerance=TOLERANCE):
+    """Checks results against the baseline of their engine
+
+    Parameters:
+    results (dict): The results of this run by case name
+    baseline (dict): The stored results of the engine, by machine_key and case name
+    machine (str): The machine_key of this run
+    tolerance (float): The allowed relative growth of wall time and memory
+
+    Returns:
+    list: (case, passed, message) for every case
+    """
+    verdicts = []
+    timings = baseline.get(machine, {})
+    for name, result in results.items():
+        expected = timings.get(name)
+        if expected is None:
+            # the events do not depend on the machine
+            others = [cases[name] for cases in baseline.values() if name in cases]
+            if not others:
+                verdicts.append((name, False, "no baseline, run with --update to create one"))
+                continue
+            expected = others[0]
+        problems = []
+        if result["events"] != expected["events"]:
+            problems.append(f'events {result["events"]} != {expected["events"]}, the model changed')
+        if name not in timings:
+            verdicts.append((name, not problems, "; ".join(problems) or f'events ok, no timings for {machine}'))
+            continue
+        if result["wall"] > expected["wall"] * (1 + tolerance) + WALL_SLACK:
+            problems.append(f'wall {result["wall"]:.3f}s > {expected["wall"]:.3f}s +{tolerance:.0%} +{WALL_SLACK:g}s')
+        if result["peak_memory"] > expected["peak_memory"] * (1 + tolerance):
+            problems.append(f'peak memory {result["peak_memory"]} > {expected["peak_memory"]} +{tolerance:.0%}')
+        verdicts.append((name, not problems, "; ".join(problems) or "ok"))
+    return verdicts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the production line simulation")
+    parser.add_argument("--update", action="store_true", help="store the results as the new baseline")
+    parser.add_argument("--quick", action="store_true", help="skip the full plant cases")
+    parser.add_argument("--slow", action="store_true", help="add the plant-year cases")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="the baseline file")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="allowed relative slowdown")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case, the fastest one counts")
+    parser.add_argument("--engine", choices=("simpy", "heap"), default="simpy", help="the event engine")
+    parser.add_argument("--machine", default=machine_key(), help="the kind of machine the timings belong to")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, factory, horizon, pool_units in cases(args.quick, args.slow):
+        result = run_case(factory, horizon, args.repeat, pool_units, args.engine)
+        results[name] = result
+        print(
+            f'{name:28s} {result["machines"]:5d} machines {result["wall"]:8.3f}s '
+            f'{result["events"]:10d} events {result["events_per_second"]:10.0f} ev/s '
+            f'peak {result["peak_memory"] / 1e6:8.1f} MB histories {result["history_bytes"] / 1e6:8.1f} MB'
+        )
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    if args.update:
+        baseline.setdefault(args.engine, {}).setdefault(args.machine, {}).update(results)
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+        print(f'baseline of {args.engine} on {args.machine} written to {args.baseline}')
+        return 0
+    if not baseline:
+        print(f'FAIL no baseline at {args.baseline}, run with --update to create one')
+        return 1
+    failed = False
+    for name, passed, message in compare(results, baseline.get(args.engine, {}), args.machine, args.tolerance):
+        print(f'{"PASS" if passed else "FAIL"} {name}: {message}')
+        failed = failed or not passed
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
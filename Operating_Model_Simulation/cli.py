@@ -0,0 +1,371 @@
+"""Command line entry point of the simulation
+
+Usage, from this directory:
+    python -m cli run [--config plant.toml] [--scenario name] [--horizon 168] [--trace] [--plot levels.png] [--animate plant.gif] [--pool 50] [--engine heap] [--precision 0.02]
+    python -m cli replicate [--config plant.toml] [--replications 20] [--warmup 24] [--snapshots 8] [--export events/] [--pool 50] [--engine heap] [--summary]
+    python -m cli sweep [--config plant.toml] [--store sweep.sqlite]
+    python -m cli report [--store sweep.sqlite] [--csv report.csv] [--plot report.png]
+
+The optional config file is JSON, or TOML when it ends in .toml:
+    line = "plant"                  # "plant" for the whole spec sheet, "process" for the strip caster line
+    horizon = 168                   # hours per replication
+    seed = 0
+    replications = 10
+    pool = 50                       # run and replicate stages of at least 50 units as one machine pool
+    engine = "heap"                 # the event engine, "simpy" or the faster "heap" with the same results
+    precision = 0.02                # run until throughput is known to 2%, see runlength.run_adaptive
+    max_horizon = 87600             # the longest such a run may go, in hours
+    interval = 24                   # the hours between its observations
+    specs = "Machine_Specs.csv"     # the estimates workbook by default, or a csv export of it
+    target_tons = 20000             # the workbook's Number-Required column, 2000 by default
+    [plant]                         # passed to plant.plant_spec
+    units = {"Jet-Mill" = 3}
+    calendar_shifts = 2             # work one or two shifts instead of 24/7, with their MTBF and maintenance
+    [scenarios.three-mills]         # named scenarios, see sweep.apply_scenario
+    "units:Jet-Mill" = 3
+    [sweep]                         # the grid of sweep.grid
+    "units:Jet-Mill" = [2, 3, 4]
+
+Command line options override the file. Modules are imported by the
+command that needs them, and plotting libraries only when a plot or an
+animation is asked for, so a headless run starts in a fraction of a second.
+"""
+import argparse
+import json
+import os
+import sys
+
+DEFAULTS = {
+    "line": "plant",
+    "horizon": 168,
+    "seed": 0,
+    "replications": 10,
+    "workers": None,
+    "confidence": 0.95,
+    "warmup": 0,
+    "snapshots": None,
+    "store": "sweep.sqlite",
+    "pool": None,
+    "engine": "simpy",
+    "precision": None,
+    "max_horizon": 87600,
+    "interval": 24,
+}
+# the characters of a sweep.line_key a report names a line by
+LINE_KEY_CHARACTERS = 8
+
+
+def load_config(path=None):
+    """Reads a JSON or TOML config file over the defaults, the defaults alone when path is None"""
+    config = dict(DEFAULTS)
+    if path is None:
+        return config
+    if path.endswith(".toml"):
+        import tomllib
+        with open(path, "rb") as config_file:
+            config.update(tomllib.load(config_file))
+    else:
+        with open(path) as config_file:
+            config.update(json.load(config_file))
+    return config
+
+
+def build_spec(config, scenario=None):
+    """Builds the line.LineSpec a config describes, with a named scenario applied"""
+    specs = None
+    if "specs" in config or "target_tons" in config:
+        from specs import DEFAULT_TARGET_TONS, WORKBOOK_PATH, load_specs
+        specs = load_specs(config.get("specs", WORKBOOK_PATH), config.get("target_tons", DEFAULT_TARGET_TONS))
+    if config["line"] == "process":
+        from process import process_line
+        spec = process_line(specs)
+    elif config["line"] == "plant":
+        from plant import plant_spec
+        options = dict(config.get("plant", {}))
+        options["specs"] = specs
+        shifts = options.pop("calendar_shifts", None)
+        if shifts is not None:
+            from shifts import shift_calendar
+            options["calendar"] = shift_calendar(shifts)
+            # the MTBF and maintenance columns of the sheet must be those of the shifts worked
+            options.setdefault("shifts", shifts)
+        spec = plant_spec(**options)
+    else:
+        raise ValueError(f'unknown line {config["line"]!r}, expected "plant" or "process"')
+    if scenario is not None:
+        from sweep import apply_scenario
+        scenarios = config.get("scenarios", {})
+        if scenario not in scenarios:
+            raise ValueError(f'no scenario {scenario!r} in the config')
+        spec = apply_scenario(spec, scenarios[scenario])
+    return spec
+
+
+def _settings(args):
+    """Merges the command line options over the config file"""
+    config = load_config(args.config)
+    for key in DEFAULTS:
+        value = getattr(args, key, None)
+        if value is not None:
+            config[key] = value
+    return config
+
+
+def _print_buffers(levels):
+    """Prints one row per buffer from (name, mean level, final level) rows"""
+    print(f'{"buffer":40s} {"mean level":>24s} {"final level":>24s}')
+    for name, mean_level, final_level in levels:
+        print(f'{name:40s} {mean_level:>24s} {final_level:>24s}')
+
+
+def _plot_levels(line, path):
+    """Plots the level history of every buffer of a line into an image file"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    figure, axes = plt.subplots(figsize=(10, 5))
+    for buffer in line.buffers:
+        times, levels = buffer.record.to_numpy()
+        axes.step(times, levels, where="post", label=buffer.name)
+    axes.set_xlabel("hours")
+    axes.set_ylabel("lbs")
+    axes.legend(fontsize="x-small")
+    figure.savefig(path)
+    plt.close(figure)
+
+
+def run(args):
+    """Runs one replication and prints the stage metrics and buffer levels
+
+    With a precision the run picks its own length, see runlength.run_adaptive,
+    and also reports the warm-up it deleted and why it stopped
+    """
+    from engine import make_environment
+    from line import Line
+    from metrics import line_metrics, bottleneck
+    config = _settings(args)
+    if args.animate and config["pool"] is not None:
+        raise ValueError("--animate does not combine with --pool, a machine pool keeps no states per machine")
+    spec = build_spec(config, args.scenario)
+    history = bool(args.plot or args.animate)
+    event_log = None
+    if args.trace:
+        from eventlog import EventLog
+        event_log = EventLog()
+    run_length = None
+    if config["precision"] is not None:
+        from runlength import run_adaptive
+        run_length = run_adaptive(
+            spec, config["precision"], seed=config["seed"], interval=config["interval"],
+            max_horizon=config["max_horizon"], confidence=config["confidence"], levels=args.levels,
+            pool_units=config["pool"], engine=config["engine"], event_log=event_log, history=history)
+        line = run_length.line
+        horizon = run_length.horizon
+    else:
+        env = make_environment(config["engine"])
+        line = Line(env, spec, seed=config["seed"], event_log=event_log, history=history, pool_units=config["pool"])
+        horizon = config["horizon"]
+        env.run(until=horizon)
+    if event_log is not None:
+        from eventlog import print_events
+        print_events(event_log.events(), event_log.sources)
+    print(f'{"stage":40s} {"units":>6s} {"finished":>16s} {"utilization":>12s} {"oee":>8s}')
+    stages = line_metrics(line, horizon)
+    for machines in line.stages:
+        if not machines:
+            continue
+        name = machines[0].type
+        metrics = stages[name]
+        finished = sum(machine.number_finished for machine in machines)
+        print(f'{name:40s} {metrics["units"]:6d} {finished:16,.0f} {metrics["utilization"]:12.1%} {metrics["oee"]:8.1%}')
+    _print_buffers(
+        (buffer.name, f'{buffer.record.mean(horizon):,.0f}', f'{buffer.level:,.0f}') for buffer in line.buffers)
+    if line.stages:
+        print(f'bottleneck: {bottleneck(line, horizon)}')
+    if run_length is not None:
+        print(run_length.report())
+    if args.plot:
+        _plot_levels(line, args.plot)
+    if args.animate:
+        from animate import animate
+        animate(line, args.animate)
+    return 0
+
+
+def _print_summary(summary):
+    def cell(value):
+        return f'{value.mean:,.0f} +/- {value.half_width:,.0f}'
+    _print_buffers(
+        (name, cell(values["mean_level"]), cell(values["final_level"]))
+        for name, values in summary["buffers"].items())
+    # the End-Buffer only fills, its change over the statistics window is the output after any warm-up
+    print(f'finished: {cell(summary["buffers"]["End-Buffer"]["net_change"])}')
+    if all("level" in values for values in summary["buffers"].values()):
+        print(f'{"buffer level over all replications":40s} {"p10":>16s} {"p50":>16s} {"p90":>16s}')
+        for name, values in summary["buffers"].items():
+            p10, p50, p90 = values["level"].quantiles((0.1, 0.5, 0.9))
+            print(f'{name:40s} {p10:16,.0f} {p50:16,.0f} {p90:16,.0f}')
+
+
+def replicate(args):
+    """Runs independent replications, or replications branched from one warm-up, and prints the summary"""
+    config = _settings(args)
+    spec = build_spec(config, args.scenario)
+    if config["warmup"]:
+        if args.export:
+            raise ValueError("--export does not combine with a warm-up")
+        from warmstart import fork_replications
+        summary = fork_replications(
+            spec, config["warmup"], config["horizon"], config["replications"],
+            seed=config["seed"], workers=config["workers"], confidence=config["confidence"],
+            pool_units=config["pool"], engine=config["engine"], summary=args.summary, snapshots=config["snapshots"])
+    else:
+        from replication import replicate as run_replications
+        summary = run_replications(
+            spec, config["horizon"], config["replications"], seed=config["seed"],
+            workers=config["workers"], confidence=config["confidence"], export_directory=args.export,
+            pool_units=config["pool"], engine=config["engine"], summary=args.summary)
+    _print_summary(summary)
+    return 0
+
+
+def sweep(args):
+    """Runs the sweep grid of the config, or its named scenarios, into the store"""
+    from sweep import grid, sweep as run_sweep
+    config = _settings(args)
+    spec = build_spec(config)
+    if "sweep" in config:
+        scenarios = grid(**config["sweep"])
+    else:
+        scenarios = list(config.get("scenarios", {}).values()) or [{}]
+    results = run_sweep(
+        spec, scenarios, config["horizon"], replications=config["replications"], seed=config["seed"],
+        store_path=config["store"], workers=config["workers"], confidence=config["confidence"])
+    for scenario, summary in results:
+        finished = _finished(summary)
+        print(f'{json.dumps(scenario, sort_keys=True)}: {finished.mean:,.0f} +/- {finished.half_width:,.0f} finished')
+    return 0
+
+
+def _finished(summary):
+    """The End-Buffer's net change of a summary, its final level for stores written before net_change
+    was kept, which is the same for runs from an empty line"""
+    values = summary["buffers"]["End-Buffer"]
+    return values["net_change"] if "net_change" in values else values["final_level"]
+
+
+def report(args):
+    """Summarizes every scenario of every line in a sweep store, optionally into a CSV file and a plot
+
+    Results are grouped by the line they ran on as well as the scenario
+    and horizon, so the same scenario applied to two base lines is reported
+    twice. A line is named by the first characters of its sweep.line_key,
+    results stored before lines were recorded show as unknown
+    """
+    import sqlite3
+    from replication import summarize
+    config = _settings(args)
+    if not os.path.exists(config["store"]):
+        print(f'no sweep store at {config["store"]}')
+        return 1
+    connection = sqlite3.connect(config["store"])
+    try:
+        groups = {}
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(results)")]
+        line_column = "line" if "line" in columns else "NULL"
+        query = f'SELECT {line_column}, scenario, horizon, result FROM results'
+        for line, scenario, horizon, result in connection.execute(query):
+            groups.setdefault((line or "unknown", scenario, horizon), []).append(json.loads(result))
+    finally:
+        connection.close()
+    rows = []
+    for (line, scenario, horizon), results in sorted(groups.items()):
+        finished = _finished(summarize(results, config["confidence"]))
+        line = line[:LINE_KEY_CHARACTERS]
+        rows.append((line, scenario, horizon, finished.n, finished.mean, finished.half_width))
+        print(
+            f'line {line} {scenario} horizon {horizon:g}: {finished.mean:,.0f} +/- {finished.half_width:,.0f}'
+            f' finished, n={finished.n}')
+    if args.csv:
+        import csv
+        with open(args.csv, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(["line", "scenario", "horizon", "replications", "finished_mean", "finished_half_width"])
+            writer.writerows(rows)
+    if args.plot:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+        figure, axes = plt.subplots(figsize=(10, max(3, len(rows) * 0.4)))
+        labels = [f'{line} {scenario} ({horizon:g} h)' for line, scenario, horizon, *_ in rows]
+        axes.barh(labels, [row[4] for row in rows], xerr=[row[5] for row in rows])
+        axes.set_xlabel("finished lbs")
+        figure.tight_layout()
+        figure.savefig(args.plot)
+        plt.close(figure)
+    return 0
+
+
+def parser():
+    """Builds the argument parser of every subcommand"""
+    main_parser = argparse.ArgumentParser(prog="python -m cli", description="Simulate the production line")
+    commands = main_parser.add_subparsers(dest="command", required=True)
+
+    def add(name, function, help):
+        command = commands.add_parser(name, help=help)
+        command.set_defaults(function=function)
+        command.add_argument("--config", help="a JSON or TOML config file")
+        command.add_argument("--seed", type=int, help="the base seed")
+        command.add_argument("--horizon", type=float, help="the hours to simulate")
+        return command
+
+    command = add("run", run, "run one replication")
+    command.add_argument("--scenario", help="a named scenario of the config")
+    command.add_argument("--trace", action="store_true", help="print every event")
+    command.add_argument("--plot", help="plot the buffer levels into this image file")
+    command.add_argument("--animate", help="animate the line into this GIF or video file")
+    command.add_argument("--pool", type=int, help="run stages of at least this many units as one machine pool")
+    command.add_argument("--engine", choices=("simpy", "heap"), help="the event engine, heap gives the same results faster")
+    command.add_argument(
+        "--precision", type=float,
+        help="instead of the horizon, run until the throughput half width is this fraction of the mean")
+    command.add_argument("--max-horizon", type=float, help="the longest a run with a precision may go")
+    command.add_argument("--interval", type=float, help="the hours between the observations of a run with a precision")
+    command.add_argument(
+        "--levels", action="store_true", help="with a precision, also wait for every buffer level to settle")
+
+    command = add("replicate", replicate, "run replications and summarize them")
+    command.add_argument("--scenario", help="a named scenario of the config")
+    command.add_argument("--replications", type=int, help="the number of replications")
+    command.add_argument("--workers", type=int, help="the worker processes, every core by default")
+    command.add_argument("--confidence", type=float, help="the confidence level of the intervals")
+    command.add_argument("--warmup", type=float, help="simulate this long and branch the replications from it")
+    command.add_argument(
+        "--snapshots", type=int, help="the independent warm-ups the replications branch from, 8 by default")
+    command.add_argument("--export", help="stream the events of every replication into this directory")
+    command.add_argument(
+        "--summary", action="store_true", help="keep streaming statistics instead of histories, in bounded memory")
+    command.add_argument("--pool", type=int, help="run stages of at least this many units as one machine pool")
+    command.add_argument("--engine", choices=("simpy", "heap"), help="the event engine, heap gives the same results faster")
+
+    command = add("sweep", sweep, "run the scenarios of the config into a sweep store")
+    command.add_argument("--replications", type=int, help="the replications per scenario")
+    command.add_argument("--workers", type=int, help="the worker processes, every core by default")
+    command.add_argument("--confidence", type=float, help="the confidence level of the intervals")
+    command.add_argument("--store", help="the SQLite sweep store")
+
+    command = add("report", report, "summarize the scenarios in a sweep store")
+    command.add_argument("--confidence", type=float, help="the confidence level of the intervals")
+    command.add_argument("--store", help="the SQLite sweep store")
+    command.add_argument("--csv", help="write the summary to this CSV file")
+    command.add_argument("--plot", help="plot the summary into this image file")
+    return main_parser
+
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    return args.function(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
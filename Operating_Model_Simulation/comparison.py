@@ -0,0 +1,169 @@
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from replication import replication_seeds, run_replication
+from stats import estimate, t_quantile
+
+# Two scenarios run on the same replication seeds draw the same variates in
+# the same machine roles, see rng.VariateStream, so their outputs move
+# together and the variance of their difference shrinks by twice their
+# covariance. Antithetic pairs add a run on the mirrored variates of each
+# seed and average the two, which cancels part of the noise of each scenario.
+
+
+def throughput(results):
+    """The finished goods of a replication over its statistics window, the default metric of a comparison"""
+    return results["buffers"]["End-Buffer"]["net_change"]
+
+
+def _variance(values):
+    """Returns the sample variance of a list of values"""
+    mean = math.fsum(values) / len(values)
+    return math.fsum((value - mean) ** 2 for value in values) / (len(values) - 1)
+
+
+class Comparison(object):
+    """The paired comparison of a metric between two scenarios
+
+    Attributes:
+        names                   The names of the two scenarios
+        a                       The stats.Estimate of the metric of the first scenario
+        b                       The stats.Estimate of the metric of the second scenario
+        difference              The stats.Estimate of a - b over paired replications
+        independent_half_width  The half width the difference would have from independent seeds
+        variance_reduction      The share of the variance of the difference removed by common random numbers,
+                                None when neither scenario varies
+        antithetic_reduction    The share of the variance of each scenario removed by antithetic pairs, None without
+        replications            The replications of each scenario, antithetic pairs count once
+    """
+
+    def __init__(self, names, a, b, difference, independent_half_width, variance_reduction,
+                 antithetic_reduction, replications):
+        self.names = names
+        self.a = a
+        self.b = b
+        self.difference = difference
+        self.independent_half_width = independent_half_width
+        self.variance_reduction = variance_reduction
+        self.antithetic_reduction = antithetic_reduction
+        self.replications = replications
+
+    @property
+    def replication_ratio(self):
+        """How many times the replications independent seeds would need for the same half width,
+        None when the difference does not vary and no number of replications would match it"""
+        if self.variance_reduction is None or self.variance_reduction >= 1:
+            return None
+        return 1 / (1 - self.variance_reduction)
+
+    @property
+    def significant(self):
+        """Whether the confidence interval of the difference excludes zero"""
+        return self.difference.low > 0 or self.difference.high < 0
+
+    def report(self):
+        """Returns the comparison as printable lines of text"""
+        first, second = self.names
+        if self.variance_reduction is None:
+            reduction = "neither scenario varies, a variance reduction is not applicable"
+        elif self.replication_ratio is None:
+            reduction = (
+                f'variance reduced {self.variance_reduction:.1%}, the difference does not vary so a'
+                f' replication ratio is not applicable')
+        else:
+            reduction = (
+                f'variance reduced {self.variance_reduction:.1%}, worth {self.replication_ratio:.1f}x'
+                f' the replications')
+        lines = [
+            f'{first}: {self.a.mean:,.1f} +/- {self.a.half_width:,.1f}',
+            f'{second}: {self.b.mean:,.1f} +/- {self.b.half_width:,.1f}',
+            f'{first} - {second}: {self.difference.mean:,.1f} +/- {self.difference.half_width:,.1f}'
+            f' ({self.difference.confidence:.0%} confidence, {self.replications} replications,'
+            f' {"significant" if self.significant else "not significant"})',
+            f'common random numbers: half width {self.difference.half_width:,.1f} against'
+            f' {self.independent_half_width:,.1f} with independent seeds, {reduction}',
+        ]
+        if self.antithetic_reduction is not None:
+            for name, reduction in zip(self.names, self.antithetic_reduction):
+                lines.append(f'antithetic pairs: variance of {name} reduced {reduction:.1%}')
+        return "\n".join(lines)
+
+
+def _run_task(args):
+    """Runs one replication in a worker process"""
+    spec, horizon, seed, antithetic = args
+    return run_replication(spec, horizon, seed, history=False, antithetic=antithetic)
+
+
+def compare_scenarios(
+        spec_a,
+        spec_b,
+        horizon,
+        replications,
+        seed=0,
+        metric=throughput,
+        antithetic=False,
+        names=("a", "b"),
+        workers=None,
+        confidence=0.95,
+        ):
+    """Compares a metric between two lines with common random numbers
+
+    Parameters:
+    spec_a (line.LineSpec): The first scenario
+    spec_b (line.LineSpec): The second scenario, e.g. sweep.apply_scenario of the first
+    horizon (float): The time each replication runs until
+    replications (int): The replications of each scenario, at least 2
+    seed (int): The base seed, both scenarios see the same replication seeds
+    metric (function): Turns the results of a replication into the number compared
+    antithetic (bool): Whether each replication is an antithetic pair of runs
+    names (tuple): The names of the two scenarios in the report
+    workers (int): The number of worker processes, every core when None
+    confidence (float): The confidence level of the intervals
+
+    Returns:
+    Comparison: The estimates of both scenarios, their difference and the variance reductions
+    """
+    if replications < 2:
+        raise ValueError("a comparison needs at least two replications")
+    seeds = replication_seeds(seed, replications)
+    mirrors = (False, True) if antithetic else (False,)
+    tasks = [
+        (spec, horizon, replication_seed, mirrored)
+        for spec in (spec_a, spec_b)
+        for replication_seed in seeds
+        for mirrored in mirrors
+    ]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        results = [_run_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_run_task, tasks, chunksize=max(1, len(tasks) // (workers * 4))))
+    values = [metric(result) for result in results]
+    runs = len(mirrors)
+    half = replications * runs
+    observations = []
+    antithetic_reduction = [] if antithetic else None
+    for scenario in (values[:half], values[half:]):
+        # an antithetic pair is one observation, the mean of its two runs
+        paired = [math.fsum(scenario[i:i + runs]) / runs for i in range(0, half, runs)]
+        observations.append(paired)
+        if antithetic:
+            single = _variance(scenario)
+            antithetic_reduction.append(1 - _variance(paired) / (single / 2) if single > 0 else 0.0)
+
+    a, b = observations
+    difference = estimate([x - y for x, y in zip(a, b)], confidence)
+    independent = _variance(a) + _variance(b)
+    factor = t_quantile(0.5 + confidence / 2, replications - 1) / math.sqrt(replications)
+    return Comparison(
+        names,
+        estimate(a, confidence),
+        estimate(b, confidence),
+        difference,
+        factor * math.sqrt(independent),
+        1 - difference.std ** 2 / independent if independent > 0 else None,
+        antithetic_reduction,
+        replications,
+    )
@@ -0,0 +1,328 @@
+from collections import deque
+from heapq import heappush, heappop
+from itertools import count
+import simpy
+from recorder import LevelRecorder
+from eventlog import TRACE, LEVEL
+
+# A scheduler for the entities.Machine, entities.MachinePool and buffer model
+# that does only what the model asks of SimPy. The heap holds plain tuples
+# of (time, priority, event id, target). A timeout made by a running process
+# is such a tuple that resumes the process directly, with no event object,
+# and buffer requests wait in typed deques. Every entry gets its event id
+# at the same point SimPy would give one, and same time entries run in the
+# same order, so a line on the same seed gives the same results and the
+# same event count on either engine.
+
+ENGINES = ("simpy", "heap")
+
+# the priorities of simpy.events
+URGENT = 0
+NORMAL = 1
+
+
+def make_environment(engine="simpy"):
+    """Returns a new environment of the named engine
+
+    Parameters:
+    engine (str): "simpy" for a simpy.Environment, "heap" for an Engine
+
+    Returns:
+    simpy.Environment or Engine: The environment to build a line.Line in
+    """
+    if engine == "simpy":
+        return simpy.Environment()
+    if engine == "heap":
+        return Engine()
+    raise ValueError(f'unknown engine {engine!r}, expected one of {", ".join(ENGINES)}')
+
+
+class Timeout(object):
+    """A timeout made outside of any process, which callbacks can wait on
+
+    Attributes:
+        callbacks   The functions called with the timeout when it is due, None once it was
+    """
+
+    __slots__ = ("callbacks",)
+
+    triggered = True
+
+    def __init__(self):
+        self.callbacks = []
+
+
+class Process(object):
+    """A generator the engine runs
+
+    Attributes:
+        env         The Engine running the process
+        alive       Whether the generator has not returned yet
+    """
+
+    __slots__ = ("env", "alive", "_generator", "_target")
+
+    def __init__(self, env, generator):
+        self.env = env
+        self.alive = True
+        self._generator = generator
+        # the event id of the timeout the process sleeps on, or the request it waits for
+        self._target = None
+
+    def interrupt(self, cause=None):
+        """Throws a simpy.Interrupt with cause into the process as soon as possible"""
+        if not self.alive:
+            raise RuntimeError(f'{self} has terminated and cannot be interrupted.')
+        if self is self.env.active_process:
+            raise RuntimeError('A process is not allowed to interrupt itself.')
+        self.env._push(self.env.now, URGENT, _Interruption(self, cause))
+
+    def _resume(self, interrupt=None):
+        """Runs the generator until it waits again"""
+        env = self.env
+        env.active_process = self
+        try:
+            if interrupt is None:
+                target = self._generator.send(None)
+            else:
+                target = self._generator.throw(interrupt)
+        except StopIteration:
+            # a finished process is an event in SimPy, it takes an event id all the same
+            self.alive = False
+            next(env._eids)
+            target = None
+        finally:
+            env.active_process = None
+        if type(target) is Request:
+            target.waiter = self
+        self._target = target
+
+
+class _Interruption(object):
+    """An interrupt on its way to a process"""
+
+    __slots__ = ("process", "cause")
+
+    def __init__(self, process, cause):
+        self.process = process
+        self.cause = cause
+
+
+class Request(object):
+    """A get or put of an amount at a Buffer
+
+    Attributes:
+        buffer      The Buffer asked
+        amount      The amount to get or put
+        put         Whether the request is a put
+        triggered   Whether the buffer granted the request
+        waiter      The Process waiting for the grant, None for none
+        callbacks   The functions called with the request once the grant is processed
+    """
+
+    __slots__ = ("buffer", "amount", "put", "triggered", "waiter", "callbacks")
+
+    def __init__(self, buffer, amount, put):
+        if amount <= 0:
+            raise ValueError(f'amount(={amount}) must be > 0.')
+        self.buffer = buffer
+        self.amount = amount
+        self.put = put
+        self.triggered = False
+        self.waiter = None
+        self.callbacks = []
+
+    def cancel(self):
+        """Withdraws the request unless it was already granted"""
+        if not self.triggered:
+            queue = self.buffer.put_queue if self.put else self.buffer.get_queue
+            queue.remove(self)
+
+
+class Buffer(object):
+    """The entities.Buffer of an Engine, a container of an amount of material
+    Requests wait in two deques and are granted oldest first, and a request
+    that does not fit holds back the ones behind it, as in simpy.Container
+
+    Attributes:
+        env         The Engine
+        name        The name given to the buffer
+        capacity    The most the buffer holds
+        level       The amount in the buffer
+        put_queue   The puts waiting for room, oldest first
+        get_queue   The gets waiting for material, oldest first
+        record      The recorder.LevelRecorder holding the level history and statistics
+        trace_log   The eventlog.EventLog receiving every level change, None when not tracing
+        log_id      The source id of the buffer in the event log
+    """
+
+    def __init__(self, env, capacity=float('inf'), init=0, name=None, history=True, event_log=None, statistics=False):
+        if capacity <= 0:
+            raise ValueError('"capacity" must be > 0.')
+        if init < 0:
+            raise ValueError('"init" must be >= 0.')
+        if init > capacity:
+            raise ValueError('"init" must be <= "capacity".')
+        self.env = env
+        self.name = name
+        self.capacity = capacity
+        self.level = init
+        self.put_queue = deque()
+        self.get_queue = deque()
+        self.record = LevelRecorder(env.now, init, capacity, history, statistics)
+        self.log_id = event_log.register(name) if event_log is not None else None
+        self.trace_log = event_log if event_log is not None and event_log.enabled(TRACE) else None
+
+    def put(self, amount):
+        """Asks to put amount into the buffer and returns the Request"""
+        request = Request(self, amount, True)
+        self.put_queue.append(request)
+        self._trigger_put()
+        return request
+
+    def get(self, amount):
+        """Asks to take amount out of the buffer and returns the Request"""
+        request = Request(self, amount, False)
+        self.get_queue.append(request)
+        self._trigger_get()
+        return request
+
+    def _grant(self, request):
+        """Records the new level and schedules the granted request"""
+        env = self.env
+        request.triggered = True
+        self.record.update(env.now, self.level)
+        if self.trace_log is not None:
+            self.trace_log.record(env.now, self.log_id, LEVEL, self.level)
+        env._push(env.now, NORMAL, request)
+
+    def _trigger_put(self):
+        """Grants the waiting puts in order while there is room for them"""
+        queue = self.put_queue
+        while queue and self.capacity - self.level >= queue[0].amount:
+            request = queue.popleft()
+            self.level += request.amount
+            self._grant(request)
+
+    def _trigger_get(self):
+        """Grants the waiting gets in order while there is material for them"""
+        queue = self.get_queue
+        while queue and self.level >= queue[0].amount:
+            request = queue.popleft()
+            self.level -= request.amount
+            self._grant(request)
+
+
+class Engine(object):
+    """A heapq scheduler standing in for simpy.Environment under a line.Line
+
+    It runs generators that yield the timeouts they make and the requests
+    of their buffers, takes simpy.Interrupt as the interrupt of a process
+    and builds the line's buffers as engine Buffers. A process must yield
+    a timeout right after making it, as every process of the model does
+
+    Attributes:
+        now             The current simulation time
+        active_process  The Process running, None between processes
+        events          The number of events processed so far
+        buffer_type     The class line.Line builds its buffers from
+    """
+
+    buffer_type = Buffer
+
+    def __init__(self, initial_time=0):
+        self.now = initial_time
+        self.active_process = None
+        self.events = 0
+        self._queue = []
+        self._eids = count()
+
+    def _push(self, time, priority, target):
+        """Schedules a target at time with the next event id"""
+        heappush(self._queue, (time, priority, next(self._eids), target))
+
+    def process(self, generator):
+        """Starts running a generator at the current time and returns its Process"""
+        process = Process(self, generator)
+        eid = next(self._eids)
+        heappush(self._queue, (self.now, URGENT, eid, process))
+        process._target = eid
+        return process
+
+    def timeout(self, delay, value=None):
+        """Schedules a wake up after delay
+
+        Returns:
+        int or Timeout: The event id the running process sleeps on, or a
+        Timeout for callbacks outside of a process
+        """
+        if delay < 0:
+            raise ValueError(f'Negative delay {delay}')
+        eid = next(self._eids)
+        process = self.active_process
+        if process is not None:
+            heappush(self._queue, (self.now + delay, NORMAL, eid, process))
+            return eid
+        timeout = Timeout()
+        heappush(self._queue, (self.now + delay, NORMAL, eid, timeout))
+        return timeout
+
+    def run(self, until=None):
+        """Processes events until the time until, or until none are left when None"""
+        stop = None
+        if until is not None:
+            at = until if isinstance(until, int) else float(until)
+            if at <= self.now:
+                raise ValueError(f'until ({at}) must be greater than the current simulation time')
+            # like SimPy's until event, before every other event due then
+            stop = object()
+            self._push(self.now + (at - self.now), URGENT, stop)
+        queue = self._queue
+        events = self.events
+        try:
+            while queue:
+                self.now, _, eid, target = heappop(queue)
+                events += 1
+                kind = type(target)
+                if kind is Process:
+                    # a stale wake up of a process that was interrupted meanwhile does nothing
+                    if target._target == eid:
+                        target._resume()
+                elif kind is Request:
+                    if target.put:
+                        target.buffer._trigger_get()
+                    else:
+                        target.buffer._trigger_put()
+                    callbacks, target.callbacks = target.callbacks, None
+                    for callback in callbacks:
+                        callback(target)
+                    process = target.waiter
+                    if process is not None:
+                        target.waiter = None
+                        process._resume()
+                elif kind is Timeout:
+                    callbacks, target.callbacks = target.callbacks, None
+                    for callback in callbacks:
+                        callback(target)
+                elif target is stop:
+                    # SimPy puts its stopped until event back ahead of everything, the next run processes it
+                    self._push(self.now, -1, Timeout())
+                    return None
+                else:
+                    self._interrupt(target)
+        finally:
+            self.events = events
+        if stop is not None:
+            raise RuntimeError(f'No scheduled events left but "until" event was not triggered: {until}')
+        return None
+
+    def _interrupt(self, interruption):
+        """Throws an interrupt into its process unless the process already finished"""
+        process = interruption.process
+        if not process.alive:
+            return
+        target = process._target
+        if type(target) is Request:
+            target.waiter = None
+        process._target = None
+        process._resume(simpy.Interrupt(interruption.cause))
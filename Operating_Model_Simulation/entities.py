@@ -1,132 +1,751 @@
-import simpy
-import random
-
-class Buffer(simpy.Container):
-    """Extends simpy.Store to log number of items at each time step
-    
-    Attributes:
-        env         A simpy.Environment
-        record      The dictionary that stores the number of items at each time step
-    """
-
-    def __init__(self, env, *args, **kwargs):
-        """Initiates the buffer
-        
-        Parameters:
-        env (simpy.Environment): An environment simpy object
-
-        Returns:
-        None
-        """
-        super().__init__(env, *args, **kwargs)
-        self.record = {}
-        self.env = env
-    
-    def put(self, *args, **kwargs):
-        """Adds an item to the buffer and records the new state"""
-        result = super().put(*args, **kwargs)
-        self.record[self.env.now] = self.level
-        return result
-    
-    def get(self, *args, **kwargs):
-        """Removes an item from the buffer and records the new state"""
-        result = super().get(*args, **kwargs)
-        self.record[self.env.now] = self.level
-        return result
-
-class Machine(object):
-    """Takes resources from a buffer and performs a process
-    The machine records the times at which a process starts and completes
-    The time for the process to complete is normally distributed
-    The machine can output good or defective parts distributed binomially
-    The machine can output good or defective batches distributed binomially
-    The machine can itself fail and cease processing using a exponential distribution
-    The machine will repair itself with the repair time distributed log-normally 
-
-    Attributes:
-        env                 The simpy environment in which the machine operates
-        name                The unique name given to the machine
-        type                The type of machine (jet-mill, etc)
-        in_buffer           The buffer from which the machine retrieves items
-        out_buffer          The buffer to which the machine outputs items
-        mean                The average time to complete the process
-        std_dev             The standard deviation from the mean for the process
-        failure_rate        The rate at which individual parts fail
-        batch_failure_rate  The rate at which batches fail
-        number_finished     The total number of items completed in the run
-        start_times         The times at which the machine started an item
-        finish_times        The times at which the machine finished an item
-        fail_times          The times at which the machine failed
-        process             The process to run in the environment
-        mtbf                The lambda parameter for the Poisson distribution
-        mttr                The mean time to repair distributed log-normally
-        repair_std_dev      The standard deviation time for repairs
-    """
-
-    def __init__(
-            self, 
-            env, 
-            name, 
-            item_type, 
-            in_buffer, 
-            out_buffer, 
-            cycle_time, 
-            cycle_time_sigma, 
-            yield_rate,
-            yield_sigma,
-            batch_failure_rate,
-            mtbf,
-            mttr,
-            repair_std_dev,
-            batch_size,
-            ):
-        
-        self.env = env
-        self.name = name
-        self.type = item_type
-        self.in_buffer = in_buffer
-        self.out_buffer = out_buffer
-        self.cycle_time = cycle_time
-        self.cycle_time_sigma = cycle_time_sigma
-        self.yield_rate = yield_rate
-        self.yield_sigma = yield_sigma
-        self.batch_failure_rate = batch_failure_rate
-        self.mtbf = mtbf
-        self.mttr = mttr
-        self.repair_std_dev = repair_std_dev
-        self.batch_size = batch_size
-        self.items_ready = 0
-        self.number_finished = 0
-        self.start_times = []
-        self.finish_times = []
-        self.fail_times = []
-        self.full = False
-        # start running the process
-        self.process = env.process(self.produce())
-
-    def produce(self):
-        """
-        Runs the process for the machine
-        """
-        while True:
-            # wait to start until you have a full batch
-            while not self.full or self.in_buffer.level < self.batch_size:
-                # if a part is available get it from the buffer
-                amount = yield self.in_buffer.get(amount = self.batch_size)
-                print(f'{self.env.now:.2f} {self.name} has got a part')
-                self.full = True
-            # add to your start times list
-            self.start_times.append(self.env.now)
-            
-            yield self.env.timeout(random.normalvariate(self.cycle_time, self.cycle_time_sigma))
-            print(f'{self.env.now:.2f} {self.name} finished a part. Next buffer has {self.out_buffer.level} and capacity of {self.out_buffer.capacity}')
-            if random.uniform(0, 1) > self.batch_failure_rate:
-                yielded_amount = random.normalvariate(self.batch_size * self.yield_rate, self.yield_sigma)
-                yield self.out_buffer.put(yielded_amount)
-                print(f'{self.env.now:.2f} {self.name} pushed a part to next buffer')
-                self.number_finished += yielded_amount
-                self.finish_times.append(self.env.now)
-            else:
-                print(f'{self.env.now:.2f} {self.name} failed')
-                self.fail_times.append(self.env.now)
-            self.full = False
+import heapq
+from collections import deque
+from itertools import count
+import simpy
+from stats import RunningStats, QuantileSketch
+from rng import NormalStream, BernoulliStream, ExponentialStream, LogNormalStream
+from recorder import LevelRecorder
+from metrics import StateClock, PoolClock, BUSY, STARVED, BLOCKED, DOWN
+from eventlog import TRACE, EVENT, GOT_BATCH, FINISHED, PUSHED, BATCH_FAILED, BROKE_DOWN, REPAIRED, LEVEL
+
+class Buffer(simpy.Container):
+    """Extends simpy.Container to log the level every time it changes
+    
+    Attributes:
+        env         A simpy.Environment
+        name        The name given to the buffer
+        record      The recorder.LevelRecorder holding the level history and statistics
+        trace_log   The eventlog.EventLog receiving every level change, None when not tracing
+        log_id      The source id of the buffer in the event log
+    """
+
+    def __init__(self, env, *args, name=None, history=True, event_log=None, statistics=False, **kwargs):
+        """Initiates the buffer
+        
+        Parameters:
+        env (simpy.Environment): An environment simpy object
+        name (str): The name given to the buffer
+        history (bool): Whether to keep the full level history or only the statistics
+        event_log (eventlog.EventLog): The log level changes are traced to, None to trace nothing
+        statistics (bool): Whether to keep a quantile sketch of the level
+
+        Returns:
+        None
+        """
+        super().__init__(env, *args, **kwargs)
+        self.record = LevelRecorder(env.now, self.level, self.capacity, history, statistics)
+        self.env = env
+        self.name = name
+        self.log_id = event_log.register(name) if event_log is not None else None
+        self.trace_log = event_log if event_log is not None and event_log.enabled(TRACE) else None
+    
+    def _do_put(self, event):
+        """Adds an amount to the buffer once there is room and records the new level"""
+        result = super()._do_put(event)
+        if result:
+            self.record.update(self.env.now, self._level)
+            if self.trace_log is not None:
+                self.trace_log.record(self.env.now, self.log_id, LEVEL, self._level)
+        return result
+    
+    def _do_get(self, event):
+        """Removes an amount from the buffer once it is available and records the new level"""
+        result = super()._do_get(event)
+        if result:
+            self.record.update(self.env.now, self._level)
+            if self.trace_log is not None:
+                self.trace_log.record(self.env.now, self.log_id, LEVEL, self._level)
+        return result
+
+class Machine(object):
+    """Takes resources from a buffer and performs a process
+    The machine records the times at which a process starts and completes
+    The time for the process to complete is normally distributed
+    The machine can output good or defective parts distributed binomially
+    The machine can output good or defective batches distributed binomially
+    The machine can itself fail and cease processing using a exponential distribution
+    The machine will repair itself with the repair time distributed log-normally 
+    A breakdown interrupts whatever the machine is doing, a batch in process
+    keeps its remaining process time and finishes after the repair
+    With a shift calendar, process times, repairs and the failure clock only
+    run during working hours
+
+    Attributes:
+        env                 The simpy environment in which the machine operates
+        name                The unique name given to the machine
+        type                The type of machine (jet-mill, etc)
+        in_buffer           The buffer from which the machine retrieves items
+        out_buffer          The buffer to which the machine outputs items
+        mean                The average time to complete the process
+        std_dev             The standard deviation from the mean for the process
+        failure_rate        The rate at which individual parts fail
+        batch_failure_rate  The rate at which batches fail
+        number_finished     The total number of items completed in the run
+        batches_good        The number of batches pushed to the out buffer
+        batches_failed      The number of batches that failed
+        breakdowns          The number of breakdowns
+        units               Always 1, a MachinePool stands for many
+        state_clock         The metrics.StateClock of time spent busy, starved, blocked, down and off shift
+        start_times         The times at which the machine started an item
+        finish_times        The times at which the machine finished an item
+        fail_times          The times at which the machine failed
+        breakdown_times     The times at which the machine broke down
+        history             Whether the start, finish, fail and breakdown times are kept
+        cycle_stats         The stats.RunningStats of process times, None when not kept
+        departure_stats     The stats.RunningStats of the times between pushes, None when not kept
+        yield_sketch        The stats.QuantileSketch of pushed amounts, None when not kept
+        last_departure      The time of the last push, None before the first
+        downtime            The total time spent under repair
+        interrupted_batches The number of batches a breakdown interrupted in process
+        broken              Whether the machine is under repair
+        process             The process to run in the environment
+        failures            The failure clock process, None when the machine never breaks down
+        mtbf                The mean time between breakdowns, 0 or None for a machine that never breaks
+        mttr                The mean time to repair distributed log-normally
+        repair_std_dev      The standard deviation time for repairs
+        seed                The seed of the run the machine's random streams derive from
+        cycle_times         The stream of process times
+        yields              The stream of yielded amounts
+        batch_failures      The stream of batch failure flags
+        times_to_failure    The stream of times between the end of a repair and the next breakdown
+        repair_times        The stream of repair times
+        calendar            The shifts.ShiftCalendar of working hours, None for 24/7 operation
+        stage               The index of the machine's stage in its line
+        lots                The lots.LotTracker following material through the line, None when not tracking
+        trace_log           The eventlog.EventLog receiving every cycle, None when not tracing
+        event_log           The eventlog.EventLog receiving failures, None when not logging
+        log_id              The source id of the machine in the event log
+    """
+
+    def __init__(
+            self, 
+            env, 
+            name, 
+            item_type, 
+            in_buffer, 
+            out_buffer, 
+            cycle_time, 
+            cycle_time_sigma, 
+            yield_rate,
+            yield_sigma,
+            batch_failure_rate,
+            mtbf,
+            mttr,
+            repair_std_dev,
+            batch_size,
+            seed=None,
+            event_log=None,
+            calendar=None,
+            history=True,
+            stage=0,
+            lots=None,
+            statistics=False,
+            ):
+        
+        self.env = env
+        self.name = name
+        self.type = item_type
+        self.in_buffer = in_buffer
+        self.out_buffer = out_buffer
+        self.cycle_time = cycle_time
+        self.cycle_time_sigma = cycle_time_sigma
+        self.yield_rate = yield_rate
+        self.yield_sigma = yield_sigma
+        self.batch_failure_rate = batch_failure_rate
+        self.mtbf = mtbf
+        self.mttr = mttr
+        self.repair_std_dev = repair_std_dev
+        self.batch_size = batch_size
+        self.calendar = calendar
+        self.stage = stage
+        self.lots = lots
+        self.state_clock = StateClock(env.now, STARVED, calendar, history)
+        self.units = 1
+        self.items_ready = 0
+        self.number_finished = 0
+        self.batches_good = 0
+        self.batches_failed = 0
+        self.breakdowns = 0
+        # without a history the times are left empty and only the counters grow
+        self.history = history
+        self.start_times = []
+        self.finish_times = []
+        self.fail_times = []
+        self.breakdown_times = []
+        # streaming statistics in constant memory, for runs without a history
+        self.cycle_stats = RunningStats() if statistics else None
+        self.departure_stats = RunningStats() if statistics else None
+        self.yield_sketch = QuantileSketch() if statistics else None
+        self.last_departure = None
+        self.downtime = 0.0
+        self.interrupted_batches = 0
+        self.broken = False
+        self.full = False
+        self.lot = None
+        # each machine owns its random streams, keyed by its name
+        self.seed = seed
+        self.cycle_times = NormalStream(seed, (name, "cycle_time"), cycle_time, cycle_time_sigma)
+        self.yields = NormalStream(seed, (name, "yield"), batch_size * yield_rate, yield_sigma)
+        self.batch_failures = BernoulliStream(seed, (name, "batch_failure"), batch_failure_rate)
+        self.times_to_failure = ExponentialStream(seed, (name, "time_to_failure"), mtbf or 0)
+        self.repair_times = LogNormalStream(seed, (name, "repair_time"), mttr or 0, repair_std_dev or 0)
+        # only keep a reference to the log if it wants the events, so a disabled log costs a None check
+        self.log_id = event_log.register(name) if event_log is not None else None
+        self.trace_log = event_log if event_log is not None and event_log.enabled(TRACE) else None
+        self.event_log = event_log if event_log is not None and event_log.enabled(EVENT) else None
+        # start running the process
+        self.process = env.process(self.produce())
+        self.failures = env.process(self.fail()) if mtbf and mtbf != float('inf') else None
+
+    def streams(self):
+        """Returns the random streams of the machine"""
+        return [self.cycle_times, self.yields, self.batch_failures, self.times_to_failure, self.repair_times]
+
+    def reset_statistics(self):
+        """Starts the counters and state times over at the current time, e.g. after a warm-up"""
+        self.number_finished = 0
+        self.batches_good = 0
+        self.batches_failed = 0
+        self.breakdowns = 0
+        self.downtime = 0.0
+        self.interrupted_batches = 0
+        self.state_clock.reset(self.env.now)
+        if self.cycle_stats is not None:
+            self.cycle_stats = RunningStats()
+            self.departure_stats = RunningStats()
+            self.yield_sketch = QuantileSketch()
+
+    def delay(self, work):
+        """
+        Returns the time it takes to do work hours of working time from now
+        """
+        if self.calendar is None:
+            return work
+        return self.calendar.delay(self.env.now, work)
+
+    def worked(self, start):
+        """
+        Returns the working time since start
+        """
+        if self.calendar is None:
+            return self.env.now - start
+        return self.calendar.working_time(start, self.env.now)
+
+    def fail(self):
+        """
+        Runs the failure clock of the machine
+        The clock schedules the next breakdown directly, so a breakdown costs one
+        timeout here, one interrupt and one repair timeout in produce
+        Times to failure are working time, so the clock stops outside of shifts
+        """
+        time_to_failure = self.times_to_failure.next()
+        while True:
+            yield self.env.timeout(self.delay(time_to_failure))
+            repair_time = self.repair_times.next()
+            self.process.interrupt(repair_time)
+            # the next breakdown can only come once this repair is over
+            time_to_failure = repair_time + self.times_to_failure.next()
+
+    def repair(self, repair_time):
+        """
+        Takes the machine out of service for the repair time
+        """
+        self.broken = True
+        state = self.state_clock.state
+        self.state_clock.enter(self.env.now, DOWN)
+        self.breakdowns += 1
+        if self.history:
+            self.breakdown_times.append(self.env.now)
+        if self.event_log is not None:
+            self.event_log.record(self.env.now, self.log_id, BROKE_DOWN, repair_time)
+        yield self.env.timeout(self.delay(repair_time))
+        self.downtime += repair_time
+        self.broken = False
+        self.state_clock.enter(self.env.now, state)
+        if self.event_log is not None:
+            self.event_log.record(self.env.now, self.log_id, REPAIRED, repair_time)
+
+    def request(self, request, amount):
+        """
+        Waits until a buffer grants a get or put of amount
+        A breakdown while waiting withdraws the request unless it was already granted
+        """
+        while True:
+            event = request(amount)
+            try:
+                yield event
+                return
+            except simpy.Interrupt as interrupt:
+                granted = event.triggered
+                if not granted:
+                    event.cancel()
+                yield from self.repair(interrupt.cause)
+                if granted:
+                    return
+
+    def produce(self):
+        """
+        Runs the process for the machine
+        """
+        while True:
+            # wait to start until you have a full batch
+            if not self.full:
+                # if a part is available get it from the buffer
+                self.state_clock.enter(self.env.now, STARVED)
+                yield from self.request(self.in_buffer.get, self.batch_size)
+                if self.trace_log is not None:
+                    self.trace_log.record(self.env.now, self.log_id, GOT_BATCH, self.batch_size)
+                if self.lots is not None:
+                    self.lot = self.lots.start(self.in_buffer, self.stage, self.batch_size, self.env.now)
+                self.full = True
+            # add to your start times list
+            if self.history:
+                self.start_times.append(self.env.now)
+            self.state_clock.enter(self.env.now, BUSY)
+
+            remaining = self.cycle_times.next()
+            if self.cycle_stats is not None:
+                self.cycle_stats.add(remaining)
+            while remaining > 0:
+                started = self.env.now
+                try:
+                    yield self.env.timeout(self.delay(remaining))
+                    remaining = 0
+                except simpy.Interrupt as interrupt:
+                    # the batch stays in the machine and finishes after the repair
+                    remaining -= self.worked(started)
+                    self.interrupted_batches += 1
+                    yield from self.repair(interrupt.cause)
+            if self.trace_log is not None:
+                self.trace_log.record(self.env.now, self.log_id, FINISHED, self.out_buffer.level)
+            if not self.batch_failures.next():
+                yielded_amount = self.yields.next()
+                self.state_clock.enter(self.env.now, BLOCKED)
+                yield from self.request(self.out_buffer.put, yielded_amount)
+                if self.trace_log is not None:
+                    self.trace_log.record(self.env.now, self.log_id, PUSHED, yielded_amount)
+                if self.lots is not None:
+                    self.lots.finish(self.lot, self.out_buffer, yielded_amount, self.env.now)
+                self.number_finished += yielded_amount
+                self.batches_good += 1
+                if self.history:
+                    self.finish_times.append(self.env.now)
+                if self.cycle_stats is not None:
+                    self.yield_sketch.add(yielded_amount)
+                    if self.last_departure is not None:
+                        self.departure_stats.add(self.env.now - self.last_departure)
+                    self.last_departure = self.env.now
+            else:
+                if self.event_log is not None:
+                    self.event_log.record(self.env.now, self.log_id, BATCH_FAILED, self.batch_size)
+                if self.lots is not None:
+                    self.lots.scrap(self.lot, self.env.now)
+                self.batches_failed += 1
+                if self.history:
+                    self.fail_times.append(self.env.now)
+            self.full = False
+
+# what a pool has scheduled for a unit, in the order of equal times
+_FINISH = 0
+_REPAIR = 1
+_BREAKDOWN = 2
+
+class MachinePool(object):
+    """Runs the identical machines of a stage as one entity
+    A stage of hundreds of Machine objects is hundreds of processes, each
+    waiting on its own get from the in buffer. The pool instead counts its
+    units by state and keeps one heap of the completions, repairs and
+    breakdowns of all of them. A single timer sleeps until the earliest one,
+    and at most one get and one put stand at a buffer at a time, so the work
+    per event does not depend on the number of units.
+    The units follow the rules of Machine: a unit takes a full batch, a
+    breakdown keeps a batch in process until after the repair and the
+    failure clock of each unit runs whatever the unit is doing. Finished
+    batches wait in one queue for room in the out buffer, oldest first.
+    The statistics are those of the whole stage, state times are unit hours
+
+    Attributes:
+        env                 The simpy environment in which the pool operates
+        name                The name of the pool, the name of its stage
+        type                The type of machine (jet-mill, etc)
+        units               The number of identical machines in the pool
+        in_buffer           The buffer from which the units retrieve items
+        out_buffer          The buffer to which the units output items
+        batch_size          The amount a unit takes from the in buffer per cycle
+        number_finished     The total number of items completed in the run
+        batches_good        The number of batches pushed to the out buffer
+        batches_failed      The number of batches that failed
+        breakdowns          The number of breakdowns of all units
+        downtime            The total unit time spent under repair
+        interrupted_batches The number of batches a breakdown interrupted in process
+        state_clock         The metrics.PoolClock of the unit time spent in each state
+        start_times         The times at which a unit started a batch
+        finish_times        The times at which a unit pushed on a batch
+        fail_times          The times at which a batch failed
+        breakdown_times     The times at which a unit broke down
+        history             Whether the start, finish, fail and breakdown times are kept
+        cycle_stats         The stats.RunningStats of process times, None when not kept
+        departure_stats     The stats.RunningStats of the times between pushes of any unit, None when not kept
+        yield_sketch        The stats.QuantileSketch of pushed amounts, None when not kept
+        last_departure      The time of the last push, None before the first
+        per_unit            Whether the output and breakdowns of every unit are counted
+        unit_finished       The amount each unit pushed on, when per_unit
+        unit_batches        The number of batches each unit pushed on, when per_unit
+        unit_breakdowns     The number of breakdowns of each unit, when per_unit
+        unit_downtime       The time each unit spent under repair, when per_unit
+        mtbf                The mean time between breakdowns of a unit, 0 or None for units that never break
+        seed                The seed of the run the pool's random streams derive from
+        cycle_times         The stream of process times
+        yields              The stream of yielded amounts
+        batch_failures      The stream of batch failure flags
+        times_to_failure    The stream of times between the end of a repair and the next breakdown
+        repair_times        The stream of repair times
+        calendar            The shifts.ShiftCalendar of working hours, None for 24/7 operation
+        stage               The index of the pool's stage in its line
+        lots                The lots.LotTracker following material through the line, None when not tracking
+        trace_log           The eventlog.EventLog receiving every cycle, None when not tracing
+        event_log           The eventlog.EventLog receiving failures, None when not logging
+        log_id              The source id of the pool in the event log
+    """
+
+    def __init__(
+            self,
+            env,
+            name,
+            item_type,
+            in_buffer,
+            out_buffer,
+            units,
+            cycle_time,
+            cycle_time_sigma,
+            yield_rate,
+            yield_sigma,
+            batch_failure_rate,
+            mtbf,
+            mttr,
+            repair_std_dev,
+            batch_size,
+            seed=None,
+            event_log=None,
+            calendar=None,
+            history=True,
+            stage=0,
+            lots=None,
+            per_unit=False,
+            statistics=False,
+            ):
+        self.env = env
+        self.name = name
+        self.type = item_type
+        self.units = units
+        self.in_buffer = in_buffer
+        self.out_buffer = out_buffer
+        self.cycle_time = cycle_time
+        self.cycle_time_sigma = cycle_time_sigma
+        self.yield_rate = yield_rate
+        self.yield_sigma = yield_sigma
+        self.batch_failure_rate = batch_failure_rate
+        self.mtbf = mtbf
+        self.mttr = mttr
+        self.repair_std_dev = repair_std_dev
+        self.batch_size = batch_size
+        self.calendar = calendar
+        self.stage = stage
+        self.lots = lots
+        self.state_clock = PoolClock(env.now, units, calendar)
+        self.number_finished = 0
+        self.batches_good = 0
+        self.batches_failed = 0
+        self.breakdowns = 0
+        self.downtime = 0.0
+        self.interrupted_batches = 0
+        self.history = history
+        self.start_times = []
+        self.finish_times = []
+        self.fail_times = []
+        self.breakdown_times = []
+        self.cycle_stats = RunningStats() if statistics else None
+        self.departure_stats = RunningStats() if statistics else None
+        self.yield_sketch = QuantileSketch() if statistics else None
+        self.last_departure = None
+        self.per_unit = per_unit
+        if per_unit:
+            self.unit_finished = [0.0] * units
+            self.unit_batches = [0] * units
+            self.unit_breakdowns = [0] * units
+            self.unit_downtime = [0.0] * units
+        # the units share the streams of the pool, keyed by the pool's name
+        self.seed = seed
+        self.cycle_times = NormalStream(seed, (name, "cycle_time"), cycle_time, cycle_time_sigma)
+        self.yields = NormalStream(seed, (name, "yield"), batch_size * yield_rate, yield_sigma)
+        self.batch_failures = BernoulliStream(seed, (name, "batch_failure"), batch_failure_rate)
+        self.times_to_failure = ExponentialStream(seed, (name, "time_to_failure"), mtbf or 0)
+        self.repair_times = LogNormalStream(seed, (name, "repair_time"), mttr or 0, repair_std_dev or 0)
+        self.log_id = event_log.register(name) if event_log is not None else None
+        self.trace_log = event_log if event_log is not None and event_log.enabled(TRACE) else None
+        self.event_log = event_log if event_log is not None and event_log.enabled(EVENT) else None
+        # the state of each unit, the work left on its batch, the time that work last
+        # resumed, its lot, the state a repair returns it to and its current repair time
+        self._states = [STARVED] * units
+        self._remaining = [0.0] * units
+        self._resumed = [0.0] * units
+        self._lots = [None] * units
+        self._returns = [STARVED] * units
+        self._repairs = [0.0] * units
+        # the sequence number of the completion each busy unit waits for, older ones are stale
+        self._finishing = [None] * units
+        self._sequence = count()
+        self._heap = []
+        self._timer = None
+        self._timer_time = None
+        self._idle = set(range(units))
+        self._ready = 0
+        self._get = None
+        self._outputs = deque()
+        self._put = None
+        if mtbf and mtbf != float('inf'):
+            self._heap = [
+                (self.delay(self.times_to_failure.next()), next(self._sequence), _BREAKDOWN, unit)
+                for unit in range(units)
+            ]
+            heapq.heapify(self._heap)
+            self._schedule()
+        self._request()
+
+    def streams(self):
+        """Returns the random streams of the pool"""
+        return [self.cycle_times, self.yields, self.batch_failures, self.times_to_failure, self.repair_times]
+
+    def reset_statistics(self):
+        """Starts the counters and state times over at the current time, e.g. after a warm-up"""
+        self.number_finished = 0
+        self.batches_good = 0
+        self.batches_failed = 0
+        self.breakdowns = 0
+        self.downtime = 0.0
+        self.interrupted_batches = 0
+        self.state_clock.reset(self.env.now)
+        if self.cycle_stats is not None:
+            self.cycle_stats = RunningStats()
+            self.departure_stats = RunningStats()
+            self.yield_sketch = QuantileSketch()
+        if self.per_unit:
+            self.unit_finished = [0.0] * self.units
+            self.unit_batches = [0] * self.units
+            self.unit_breakdowns = [0] * self.units
+            self.unit_downtime = [0.0] * self.units
+
+    def unit_results(self):
+        """Returns the output, batches, breakdowns and downtime of every unit, the pool must count per unit"""
+        if not self.per_unit:
+            raise ValueError(f'{self.name} does not count per unit')
+        return {
+            "number_finished": list(self.unit_finished),
+            "batches_good": list(self.unit_batches),
+            "breakdowns": list(self.unit_breakdowns),
+            "downtime": list(self.unit_downtime),
+        }
+
+    def delay(self, work):
+        """Returns the time it takes to do work hours of working time from now"""
+        if self.calendar is None:
+            return work
+        return self.calendar.delay(self.env.now, work)
+
+    def worked(self, start):
+        """Returns the working time since start"""
+        if self.calendar is None:
+            return self.env.now - start
+        return self.calendar.working_time(start, self.env.now)
+
+    def _push(self, time, kind, unit):
+        """Puts a completion, repair or breakdown of a unit on the heap and returns its sequence number"""
+        sequence = next(self._sequence)
+        heapq.heappush(self._heap, (time, sequence, kind, unit))
+        return sequence
+
+    def _schedule(self):
+        """Sets the timer to the earliest entry of the heap unless it already wakes up by then"""
+        if not self._heap:
+            return
+        time = self._heap[0][0]
+        if self._timer_time is not None and self._timer_time <= time:
+            return
+        self._timer_time = time
+        self._timer = self.env.timeout(max(time - self.env.now, 0))
+        self._timer.callbacks.append(self._wake)
+
+    def _wake(self, event):
+        """Handles every heap entry that is due, a timer the heap no longer needs does nothing"""
+        if event is not self._timer:
+            return
+        # entries pushed for now while handling the heap are handled by this loop, not a new timer
+        self._timer_time = self.env.now
+        heap = self._heap
+        while heap and heap[0][0] <= self.env.now:
+            _, sequence, kind, unit = heapq.heappop(heap)
+            if kind == _FINISH:
+                if self._finishing[unit] == sequence:
+                    self._finishing[unit] = None
+                    self._complete(unit)
+            elif kind == _REPAIR:
+                self._repaired(unit)
+            else:
+                self._break(unit)
+        self._timer = None
+        self._timer_time = None
+        self._schedule()
+
+    def _enter(self, unit, state):
+        """Moves a unit to another state"""
+        self.state_clock.move(self.env.now, self._states[unit], state)
+        self._states[unit] = state
+
+    def _request(self):
+        """Asks the in buffer for a batch while a unit is idle and no request stands"""
+        if self._get is None and self._idle:
+            self._get = self.in_buffer.get(self.batch_size)
+            self._get.callbacks.append(self._got)
+
+    def _got(self, event):
+        """Starts an idle unit on the batch the in buffer granted"""
+        self._get = None
+        if self._idle:
+            self._start(self._idle.pop())
+        else:
+            # the last idle unit broke down after the grant, the next free unit takes the batch
+            self._ready += 1
+        self._request()
+
+    def _release(self, unit):
+        """Makes a unit idle, or starts it on a batch that is already waiting"""
+        self._enter(unit, STARVED)
+        if self._ready:
+            self._ready -= 1
+            self._start(unit)
+        else:
+            self._idle.add(unit)
+            self._request()
+
+    def _start(self, unit):
+        """Starts a unit on a batch taken from the in buffer"""
+        now = self.env.now
+        if self.trace_log is not None:
+            self.trace_log.record(now, self.log_id, GOT_BATCH, self.batch_size)
+        if self.lots is not None:
+            self._lots[unit] = self.lots.start(self.in_buffer, self.stage, self.batch_size, now)
+        if self.history:
+            self.start_times.append(now)
+        self._enter(unit, BUSY)
+        cycle_time = self.cycle_times.next()
+        if self.cycle_stats is not None:
+            self.cycle_stats.add(cycle_time)
+        self._run(unit, cycle_time)
+
+    def _run(self, unit, remaining):
+        """Schedules the completion of a unit's batch after remaining hours of working time"""
+        now = self.env.now
+        self._remaining[unit] = remaining
+        self._resumed[unit] = now
+        finish = now + self.delay(remaining) if remaining > 0 else now
+        self._finishing[unit] = self._push(finish, _FINISH, unit)
+        self._schedule()
+
+    def _complete(self, unit):
+        """Queues the output of a finished batch for the out buffer, or scraps it"""
+        now = self.env.now
+        if self.trace_log is not None:
+            self.trace_log.record(now, self.log_id, FINISHED, self.out_buffer.level)
+        if not self.batch_failures.next():
+            self._enter(unit, BLOCKED)
+            self._outputs.append((unit, self.yields.next()))
+            self._deliver()
+        else:
+            if self.event_log is not None:
+                self.event_log.record(now, self.log_id, BATCH_FAILED, self.batch_size)
+            if self.lots is not None:
+                self.lots.scrap(self._lots[unit], now)
+            self.batches_failed += 1
+            if self.history:
+                self.fail_times.append(now)
+            self._release(unit)
+
+    def _deliver(self):
+        """Offers the oldest finished batch to the out buffer while no put stands"""
+        if self._put is None and self._outputs:
+            self._put = self.out_buffer.put(self._outputs[0][1])
+            self._put.callbacks.append(self._pushed)
+
+    def _pushed(self, event):
+        """Frees the unit whose batch the out buffer took"""
+        self._put = None
+        unit, amount = self._outputs.popleft()
+        now = self.env.now
+        if self.trace_log is not None:
+            self.trace_log.record(now, self.log_id, PUSHED, amount)
+        if self.lots is not None:
+            self.lots.finish(self._lots[unit], self.out_buffer, amount, now)
+        self.number_finished += amount
+        self.batches_good += 1
+        if self.per_unit:
+            self.unit_finished[unit] += amount
+            self.unit_batches[unit] += 1
+        if self.history:
+            self.finish_times.append(now)
+        if self.cycle_stats is not None:
+            self.yield_sketch.add(amount)
+            if self.last_departure is not None:
+                self.departure_stats.add(now - self.last_departure)
+            self.last_departure = now
+        if self._states[unit] == DOWN:
+            # the batch left during the repair, so the unit comes back empty
+            self._returns[unit] = STARVED
+        else:
+            self._release(unit)
+        self._deliver()
+
+    def _break(self, unit):
+        """Takes a unit out of service and schedules its repair and its next breakdown"""
+        now = self.env.now
+        repair_time = self.repair_times.next()
+        state = self._states[unit]
+        if state == STARVED:
+            self._idle.discard(unit)
+            if not self._idle and self._get is not None and not self._get.triggered:
+                self._get.cancel()
+                self._get = None
+        elif state == BUSY:
+            # the batch stays in the unit and finishes after the repair
+            self._remaining[unit] -= self.worked(self._resumed[unit])
+            self._finishing[unit] = None
+            self.interrupted_batches += 1
+        self._returns[unit] = state
+        self._repairs[unit] = repair_time
+        self._enter(unit, DOWN)
+        self.breakdowns += 1
+        if self.per_unit:
+            self.unit_breakdowns[unit] += 1
+        if self.history:
+            self.breakdown_times.append(now)
+        if self.event_log is not None:
+            self.event_log.record(now, self.log_id, BROKE_DOWN, repair_time)
+        self._push(now + self.delay(repair_time), _REPAIR, unit)
+        # the next breakdown can only come once this repair is over
+        self._push(now + self.delay(repair_time + self.times_to_failure.next()), _BREAKDOWN, unit)
+
+    def _repaired(self, unit):
+        """Returns a repaired unit to what it was doing"""
+        repair_time = self._repairs[unit]
+        self.downtime += repair_time
+        if self.per_unit:
+            self.unit_downtime[unit] += repair_time
+        if self.event_log is not None:
+            self.event_log.record(self.env.now, self.log_id, REPAIRED, repair_time)
+        state = self._returns[unit]
+        if state == BUSY:
+            self._enter(unit, BUSY)
+            self._run(unit, self._remaining[unit])
+        elif state == BLOCKED:
+            self._enter(unit, BLOCKED)
+        else:
+            self._release(unit)
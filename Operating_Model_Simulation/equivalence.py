@@ -0,0 +1,129 @@
+"""Checks that engine.Engine runs a line exactly as SimPy does
+
+Usage:
+    python equivalence.py           run every case on both engines and compare
+    python equivalence.py --quick   skip the full plant cases
+
+Each case builds the same line on the same seed under both engines and
+compares the per machine and per buffer results, the traced events, the
+lot table and the number of events processed. They must match exactly,
+not within a tolerance, so any difference in the order of same time events
+shows up. The script exits with 1 when a case differs.
+"""
+import argparse
+import math
+import sys
+import numpy as np
+from benchmark import CountingEnvironment, sandbox_line, process_line, scaled_plant
+from engine import Engine
+from eventlog import EventLog
+from line import Line, LineSpec, StageSpec
+from plant import plant_spec
+from replication import line_results
+from shifts import shift_calendar
+
+SEED = 2024
+
+
+def blocking_line():
+    """A line of small finite buffers, breakdowns and batch sizes that do not divide each other"""
+    def stage(name, units, cycle_time, batch_size, capacity, mtbf):
+        return StageSpec(
+            name = name,
+            units = units,
+            cycle_time = cycle_time,
+            cycle_time_sigma = cycle_time / 3,
+            yield_rate = 0.9,
+            yield_sigma = batch_size / 50,
+            batch_failure_rate = 0.1,
+            mtbf = mtbf,
+            mttr = 2,
+            repair_std_dev = 1,
+            batch_size = batch_size,
+            buffer_capacity = capacity,
+        )
+    return LineSpec(
+        [
+            stage("Cutter", 3, 1.0, 4, 40, 30),
+            stage("Press", 2, 1.5, 7, 15, 20),
+            stage("Oven", 4, 3.0, 5, 12, math.inf),
+        ],
+        delivery_size = 12,
+        delivery_size_sigma = 1,
+        delivery_time = 1,
+        delivery_time_sigma = 0.1,
+    )
+
+
+def shift_plant():
+    """A small plant working two shifts, so breakdowns and cycles wait out the nights"""
+    return plant_spec(units={"Strip-Caster": 4, "Hydrogen-Decrepitation": 3}, calendar=shift_calendar(2))
+
+
+def cases(quick=False):
+    """Returns (name, spec factory, horizon, options of line.Line, warm-up) for every case"""
+    cases = [
+        ("process-line", process_line, 2000, {}, None),
+        ("sandbox-line", sandbox_line, 2000, {}, None),
+        ("blocking-line", blocking_line, 2000, {"track_lots": True}, None),
+        ("blocking-line-pooled", blocking_line, 2000, {"pool_units": 2, "track_lots": True}, None),
+        ("blocking-line-antithetic", blocking_line, 2000, {"antithetic": True}, None),
+        ("blocking-line-warm-start", blocking_line, 2000, {}, 500),
+        ("shift-plant", shift_plant, 500, {"track_lots": True}, None),
+    ]
+    if not quick:
+        cases.append(("plant", lambda: scaled_plant(0.1), 168, {}, None))
+        cases.append(("plant-pooled", lambda: scaled_plant(1.0), 48, {"pool_units": 50}, None))
+    return cases
+
+
+def run(env, spec, horizon, options, warmup):
+    """Runs a traced line on an environment, reseeded and restarted after the warm-up when given
+
+    Returns:
+    tuple: The line results, the traced events, the lot table and the number of events
+    """
+    event_log = EventLog()
+    line = Line(env, spec, seed=SEED, event_log=event_log, **options)
+    if warmup is not None:
+        env.run(until=warmup)
+        line.reset_statistics()
+        line.reseed(SEED + 1)
+    env.run(until=horizon)
+    lots = line.lots.to_numpy() if line.lots is not None else {}
+    return line_results(line, horizon), event_log.events(), lots, env.events
+
+
+def differences(simpy_run, heap_run):
+    """Returns what differs between the runs of the two engines, empty when nothing does"""
+    problems = []
+    (results, events, lots, count), (other_results, other_events, other_lots, other_count) = simpy_run, heap_run
+    if results != other_results:
+        problems.append("results differ")
+    if not np.array_equal(events, other_events):
+        problems.append("traced events differ")
+    if lots.keys() != other_lots.keys() or any(
+            not np.array_equal(lots[name], other_lots[name], equal_nan=True) for name in lots):
+        problems.append("lots differ")
+    if count != other_count:
+        problems.append(f'{count} events on simpy, {other_count} on heap')
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the heap engine against SimPy")
+    parser.add_argument("--quick", action="store_true", help="skip the full plant cases")
+    args = parser.parse_args(argv)
+    failed = False
+    for name, factory, horizon, options, warmup in cases(args.quick):
+        spec = factory()
+        simpy_run = run(CountingEnvironment(), spec, horizon, options, warmup)
+        heap_run = run(Engine(), spec, horizon, options, warmup)
+        problems = differences(simpy_run, heap_run)
+        print(f'{"FAIL" if problems else "PASS"} {name}: {"; ".join(problems) or f"{heap_run[3]} events identical"}')
+        failed = failed or bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
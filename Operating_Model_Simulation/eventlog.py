@@ -0,0 +1,174 @@
+import sys
+from array import array
+import numpy as np
+
+# levels, an event is kept when its level is at least the level of the log
+TRACE = 10
+EVENT = 20
+
+# event codes, failures and repairs are logged at EVENT level and the rest at TRACE
+ARRIVED = 1
+GOT_BATCH = 2
+FINISHED = 3
+PUSHED = 4
+BATCH_FAILED = 5
+BROKE_DOWN = 6
+REPAIRED = 7
+LEVEL = 8
+
+# the layout of one event in the binary file, 21 bytes per event
+RECORD_DTYPE = np.dtype([
+    ("time", "<f8"),
+    ("source", "<u4"),
+    ("code", "u1"),
+    ("quantity", "<f8"),
+])
+
+
+class EventLog(object):
+    """Keeps compact (time, source id, event code, quantity) records of a run
+    Events go into preallocated typed arrays used as a ring buffer, so only
+    the last capacity events are kept. When a path is given the ring buffer
+    is flushed to a binary file every time it fills up and nothing is lost.
+
+    Entities hold a reference to the log only when it is enabled for the
+    level of their events, so a disabled log costs one None check per event
+
+    Attributes:
+        level       The lowest level of event kept
+        capacity    The number of events held in memory
+        path        The binary file events are flushed to, None to keep them in memory
+        sources     The names of the entities, a source id is an index into the list
+        count       The total number of events recorded
+    """
+
+    def __init__(self, level=TRACE, capacity=65536, path=None):
+        self.level = level
+        self.capacity = capacity
+        self.path = path
+        self.sources = []
+        self.count = 0
+        self._times = array('d', bytes(8 * capacity))
+        self._source_ids = array('I', bytes(4 * capacity))
+        self._codes = array('B', bytes(capacity))
+        self._quantities = array('d', bytes(8 * capacity))
+        self._index = 0
+        self._file = open(path, "wb") if path is not None else None
+        # a log that spills writes out full buffers instead of overwriting them
+        self._spill = path is not None
+
+    def enabled(self, level):
+        """Tells if events of the given level are kept"""
+        return level >= self.level
+
+    def register(self, name):
+        """Adds an entity to the log and returns its source id"""
+        self.sources.append(name)
+        return len(self.sources) - 1
+
+    def record(self, time, source, code, quantity=0.0):
+        """Stores one event"""
+        index = self._index
+        self._times[index] = time
+        self._source_ids[index] = source
+        self._codes[index] = code
+        self._quantities[index] = quantity
+        self.count += 1
+        index += 1
+        self._index = index
+        if index == self.capacity:
+            if self._spill:
+                self.flush()
+            else:
+                self._index = 0
+
+    def _columns(self):
+        """Returns the events held in memory as a structured numpy array in time order"""
+        if self._spill or self.count < self.capacity:
+            order = np.arange(self._index)
+        else:
+            # the ring buffer has wrapped, the oldest event is at the write index
+            order = np.roll(np.arange(self.capacity), -self._index)
+        events = np.empty(len(order), dtype=RECORD_DTYPE)
+        events["time"] = np.frombuffer(self._times, dtype="<f8")[order]
+        events["source"] = np.frombuffer(self._source_ids, dtype=np.uint32)[order]
+        events["code"] = np.frombuffer(self._codes, dtype=np.uint8)[order]
+        events["quantity"] = np.frombuffer(self._quantities, dtype="<f8")[order]
+        return events
+
+    def _write(self, events):
+        """Writes a block of events out, the binary file by default"""
+        events.tofile(self._file)
+
+    def flush(self):
+        """Writes the buffered events out"""
+        if not self._spill:
+            return
+        if self._index:
+            self._write(self._columns())
+        self._index = 0
+
+    def close(self):
+        """Flushes the events and writes the source names next to the binary file"""
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+        with open(f'{self.path}.sources', "w") as sources:
+            sources.write("\n".join(self.sources))
+
+    def events(self):
+        """Returns the events held in memory as a structured numpy array"""
+        return self._columns()
+
+
+def read_events(path):
+    """Loads the events and source names written by an EventLog
+
+    Parameters:
+    path (str): The binary file given to the EventLog
+
+    Returns:
+    tuple: The structured numpy array of events and the list of source names
+    """
+    events = np.fromfile(path, dtype=RECORD_DTYPE)
+    with open(f'{path}.sources') as sources:
+        names = sources.read().split("\n")
+    return events, names
+
+
+def format_event(time, name, code, quantity):
+    """Turns one event into the message printed while debugging"""
+    if code == ARRIVED:
+        return f'{time:.2f} part has arrived'
+    if code == GOT_BATCH:
+        return f'{time:.2f} {name} has got a part'
+    if code == FINISHED:
+        return f'{time:.2f} {name} finished a part. Next buffer has {quantity}'
+    if code == PUSHED:
+        return f'{time:.2f} {name} pushed a part to next buffer'
+    if code == BATCH_FAILED:
+        return f'{time:.2f} {name} failed'
+    if code == BROKE_DOWN:
+        return f'{time:.2f} {name} broke down for {quantity:.2f}'
+    if code == REPAIRED:
+        return f'{time:.2f} {name} is repaired'
+    if code == LEVEL:
+        return f'{time:.2f} {name} holds {quantity}'
+    return f'{time:.2f} {name} event {code} {quantity}'
+
+
+def print_events(events, sources, file=sys.stdout):
+    """Pretty prints events for debugging
+
+    Parameters:
+    events (numpy.ndarray): The events, from EventLog.events or read_events
+    sources (list): The source names of the log
+    file (file): Where to print the events
+
+    Returns:
+    None
+    """
+    for time, source, code, quantity in events.tolist():
+        print(format_event(time, sources[source], code, quantity), file=file)
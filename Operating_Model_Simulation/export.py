@@ -0,0 +1,132 @@
+import glob
+import json
+import os
+import numpy as np
+from eventlog import EventLog, TRACE
+
+# one manifest per run names its chunks, the columns of a chunk are the fields of eventlog.RECORD_DTYPE
+COLUMNS = ("time", "source", "code", "quantity")
+MANIFEST_PATTERN = "scenario-*-replication-*.json"
+
+
+def run_prefix(scenario, replication):
+    """Returns the file name prefix of the chunks and manifest of one run"""
+    return f'scenario-{scenario}-replication-{replication}'
+
+
+class ChunkExporter(EventLog):
+    """An EventLog that streams its events to columnar chunk files during the run
+    Every time chunk_size events are buffered they are written to a numpy
+    .npz file holding one array per column, so memory stays bounded by the
+    chunk size however long the horizon. Closing the exporter writes the
+    last partial chunk and a JSON manifest with the source names, which
+    load_events uses to put runs of many scenarios and replications together
+
+    Attributes:
+        directory       The directory the chunks and manifest are written to
+        scenario        The scenario id stamped on every event of the run
+        replication     The replication id stamped on every event of the run
+        chunks          The number of chunks written so far
+        compress        Whether chunks are written with zip compression
+    """
+
+    def __init__(self, directory, scenario=0, replication=0, chunk_size=65536, level=TRACE, compress=False):
+        super().__init__(level=level, capacity=chunk_size)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.scenario = scenario
+        self.replication = replication
+        self.chunks = 0
+        self.compress = compress
+        self._spill = True
+        self._closed = False
+
+    def _chunk_path(self, chunk):
+        return os.path.join(self.directory, f'{run_prefix(self.scenario, self.replication)}-{chunk:06d}.npz')
+
+    def _write(self, events):
+        """Writes a block of events as the next chunk"""
+        save = np.savez_compressed if self.compress else np.savez
+        save(self._chunk_path(self.chunks), **{column: events[column] for column in COLUMNS})
+        self.chunks += 1
+
+    def close(self):
+        """Writes the last chunk and the manifest of the run"""
+        if self._closed:
+            return
+        self.flush()
+        self._closed = True
+        manifest = {
+            "scenario": self.scenario,
+            "replication": self.replication,
+            "events": self.count,
+            "sources": self.sources,
+            "chunks": [os.path.basename(self._chunk_path(chunk)) for chunk in range(self.chunks)],
+        }
+        path = os.path.join(self.directory, f'{run_prefix(self.scenario, self.replication)}.json')
+        with open(path, "w") as manifest_file:
+            json.dump(manifest, manifest_file)
+
+
+def manifests(directory, scenarios=None, replications=None):
+    """Returns the manifests of the runs exported to a directory
+
+    Parameters:
+    directory (str): The directory given to the ChunkExporter objects
+    scenarios (iterable): The scenario ids to keep, all when None
+    replications (iterable): The replication ids to keep, all when None
+
+    Returns:
+    list: The manifest dicts sorted by scenario and replication
+    """
+    scenarios = None if scenarios is None else set(scenarios)
+    replications = None if replications is None else set(replications)
+    found = []
+    for path in glob.glob(os.path.join(directory, MANIFEST_PATTERN)):
+        with open(path) as manifest_file:
+            manifest = json.load(manifest_file)
+        if scenarios is not None and manifest["scenario"] not in scenarios:
+            continue
+        if replications is not None and manifest["replication"] not in replications:
+            continue
+        found.append(manifest)
+    # numeric ids sort numerically, so scenario 10 follows 9, and before any named scenarios
+    return sorted(found, key=lambda manifest: (
+        isinstance(manifest["scenario"], str), manifest["scenario"], manifest["replication"]))
+
+
+def iter_events(directory, scenarios=None, replications=None, columns=COLUMNS, names=True):
+    """Yields the exported events one chunk at a time as pandas DataFrames
+
+    Only the requested columns are read from each chunk, so a query over
+    many runs holds one chunk in memory at a time
+
+    Parameters:
+    directory (str): The directory given to the ChunkExporter objects
+    scenarios (iterable): The scenario ids to read, all when None
+    replications (iterable): The replication ids to read, all when None
+    columns (tuple): The event columns to read
+    names (bool): Whether to add a categorical name column when source is read
+
+    Returns:
+    generator: One DataFrame per chunk with scenario and replication columns added
+    """
+    import pandas as pd
+    for manifest in manifests(directory, scenarios, replications):
+        for chunk in manifest["chunks"]:
+            with np.load(os.path.join(directory, chunk)) as arrays:
+                frame = pd.DataFrame({column: arrays[column] for column in columns})
+            frame.insert(0, "scenario", manifest["scenario"])
+            frame.insert(1, "replication", manifest["replication"])
+            if names and "source" in frame:
+                frame["name"] = pd.Categorical.from_codes(frame["source"], categories=manifest["sources"])
+            yield frame
+
+
+def load_events(directory, scenarios=None, replications=None, columns=COLUMNS, names=True):
+    """Concatenates the exported events of the selected runs into one DataFrame, see iter_events"""
+    import pandas as pd
+    frames = list(iter_events(directory, scenarios, replications, columns, names))
+    if not frames:
+        return pd.DataFrame(columns=["scenario", "replication"] + list(columns))
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,313 @@
+import numpy as np
+from stats import estimate_moments
+
+# The fluid engine advances every replication of a line together in fixed
+# time steps. The state of R replications of a line of M machines and B
+# buffers lives in (R, M) and (R, B) arrays, and each step moves all of them
+# at once with numpy, so the Python cost of a step does not depend on R.
+#
+# It follows the rules of entities.Machine: a machine takes a full batch
+# from its in buffer, processes it, fails the batch or yields a normal
+# amount, and waits until the out buffer has room for it. Breakdowns come
+# from a clock of exponential working time and last a log-normal repair
+# time, and freeze the batch in process. Buffer moves inside a step happen
+# at the end of the step, while a machine that finishes early in a step
+# carries the rest of the step into its next batch, so no process time is
+# lost to the grid and statistics converge to the SimPy model as dt shrinks.
+#
+# The state takes about a hundred bytes per replication and machine, so
+# thousands of replications of the full plant do not fit in memory at once.
+# replicate runs them in blocks sized to a memory budget and merges the
+# per column counts, means and squared deviations of the blocks, keeping
+# only one block's state at a time.
+
+# the bytes a replication of one machine takes while simulating, measured on the full plant
+BYTES_PER_MACHINE = 120
+MEMORY_BUDGET = 256 * 2 ** 20
+STATISTICS = {
+    "machines": ("number_finished", "failures", "breakdowns"),
+    "buffers": ("mean_level", "max_level", "final_level"),
+}
+
+
+class FluidLine(object):
+    """The per machine parameters of a line laid out as numpy arrays
+
+    Attributes:
+        spec            The line.LineSpec
+        names           The machine names, in the order of the machine axis
+        stage_of        The stage index of each machine
+        stage_slices    The slice of the machine axis holding each stage
+        calendars       The shift calendar of each stage, None for 24/7
+        parameters      A dict of arrays over machines: batch_size, cycle_time,
+                        cycle_time_sigma, good_amount, yield_sigma,
+                        batch_failure_rate, mtbf, mttr, repair_std_dev
+        capacities      The capacity of each buffer
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.names = []
+        self.stage_slices = []
+        stage_of = []
+        columns = {
+            "batch_size": [],
+            "cycle_time": [],
+            "cycle_time_sigma": [],
+            "good_amount": [],
+            "yield_sigma": [],
+            "batch_failure_rate": [],
+            "mtbf": [],
+            "mttr": [],
+            "repair_std_dev": [],
+        }
+        for i, stage in enumerate(spec.stages):
+            start = len(self.names)
+            for j in range(stage.units):
+                self.names.append(f'{stage.name}{j + 1}')
+                stage_of.append(i)
+                columns["batch_size"].append(stage.batch_size)
+                columns["cycle_time"].append(stage.cycle_time)
+                columns["cycle_time_sigma"].append(stage.cycle_time_sigma)
+                columns["good_amount"].append(stage.batch_size * stage.yield_rate)
+                columns["yield_sigma"].append(stage.yield_sigma)
+                columns["batch_failure_rate"].append(stage.batch_failure_rate)
+                columns["mtbf"].append(stage.mtbf or 0)
+                columns["mttr"].append(stage.mttr or 0)
+                columns["repair_std_dev"].append(stage.repair_std_dev or 0)
+            self.stage_slices.append(slice(start, len(self.names)))
+        self.stage_of = np.array(stage_of, dtype=int)
+        self.calendars = [stage.calendar for stage in spec.stages]
+        self.parameters = {name: np.array(values, dtype=float) for name, values in columns.items()}
+        self.capacities = np.array(
+            [stage.buffer_capacity for stage in spec.stages] + [float('inf')], dtype=float)
+
+
+def _lognormal(generator, mean, sigma):
+    """Draws log-normal variates with the given means and deviations"""
+    mean = np.maximum(mean, 1e-12)
+    log_variance = np.log1p((sigma / mean) ** 2)
+    return generator.lognormal(np.log(mean) - log_variance / 2, np.sqrt(log_variance))
+
+
+def _grant(requests, available):
+    """Grants requests in machine order while their running total fits the available amount
+
+    Parameters:
+    requests (numpy.ndarray): The amount each machine asks for, 0 for none, shape (R, n)
+    available (numpy.ndarray): The amount available in each replication, shape (R,)
+
+    Returns:
+    numpy.ndarray: Which requests are granted, shape (R, n)
+    """
+    return (requests > 0) & (np.cumsum(requests, axis=1) <= available[:, None] + 1e-9)
+
+
+def simulate(spec, horizon, replications, dt=None, seed=0):
+    """Simulates replications of a line in lockstep
+
+    The state of all replications is held at once, about BYTES_PER_MACHINE
+    per replication and machine, see replicate for runs too large for that
+
+    Parameters:
+    spec (line.LineSpec): The line
+    horizon (float): The time to run until
+    replications (int): The number of replications
+    dt (float): The time step, a tenth of the shortest cycle time when None
+    seed (int or numpy.random.SeedSequence): The seed of the numpy generator
+
+    Returns:
+    dict: Arrays of per replication results: number_finished, failures and
+    breakdowns of shape (R, machines), mean_level, max_level and final_level
+    of shape (R, buffers)
+    """
+    line = FluidLine(spec)
+    p = line.parameters
+    generator = np.random.default_rng(seed)
+    r = replications
+    m = len(line.names)
+    b = len(line.capacities)
+    if dt is None:
+        dt = float(p["cycle_time"].min()) / 10
+    # state
+    level = np.zeros((r, b))
+    holding = np.zeros((r, m), dtype=bool)
+    remaining = np.zeros((r, m))
+    pending = np.zeros((r, m))
+    has_mtbf = p["mtbf"] > 0
+    up = np.ones((r, m), dtype=bool)
+    time_to_failure = np.where(has_mtbf, generator.exponential(np.where(has_mtbf, p["mtbf"], 1), (r, m)), np.inf)
+    repair_left = np.zeros((r, m))
+    next_delivery = np.maximum(generator.normal(spec.delivery_time, spec.delivery_time_sigma, r), 0)
+    # results
+    number_finished = np.zeros((r, m))
+    failures = np.zeros((r, m))
+    breakdowns = np.zeros((r, m))
+    level_area = np.zeros((r, b))
+    max_level = np.zeros((r, b))
+
+    steps = int(np.ceil(horizon / dt))
+    for step in range(steps):
+        start = step * dt
+        end = min(start + dt, horizon)
+        step_length = end - start
+        # working time of each machine in this step
+        work = np.empty(m)
+        for i, calendar in enumerate(line.calendars):
+            work[line.stage_slices[i]] = step_length if calendar is None else calendar.working_time(start, end)
+
+        # deliveries due in this step
+        arriving = next_delivery <= end
+        while arriving.any():
+            amounts = generator.normal(spec.delivery_size, spec.delivery_size_sigma, r)
+            level[:, 0] += np.where(arriving, amounts, 0)
+            gaps = np.maximum(generator.normal(spec.delivery_time, spec.delivery_time_sigma, r), 0)
+            next_delivery = np.where(arriving, next_delivery + gaps, next_delivery)
+            arriving = next_delivery <= end
+
+        # failure clocks and repairs
+        time_to_failure -= np.where(up, work, 0)
+        breaking = up & (time_to_failure <= 0)
+        if breaking.any():
+            rows, columns = np.nonzero(breaking)
+            repair_left[rows, columns] = _lognormal(generator, p["mttr"][columns], p["repair_std_dev"][columns])
+            up[rows, columns] = False
+            breakdowns[rows, columns] += 1
+        repair_left -= np.where(up, 0, work)
+        repairing = ~up & ~breaking
+        repaired = repairing & (repair_left <= 0)
+        if repaired.any():
+            rows, columns = np.nonzero(repaired)
+            up[rows, columns] = True
+            # the clock restarts with whatever part of the step is left after the repair
+            time_to_failure[rows, columns] = generator.exponential(p["mtbf"][columns]) + repair_left[rows, columns]
+
+        # processing, a machine that finishes early in the step keeps the rest of it as slack
+        remaining -= np.where(up & holding, work, 0)
+        finishing = holding & (remaining <= 0)
+        slack = np.zeros((r, m))
+        if finishing.any():
+            rows, columns = np.nonzero(finishing)
+            slack[rows, columns] = -remaining[rows, columns]
+            failed = generator.random(len(rows)) < p["batch_failure_rate"][columns]
+            amounts = generator.normal(p["good_amount"][columns], p["yield_sigma"][columns])
+            pending[rows, columns] = np.where(failed, 0, amounts)
+            failures[rows[failed], columns[failed]] += 1
+            holding[rows, columns] = False
+            remaining[rows, columns] = 0
+
+        for i, stage_slice in enumerate(line.stage_slices):
+            # push finished batches into the out buffer while there is room
+            out = i + 1
+            room = line.capacities[out] - level[:, out]
+            requests = np.where(up[:, stage_slice], pending[:, stage_slice], 0)
+            granted = _grant(requests, room)
+            pushed = np.where(granted, requests, 0)
+            level[:, out] += pushed.sum(axis=1)
+            number_finished[:, stage_slice] += pushed
+            pending[:, stage_slice] -= pushed
+            # a machine still blocked has no slack left to start its next batch with
+            slack[:, stage_slice] = np.where(pending[:, stage_slice] > 0, 0, slack[:, stage_slice])
+            # idle machines take a full batch from the in buffer
+            idle = up[:, stage_slice] & ~holding[:, stage_slice] & (pending[:, stage_slice] <= 0)
+            requests = np.where(idle, p["batch_size"][stage_slice], 0)
+            granted = _grant(requests, level[:, i])
+            level[:, i] -= np.where(granted, requests, 0).sum(axis=1)
+            if granted.any():
+                rows, columns = np.nonzero(granted)
+                columns = columns + stage_slice.start
+                holding[rows, columns] = True
+                remaining[rows, columns] = generator.normal(
+                    p["cycle_time"][columns], p["cycle_time_sigma"][columns]) - slack[rows, columns]
+
+        level_area += level * step_length
+        np.maximum(max_level, level, out=max_level)
+
+    return {
+        "machines": line.names,
+        "buffers": ["Start-Buffer"] + [f'{stage.name}-Buffer' for stage in spec.stages[1:]] + ["End-Buffer"],
+        "number_finished": number_finished,
+        "failures": failures,
+        "breakdowns": breakdowns,
+        "mean_level": level_area / horizon,
+        "max_level": max_level,
+        "final_level": level,
+    }
+
+
+def _moments(results):
+    """Returns the (count, column means, column sums of squared deviations) of every statistic of simulate results"""
+    moments = {}
+    for keys in STATISTICS.values():
+        for key in keys:
+            values = results[key]
+            means = values.mean(axis=0)
+            moments[key] = (values.shape[0], means, ((values - means) ** 2).sum(axis=0))
+    return moments
+
+
+def _merge(moments, other):
+    """Merges the moments of two blocks of replications with Chan's pairwise update"""
+    merged = {}
+    for key, (n, means, squares) in moments.items():
+        other_n, other_means, other_squares = other[key]
+        total = n + other_n
+        delta = other_means - means
+        merged[key] = (
+            total, means + delta * other_n / total, squares + other_squares + delta * delta * n * other_n / total)
+    return merged
+
+
+def _summary(names, moments, confidence):
+    """Builds the summary layout from merged moments, names holding the machine and buffer names"""
+    summary = {"machines": {}, "buffers": {}}
+    for group, keys in STATISTICS.items():
+        for key in keys:
+            for name, value in zip(names[group], estimate_moments(*moments[key], confidence)):
+                summary[group].setdefault(name, {})[key] = value
+    return summary
+
+
+def summarize(results, confidence=0.95):
+    """Aggregates fluid results into the layout of replication.summarize
+
+    Parameters:
+    results (dict): The arrays returned by simulate
+    confidence (float): The confidence level of the intervals
+
+    Returns:
+    dict: A stats.Estimate for every machine and buffer statistic
+    """
+    return _summary(results, _moments(results), confidence)
+
+
+def replicate(spec, horizon, replications, dt=None, seed=0, chunk=None, confidence=0.95):
+    """Simulates replications of a line in blocks and summarizes them all
+
+    Only one block of replications is held at a time and the blocks merge
+    through their column moments, so memory follows chunk, not replications.
+    Every block draws from its own child of the seed, so the results depend
+    on chunk as well as on seed
+
+    Parameters:
+    spec (line.LineSpec): The line
+    horizon (float): The time to run until
+    replications (int): The number of replications
+    dt (float): The time step, a tenth of the shortest cycle time when None
+    seed (int): The seed the block generators derive from
+    chunk (int): The replications per block, as many as fit MEMORY_BUDGET when None
+    confidence (float): The confidence level of the intervals
+
+    Returns:
+    dict: A stats.Estimate for every machine and buffer statistic, as summarize
+    """
+    if chunk is None:
+        machines = sum(stage.units for stage in spec.stages)
+        chunk = max(1, MEMORY_BUDGET // (BYTES_PER_MACHINE * max(machines, 1)))
+    sizes = [min(chunk, replications - start) for start in range(0, replications, chunk)]
+    moments = None
+    for size, block_seed in zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))):
+        results = simulate(spec, horizon, size, dt, block_seed)
+        block = _moments(results)
+        moments = block if moments is None else _merge(moments, block)
+    return _summary(results, moments, confidence)
@@ -0,0 +1,253 @@
+from entities import Machine, MachinePool, Buffer
+from lots import LotTracker
+from rng import NormalStream
+from eventlog import TRACE, ARRIVED
+
+
+class StageSpec(object):
+    """Describes one stage of identical machines in a serial line
+    The spec holds no simpy objects so it can be pickled and sent to worker processes
+
+    Attributes:
+        name                The name of the stage (Strip-Caster, etc)
+        units               The number of identical machines working in parallel
+        cycle_time          The average time to complete the process
+        cycle_time_sigma    The standard deviation of the process time
+        yield_rate          The fraction of a batch that comes out good
+        yield_sigma         The standard deviation of the yielded amount
+        batch_failure_rate  The rate at which batches fail
+        mtbf                The mean time between machine failures
+        mttr                The mean time to repair
+        repair_std_dev      The standard deviation time for repairs
+        batch_size          The amount each machine takes from its in buffer per cycle
+        buffer_capacity     The capacity of the buffer feeding the stage
+        calendar            The shifts.ShiftCalendar the stage works, None for 24/7 operation
+    """
+
+    def __init__(
+            self,
+            name,
+            units,
+            cycle_time,
+            cycle_time_sigma,
+            yield_rate,
+            yield_sigma,
+            batch_failure_rate,
+            mtbf,
+            mttr,
+            repair_std_dev,
+            batch_size,
+            buffer_capacity=float('inf'),
+            calendar=None,
+            ):
+        self.name = name
+        self.units = units
+        self.cycle_time = cycle_time
+        self.cycle_time_sigma = cycle_time_sigma
+        self.yield_rate = yield_rate
+        self.yield_sigma = yield_sigma
+        self.batch_failure_rate = batch_failure_rate
+        self.mtbf = mtbf
+        self.mttr = mttr
+        self.repair_std_dev = repair_std_dev
+        self.batch_size = batch_size
+        self.buffer_capacity = buffer_capacity
+        self.calendar = calendar
+
+
+class LineSpec(object):
+    """Describes a serial line of stages fed by regular deliveries
+    Stage i pulls from buffer i and pushes to buffer i + 1, so a line of
+    n stages has n + 1 buffers and the last one collects finished goods
+
+    Attributes:
+        stages              The list of StageSpec in process order
+        delivery_size       The average amount of each delivery
+        delivery_size_sigma The standard deviation of the delivery amount
+        delivery_time       The average time between deliveries
+        delivery_time_sigma The standard deviation of the time between deliveries
+    """
+
+    def __init__(
+            self,
+            stages,
+            delivery_size,
+            delivery_size_sigma=0,
+            delivery_time=1,
+            delivery_time_sigma=0,
+            ):
+        self.stages = list(stages)
+        self.delivery_size = delivery_size
+        self.delivery_size_sigma = delivery_size_sigma
+        self.delivery_time = delivery_time
+        self.delivery_time_sigma = delivery_time_sigma
+
+
+def gen_arrivals(env, start_buffer, delivery_times, delivery_sizes, event_log=None, lots=None):
+    """
+    start the process for each part by putting part in starting buffer
+    delivery_times and delivery_sizes are the rng.NormalStream objects of the gaps and amounts
+    every delivery becomes a lot when a lots.LotTracker is given
+    """
+    trace_log = event_log if event_log is not None and event_log.enabled(TRACE) else None
+    log_id = event_log.register("Deliveries") if event_log is not None else None
+    while True:
+        yield env.timeout(delivery_times.next())
+        delivered_amount = delivery_sizes.next()
+        if trace_log is not None:
+            trace_log.record(env.now, log_id, ARRIVED, delivered_amount)
+        yield start_buffer.put(delivered_amount)
+        if lots is not None:
+            lots.deliver(start_buffer, delivered_amount, env.now)
+
+
+class Line(object):
+    """The simpy objects of a serial line built from a LineSpec
+
+    Attributes:
+        env         The simpy environment or engine.Engine in which the line operates
+        spec        The LineSpec the line was built from
+        buffers     The buffers in process order, starting with the delivery buffer
+        stages      A list holding the list of machines in each stage, one MachinePool for a pooled stage
+        arrivals    The delivery process feeding the first buffer
+        delivery_times  The stream of times between deliveries
+        delivery_sizes  The stream of delivered amounts
+        seed        The seed every random stream of the line derives from
+        event_log   The eventlog.EventLog the line reports to, None to log nothing
+        history     Whether machines and buffers keep their full histories in memory
+        antithetic  Whether every random stream draws antithetic variates
+        lots        The lots.LotTracker following material through the line, None when not tracking
+        pool_units  Stages of at least this many units run as one entities.MachinePool, None to never pool
+        statistics  Whether machines and buffers keep streaming statistics, see stats.RunningStats
+    """
+
+    def __init__(
+            self,
+            env,
+            spec,
+            seed=None,
+            event_log=None,
+            history=True,
+            antithetic=False,
+            track_lots=False,
+            pool_units=None,
+            statistics=False,
+            ):
+        self.env = env
+        self.spec = spec
+        self.seed = seed
+        self.event_log = event_log
+        self.history = history
+        self.statistics = statistics
+        # buffer i feeds stage i and the last buffer collects finished goods, an engine.Engine brings its own buffers
+        buffer_type = getattr(env, "buffer_type", Buffer)
+        self.buffers = []
+        for i, stage in enumerate(spec.stages):
+            name = "Start-Buffer" if i == 0 else f'{stage.name}-Buffer'
+            self.buffers.append(buffer_type(
+                env, capacity=stage.buffer_capacity, name=name, history=history, event_log=event_log,
+                statistics=statistics))
+        self.buffers.append(buffer_type(
+            env, name="End-Buffer", history=history, event_log=event_log, statistics=statistics))
+        self.lots = LotTracker(self.buffers) if track_lots else None
+        self.pool_units = pool_units
+        self.stages = []
+        for i, stage in enumerate(spec.stages):
+            machines = []
+            if pool_units is not None and stage.units >= pool_units:
+                machines.append(MachinePool(
+                    env,
+                    name = stage.name,
+                    item_type = stage.name,
+                    in_buffer = self.buffers[i],
+                    out_buffer = self.buffers[i + 1],
+                    units = stage.units,
+                    cycle_time = stage.cycle_time,
+                    cycle_time_sigma = stage.cycle_time_sigma,
+                    yield_rate = stage.yield_rate,
+                    yield_sigma = stage.yield_sigma,
+                    batch_failure_rate = stage.batch_failure_rate,
+                    mtbf = stage.mtbf,
+                    mttr = stage.mttr,
+                    repair_std_dev = stage.repair_std_dev,
+                    batch_size = stage.batch_size,
+                    seed = seed,
+                    event_log = event_log,
+                    calendar = stage.calendar,
+                    history = history,
+                    stage = i,
+                    lots = self.lots,
+                    statistics = statistics,
+                ))
+                self.stages.append(machines)
+                continue
+            for j in range(stage.units):
+                machines.append(Machine(
+                    env,
+                    name = f'{stage.name}{j + 1}',
+                    item_type = stage.name,
+                    in_buffer = self.buffers[i],
+                    out_buffer = self.buffers[i + 1],
+                    cycle_time = stage.cycle_time,
+                    cycle_time_sigma = stage.cycle_time_sigma,
+                    yield_rate = stage.yield_rate,
+                    yield_sigma = stage.yield_sigma,
+                    batch_failure_rate = stage.batch_failure_rate,
+                    mtbf = stage.mtbf,
+                    mttr = stage.mttr,
+                    repair_std_dev = stage.repair_std_dev,
+                    batch_size = stage.batch_size,
+                    seed = seed,
+                    event_log = event_log,
+                    calendar = stage.calendar,
+                    history = history,
+                    stage = i,
+                    lots = self.lots,
+                    statistics = statistics,
+                ))
+            self.stages.append(machines)
+        self.delivery_times = NormalStream(
+            seed, ("deliveries", "delivery_time"), spec.delivery_time, spec.delivery_time_sigma)
+        self.delivery_sizes = NormalStream(
+            seed, ("deliveries", "delivery_size"), spec.delivery_size, spec.delivery_size_sigma)
+        self.arrivals = env.process(gen_arrivals(
+            env,
+            self.buffers[0],
+            self.delivery_times,
+            self.delivery_sizes,
+            event_log,
+            self.lots,
+        ))
+        self.antithetic = antithetic
+        if antithetic:
+            for stream in self.streams():
+                stream.antithetic = True
+
+    @property
+    def machines(self):
+        """All machines and machine pools of the line in process order"""
+        return [machine for machines in self.stages for machine in machines]
+
+    def streams(self):
+        """Returns every random stream of the line"""
+        streams = [self.delivery_times, self.delivery_sizes]
+        for machine in self.machines:
+            streams.extend(machine.streams())
+        return streams
+
+    def reseed(self, seed):
+        """Switches every random stream to another seed, the state of the line is kept
+        Timeouts already scheduled keep their drawn durations, every later draw comes from the new seed
+        """
+        self.seed = seed
+        for stream in self.streams():
+            stream.reseed(seed)
+        for machine in self.machines:
+            machine.seed = seed
+
+    def reset_statistics(self):
+        """Starts the statistics of every machine and buffer over at the current time"""
+        for machine in self.machines:
+            machine.reset_statistics()
+        for buffer in self.buffers:
+            buffer.record.reset(self.env.now)
@@ -0,0 +1,183 @@
+from array import array
+from collections import deque
+import numpy as np
+
+# lot status
+IN_PROCESS = 0
+DONE = 1
+SCRAPPED = 2
+
+# the stage of a delivery lot, machine lots carry the index of their stage
+DELIVERY = -1
+
+
+class LotTracker(object):
+    """Tracks lots of material through a line in a struct-of-arrays table
+
+    Every delivery is a lot, and every batch a machine takes is a new lot
+    made from the front of the lots waiting in its in buffer, so batches
+    of a different size than the lots before them merge or split lots.
+    The genealogy table records how much of which lot went into each
+    batch. A lot is a row in typed arrays rather than an object, about 60
+    bytes per lot and 24 per genealogy link, and the only per-lot Python
+    objects are the ids and amounts queued in the buffers
+
+    Attributes:
+        stage       The stage index of each lot, DELIVERY for deliveries
+        started     The time each lot was delivered or taken into a machine
+        finished    The time each lot was delivered, pushed on or scrapped, nan while in process
+        amount_in   The amount that went into each lot
+        amount_out  The amount each lot came out with after yield loss, 0 when scrapped
+        origin      The delivery lot the oldest material of each lot came from
+        arrived     The delivery time of the oldest material in each lot
+        status      IN_PROCESS, DONE or SCRAPPED
+        children    The lot of each genealogy link
+        parents     The lot that fed the child of each genealogy link
+        shares      The amount of the parent that went into the child of each link
+    """
+
+    def __init__(self, buffers):
+        self.stage = array('h')
+        self.started = array('d')
+        self.finished = array('d')
+        self.amount_in = array('d')
+        self.amount_out = array('d')
+        self.origin = array('q')
+        self.arrived = array('d')
+        self.status = array('b')
+        self.children = array('q')
+        self.parents = array('q')
+        self.shares = array('d')
+        # the lots waiting in each buffer, oldest first, with the amount of each still there
+        self._queues = {buffer.name: (deque(), deque()) for buffer in buffers}
+
+    def __len__(self):
+        return len(self.stage)
+
+    def _new(self, stage, started, amount, origin, arrived):
+        lot = len(self.stage)
+        self.stage.append(stage)
+        self.started.append(started)
+        self.finished.append(float('nan'))
+        self.amount_in.append(amount)
+        self.amount_out.append(0.0)
+        self.origin.append(origin)
+        self.arrived.append(arrived)
+        self.status.append(IN_PROCESS)
+        return lot
+
+    def deliver(self, buffer, amount, now):
+        """Adds a delivery lot to the buffer it was put into and returns its id"""
+        lot = self._new(DELIVERY, now, amount, len(self.stage), now)
+        self.finished[lot] = now
+        self.amount_out[lot] = amount
+        self.status[lot] = DONE
+        ids, amounts = self._queues[buffer.name]
+        ids.append(lot)
+        amounts.append(amount)
+        return lot
+
+    def start(self, buffer, stage, amount, now):
+        """Takes amount from the front of the lots in a buffer into a new lot and returns its id"""
+        ids, amounts = self._queues[buffer.name]
+        lot = len(self.stage)
+        if ids:
+            # the front lot holds the oldest material
+            origin = self.origin[ids[0]]
+            arrived = self.arrived[ids[0]]
+        else:
+            origin = lot
+            arrived = now
+        self._new(stage, now, amount, origin, arrived)
+        needed = amount
+        while needed > 1e-9 and ids:
+            parent = ids[0]
+            available = amounts[0]
+            taken = min(available, needed)
+            self.children.append(lot)
+            self.parents.append(parent)
+            self.shares.append(taken)
+            needed -= taken
+            if available - taken <= 1e-9:
+                ids.popleft()
+                amounts.popleft()
+            else:
+                amounts[0] = available - taken
+        return lot
+
+    def finish(self, lot, buffer, amount, now):
+        """Records that a lot was pushed into the next buffer with amount after yield loss"""
+        self.finished[lot] = now
+        self.amount_out[lot] = amount
+        self.status[lot] = DONE
+        ids, amounts = self._queues[buffer.name]
+        ids.append(lot)
+        amounts.append(amount)
+
+    def scrap(self, lot, now):
+        """Records that a lot failed as a batch and left the line"""
+        self.finished[lot] = now
+        self.status[lot] = SCRAPPED
+
+    def waiting(self, buffer):
+        """Returns the ids and remaining amounts of the lots in a buffer, oldest first"""
+        ids, amounts = self._queues[buffer.name]
+        return np.array(ids, dtype=np.int64), np.array(amounts, dtype=np.float64)
+
+    def wip_ages(self, buffer, now):
+        """Returns the time since delivery of the oldest material of every lot in a buffer"""
+        ids, _ = self.waiting(buffer)
+        return now - self.to_numpy()["arrived"][ids]
+
+    def to_numpy(self):
+        """Returns a copy of every column of the lot table as a numpy array
+
+        A view over the columns would lock them against the appends of a
+        running line, so the table may be read at any time of the run
+        """
+        columns = {}
+        for name in ("stage", "started", "finished", "amount_in", "amount_out", "origin", "arrived", "status"):
+            column = getattr(self, name)
+            columns[name] = np.array(column, dtype=column.typecode)
+        return columns
+
+    def genealogy(self):
+        """Returns a copy of the (child, parent, share) links as numpy arrays"""
+        return tuple(
+            np.array(column, dtype=column.typecode) for column in (self.children, self.parents, self.shares))
+
+    def lead_times(self, stage):
+        """Returns the time from delivery of the oldest material to the end of stage for every lot done there"""
+        table = self.to_numpy()
+        done = (table["stage"] == stage) & (table["status"] == DONE)
+        return table["finished"][done] - table["arrived"][done]
+
+    def stage_times(self, stage):
+        """Returns the time from start to push on of every lot done at a stage, processing and blocking"""
+        table = self.to_numpy()
+        done = (table["stage"] == stage) & (table["status"] == DONE)
+        return table["finished"][done] - table["started"][done]
+
+    def queue_times(self, stage):
+        """Returns the time each genealogy link of a stage's lots waited in the buffer and the amount that waited
+
+        Returns:
+        tuple: The waiting times and the amounts, for amount weighted statistics
+        """
+        table = self.to_numpy()
+        children, parents, shares = self.genealogy()
+        links = table["stage"][children] == stage
+        return table["started"][children[links]] - table["finished"][parents[links]], shares[links]
+
+    def yield_loss(self, stage):
+        """Returns the amount lost to yield and scrap at a stage"""
+        table = self.to_numpy()
+        lots = (table["stage"] == stage) & (table["status"] != IN_PROCESS)
+        return float(table["amount_in"][lots].sum() - table["amount_out"][lots].sum())
+
+    def to_frame(self):
+        """Returns the lot table as a pandas DataFrame indexed by lot id"""
+        import pandas as pd
+        frame = pd.DataFrame(self.to_numpy())
+        frame.index.name = "lot"
+        return frame
@@ -0,0 +1,309 @@
+from array import array
+import numpy as np
+
+# machine states
+BUSY = 0
+STARVED = 1
+BLOCKED = 2
+DOWN = 3
+OFF_SHIFT = 4
+STATE_NAMES = ("busy", "starved", "blocked", "down", "off_shift")
+
+
+class StateClock(object):
+    """Accumulates the time a machine spends in each state
+    Time is only added when the state changes, so the totals cost nothing
+    between transitions and need no event history. With a shift calendar the
+    time outside of shifts goes to OFF_SHIFT whatever the machine's state.
+    With history the clock also keeps the time and new state of every
+    change, which state_matrix samples onto a time grid
+
+    Attributes:
+        state       The current state
+        since       The time the current state was entered
+        totals      The time spent in each state before since, indexed by state
+        calendar    The shifts.ShiftCalendar splitting off shift time, None for 24/7
+        history     Whether the changes of state are kept
+        times       The times at which the state changed
+        states      The state entered at each change
+    """
+
+    def __init__(self, now, state=STARVED, calendar=None, history=False):
+        self.state = state
+        self.since = now
+        self.totals = [0.0] * len(STATE_NAMES)
+        self.calendar = calendar
+        self.history = history
+        self.times = array('d')
+        self.states = array('b')
+        if history:
+            self.times.append(now)
+            self.states.append(state)
+
+    def _add(self, totals, state, start, end):
+        """Adds the time from start to end to state, or to OFF_SHIFT outside of shifts"""
+        elapsed = end - start
+        if self.calendar is not None:
+            working = self.calendar.working_time(start, end)
+            totals[OFF_SHIFT] += elapsed - working
+            elapsed = working
+        totals[state] += elapsed
+
+    def enter(self, now, state):
+        """Switches to state at now"""
+        if now > self.since:
+            self._add(self.totals, self.state, self.since, now)
+        if self.history and state != self.state:
+            self.times.append(now)
+            self.states.append(state)
+        self.since = now
+        self.state = state
+
+    def reset(self, now):
+        """Starts the totals over at now, the history is kept"""
+        self.totals = [0.0] * len(STATE_NAMES)
+        self.since = now
+
+    def snapshot(self, now):
+        """Returns the time spent in each state up to now, keyed by state name"""
+        totals = list(self.totals)
+        if now > self.since:
+            self._add(totals, self.state, self.since, now)
+        return dict(zip(STATE_NAMES, totals))
+
+    def to_numpy(self):
+        """Returns a copy of the history as two numpy arrays of times and states, safe to hold while the run goes on"""
+        return (
+            np.array(self.times, dtype=np.float64),
+            np.array(self.states, dtype=np.int8),
+        )
+
+
+class PoolClock(object):
+    """Accumulates the unit time the machines of an entities.MachinePool spend in each state
+    The clock counts the units in each state and adds count times elapsed
+    time to every state when a unit changes state, so the totals are unit
+    hours and summing them gives units times the elapsed time, as summing
+    the StateClock of every machine would. Off shift time counts all units
+
+    Attributes:
+        units       The number of units in the pool
+        counts      The number of units in each state, indexed by state
+        since       The time of the last change
+        totals      The unit time spent in each state before since, indexed by state
+        calendar    The shifts.ShiftCalendar splitting off shift time, None for 24/7
+        history     Always False, a pool keeps no changes of state
+    """
+
+    def __init__(self, now, units, calendar=None):
+        self.units = units
+        self.counts = [0] * len(STATE_NAMES)
+        self.counts[STARVED] = units
+        self.since = now
+        self.totals = [0.0] * len(STATE_NAMES)
+        self.calendar = calendar
+        self.history = False
+
+    def _add(self, totals, start, end):
+        """Adds the time from start to end for the units in each state, or to OFF_SHIFT outside of shifts"""
+        elapsed = end - start
+        if self.calendar is not None:
+            working = self.calendar.working_time(start, end)
+            totals[OFF_SHIFT] += (elapsed - working) * self.units
+            elapsed = working
+        for state, units in enumerate(self.counts):
+            if units:
+                totals[state] += units * elapsed
+
+    def move(self, now, old, new):
+        """Moves one unit from state old to state new at now"""
+        if now > self.since:
+            self._add(self.totals, self.since, now)
+            self.since = now
+        self.counts[old] -= 1
+        self.counts[new] += 1
+
+    def reset(self, now):
+        """Starts the totals over at now"""
+        self.totals = [0.0] * len(STATE_NAMES)
+        self.since = now
+
+    def snapshot(self, now):
+        """Returns the unit time spent in each state up to now, keyed by state name"""
+        totals = list(self.totals)
+        if now > self.since:
+            self._add(totals, self.since, now)
+        return dict(zip(STATE_NAMES, totals))
+
+
+def machine_metrics(machine, now):
+    """Summarizes the state times and output of a machine up to now
+
+    Parameters:
+    machine (entities.Machine): The machine, or an entities.MachinePool for its units together
+    now (float): The time to summarize up to, usually env.now
+
+    Returns:
+    dict: The time in each state, the utilization, availability, performance,
+    quality and OEE of the machine
+    """
+    metrics = machine.state_clock.snapshot(now)
+    total = sum(metrics.values())
+    planned = total - metrics["off_shift"]
+    uptime = planned - metrics["down"]
+    processed = (machine.batches_good + machine.batches_failed) * machine.batch_size
+    metrics["utilization"] = metrics["busy"] / planned if planned > 0 else 0.0
+    metrics["availability"] = uptime / planned if planned > 0 else 0.0
+    metrics["performance"] = metrics["busy"] / uptime if uptime > 0 else 0.0
+    metrics["quality"] = machine.number_finished / processed if processed > 0 else 0.0
+    metrics["oee"] = metrics["availability"] * metrics["performance"] * metrics["quality"]
+    return metrics
+
+
+def stage_metrics(machines, now):
+    """Rolls up the metrics of the machines of a stage
+
+    Parameters:
+    machines (list): The entities.Machine or entities.MachinePool objects of the stage
+    now (float): The time to summarize up to
+
+    Returns:
+    dict: The state times summed over machines and the machine averages of the ratios,
+    a pool weighing as much as its units
+    """
+    ratios = ("utilization", "availability", "performance", "quality", "oee")
+    rollup = {}
+    units = 0
+    for machine in machines:
+        for key, value in machine_metrics(machine, now).items():
+            if key in ratios:
+                value *= machine.units
+            rollup[key] = rollup.get(key, 0.0) + value
+        units += machine.units
+    for key in ratios:
+        rollup[key] = rollup.get(key, 0.0) / max(units, 1)
+    rollup["units"] = units
+    return rollup
+
+
+def line_metrics(line, now):
+    """Returns stage_metrics for every stage of a line.Line, keyed by stage name"""
+    return {
+        machines[0].type: stage_metrics(machines, now)
+        for machines in line.stages
+        if machines
+    }
+
+
+def bottleneck(line, now):
+    """Names the stage whose machines are least often starved or blocked
+
+    The stage that is active, busy or down, for the largest share of its
+    planned time is the one holding the rest of the line back
+
+    Parameters:
+    line (line.Line): The line
+    now (float): The time to judge up to
+
+    Returns:
+    str: The name of the bottleneck stage
+    """
+    def active_share(metrics):
+        planned = metrics["busy"] + metrics["starved"] + metrics["blocked"] + metrics["down"]
+        return (metrics["busy"] + metrics["down"]) / planned if planned > 0 else 0.0
+    stages = line_metrics(line, now)
+    return max(stages, key=lambda name: active_share(stages[name]))
+
+
+def _sample(times, values, grid):
+    """Returns the value in force at every grid time of a series of changes
+
+    The changes are sorted once, stably so that of several changes at the
+    same time the last one recorded wins, and each grid time is looked up
+    with a binary search. Grid times before the first change take its value
+
+    Parameters:
+    times (numpy.ndarray): The times of the changes
+    values (numpy.ndarray): The value after each change
+    grid (numpy.ndarray): The sorted times to sample at
+
+    Returns:
+    numpy.ndarray: The value at each grid time
+    """
+    if len(times) > 1 and (np.diff(times) < 0).any():
+        order = np.argsort(times, kind="stable")
+        times = times[order]
+        values = values[order]
+    index = np.searchsorted(times, grid, side="right") - 1
+    return values[np.maximum(index, 0)]
+
+
+class StateMatrix(object):
+    """The states of machines and levels of buffers sampled on a time grid
+
+    Attributes:
+        times       The grid times
+        machines    The machine names, one column of states each
+        buffers     The buffer names, one column of levels each
+        states      The machine states, an int8 array of shape (times, machines)
+        levels      The buffer levels, a float array of shape (times, buffers)
+    """
+
+    def __init__(self, times, machines, buffers, states, levels):
+        self.times = times
+        self.machines = machines
+        self.buffers = buffers
+        self.states = states
+        self.levels = levels
+
+    def to_frame(self):
+        """Returns the matrix as a pandas DataFrame with a time column and one column per entity"""
+        import pandas as pd
+        frame = pd.DataFrame(self.states, columns=self.machines)
+        for column, name in enumerate(self.buffers):
+            frame[name] = self.levels[:, column]
+        frame.insert(0, "time", self.times)
+        return frame
+
+
+def state_matrix(machines, buffers=(), step=0.1, start=0.0, end=None):
+    """Samples the state of machines and the level of buffers on a regular time grid in one pass
+
+    Every column is filled from the history of its entity with one binary
+    search over the grid, so the cost grows with the grid and the changes
+    of each entity but never copies a table per column. The machines and
+    buffers must keep their histories, see line.Line
+
+    Parameters:
+    machines (list): The entities.Machine objects, one column each
+    buffers (list): The entities.Buffer objects, one column each
+    step (float): The spacing of the grid
+    start (float): The first grid time
+    end (float): The last grid time, the current simulation time when None
+
+    Returns:
+    StateMatrix: The states and levels at every grid time
+    """
+    entities = list(machines) + list(buffers)
+    if end is None:
+        end = entities[0].env.now if entities else start
+    times = np.arange(start, end + step / 2, step)
+    states = np.empty((len(times), len(machines)), dtype=np.int8)
+    levels = np.empty((len(times), len(buffers)), dtype=np.float64)
+    for column, machine in enumerate(machines):
+        if not machine.state_clock.history:
+            raise ValueError(f'{machine.name} keeps no state history')
+        states[:, column] = _sample(*machine.state_clock.to_numpy(), times)
+        if machine.calendar is not None:
+            states[~machine.calendar.on_shift(times), column] = OFF_SHIFT
+    for column, buffer in enumerate(buffers):
+        if not buffer.record.history:
+            raise ValueError(f'{buffer.name} keeps no level history')
+        levels[:, column] = _sample(*buffer.record.to_numpy(), times)
+    return StateMatrix(
+        times,
+        [machine.name for machine in machines],
+        [buffer.name for buffer in buffers],
+        states,
+        levels,
+    )
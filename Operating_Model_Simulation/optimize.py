@@ -0,0 +1,294 @@
+import heapq
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from analytic import screen
+from engine import make_environment
+from line import Line
+from replication import replication_seeds
+from runlength import mser
+from specs import load_specs, spec_by_item
+from stats import estimate
+from sweep import apply_scenario
+
+HOURS_PER_YEAR = 8760
+LBS_PER_TON = 2000
+# the hours between the observations of the finished goods that decide a replication's warm-up
+INTERVAL = 24
+
+
+class Candidate(object):
+    """A machine mix the optimizer considers
+
+    Attributes:
+        units           The machines per stage in process order
+        buffer_capacity The capacity of every buffer between stages
+        cost            The capital cost of the machines and buffers
+        sqft            The floor space of the machines
+        objective       The value minimized, cost plus weighted floor space
+        outputs         The simulated tons per year of each replication so far
+        status          None while undecided, then "feasible" or "infeasible"
+    """
+
+    def __init__(self, units, buffer_capacity, cost, sqft, objective):
+        self.units = units
+        self.buffer_capacity = buffer_capacity
+        self.cost = cost
+        self.sqft = sqft
+        self.objective = objective
+        self.outputs = []
+        self.status = None
+
+    def scenario(self, stage_names):
+        """Returns the sweep scenario that applies the candidate to a line"""
+        scenario = {f'units:{name}': units for name, units in zip(stage_names, self.units)}
+        for name in stage_names[1:]:
+            scenario[f'buffer_capacity:{name}'] = self.buffer_capacity
+        return scenario
+
+    def __repr__(self):
+        return f'Candidate(cost={self.cost:,.0f}, units={self.units}, buffer={self.buffer_capacity}, status={self.status})'
+
+
+class OptimizationResult(object):
+    """The outcome of a capital cost optimization
+
+    Attributes:
+        best            The cheapest feasible Candidate, None when none was found
+        candidates      Every Candidate evaluated, in evaluation order
+        replications    The total number of replications simulated
+    """
+
+    def __init__(self, best, candidates, replications):
+        self.best = best
+        self.candidates = candidates
+        self.replications = replications
+
+
+def unit_costs(spec, specs, sqft_weight=0.0):
+    """Returns the cost, floor space and objective of one machine of each stage"""
+    cost = []
+    sqft = []
+    for stage in spec.stages:
+        machine_spec = spec_by_item(specs, stage.name)
+        cost.append(machine_spec.cost or 0.0)
+        sqft.append(machine_spec.sqft or 0.0)
+    cost = np.array(cost)
+    sqft = np.array(sqft)
+    return cost, sqft, cost + sqft_weight * sqft
+
+
+def minimal_units(spec, target_rate):
+    """Returns the fewest machines per stage whose analytical capacity covers a rate
+
+    Parameters:
+    spec (line.LineSpec): The line
+    target_rate (float): The finished pounds per hour to cover
+
+    Returns:
+    numpy.ndarray: The machines per stage
+    """
+    per_unit = screen(spec, units=np.ones((1, len(spec.stages))))["capacity"][0]
+    return np.maximum(np.ceil(target_rate / per_unit), 1).astype(int)
+
+
+def steady_output(spec, horizon, seed, interval=INTERVAL, pool_units=None, engine="simpy"):
+    """Runs a line once from empty and returns its finished goods per hour after the warm-up
+
+    The End-Buffer level is observed every interval and MSER-5 on the output
+    per interval decides the warm-up, see runlength.mser. The result is the
+    End-Buffer's net change from there to the horizon per hour, so the
+    filling of the empty line does not count against it. A run that has not
+    settled loses its first half, the most MSER may delete
+
+    Parameters:
+    spec (line.LineSpec): The line to simulate
+    horizon (float): The time to run the simulation until
+    seed (int): The seed of the replication
+    interval (float): The time between observations
+    pool_units (int): Stages of at least this many units run as one entities.MachinePool, None to never pool
+    engine (str): The event engine, "simpy" or "heap" for engine.Engine
+
+    Returns:
+    float: The finished pounds per hour after the warm-up
+    """
+    env = make_environment(engine)
+    line = Line(env, spec, seed=seed, history=False, pool_units=pool_units)
+    steps = int(math.floor(horizon / interval + 1e-9))
+    if steps < 1:
+        raise ValueError(f'a horizon of {horizon} h is shorter than one {interval} h interval')
+    levels = [0.0]
+    for step in range(1, steps + 1):
+        env.run(until=step * interval)
+        levels.append(line.buffers[-1].level)
+    deleted = mser(np.diff(levels))
+    if deleted is None:
+        deleted = steps // 2
+    return (levels[-1] - levels[deleted]) / ((steps - deleted) * interval)
+
+
+def _race_round(args):
+    """Runs one replication of a candidate in a worker process"""
+    index, spec, horizon, seed, pool_units, engine = args
+    return index, steady_output(spec, horizon, seed, pool_units=pool_units, engine=engine)
+
+
+def optimize(
+        spec,
+        target_tons,
+        specs=None,
+        horizon=HOURS_PER_YEAR,
+        hours_per_year=HOURS_PER_YEAR,
+        buffer_options=(float('inf'),),
+        buffer_cost=0.0,
+        sqft_weight=0.0,
+        batch=4,
+        max_replications=32,
+        max_candidates=100,
+        confidence=0.95,
+        seed=0,
+        workers=None,
+        pool_units=None,
+        engine="simpy",
+        ):
+    """Finds the cheapest machine mix whose simulated output meets a target
+
+    The search is best-first in cost starting from the fewest machines the
+    analytical model allows, so the first candidate proven feasible is the
+    cheapest one explored. Candidates race in rounds of batch replications
+    on common seeds and leave the race as soon as the confidence interval
+    of their annual output is clear of the target. An infeasible candidate
+    adds machines where the analytical model says capacity is short, scaled
+    by how far its simulated output missed the target. The annual output of
+    a replication is its output after the warm-up, see steady_output
+
+    Parameters:
+    spec (line.LineSpec): The line, its unit counts and buffers are replaced
+    target_tons (float): The tons of finished goods per year to reach
+    specs (tuple): The specs.MachineSpec records with the costs, the default sheet when None
+    horizon (float): The hours simulated per replication
+    hours_per_year (float): The hours the simulated output is scaled up to
+    buffer_options (tuple): The buffer capacities to choose from
+    buffer_cost (float): The cost per pound of buffer capacity
+    sqft_weight (float): The cost per square foot of floor space, 0 to ignore space
+    batch (int): The replications a candidate gets per racing round
+    max_replications (int): The replications after which a candidate is decided on its mean
+    max_candidates (int): The number of candidates after which the search gives up
+    confidence (float): The confidence level of the racing intervals
+    seed (int): The base seed, every candidate sees the same replication seeds
+    workers (int): The number of worker processes, every core when None
+    pool_units (int): Stages of at least this many units run as one entities.MachinePool, None to never pool
+    engine (str): The event engine, "simpy" or "heap" for engine.Engine
+
+    Returns:
+    OptimizationResult: The cheapest feasible candidate and the search history
+    """
+    specs = load_specs() if specs is None else specs
+    stage_names = [stage.name for stage in spec.stages]
+    cost_per_unit, sqft_per_unit, objective_per_unit = unit_costs(spec, specs, sqft_weight)
+    target_rate = target_tons * LBS_PER_TON / hours_per_year
+    seeds = replication_seeds(seed, max_replications)
+    buffer_options = sorted(buffer_options)
+    buffer_count = len(spec.stages) - 1
+
+    def make(units, buffer_index):
+        units = tuple(int(unit) for unit in units)
+        buffer_capacity = buffer_options[buffer_index]
+        buffer_total = buffer_capacity * buffer_count * buffer_cost if buffer_cost else 0.0
+        cost = float(np.dot(units, cost_per_unit)) + buffer_total
+        objective = float(np.dot(units, objective_per_unit)) + buffer_total
+        return Candidate(units, buffer_capacity, cost, float(np.dot(units, sqft_per_unit)), objective)
+
+    def capacities(buffer_capacity):
+        # a candidate sizes the buffers between stages, the Start-Buffer stays as the spec has it
+        return np.array([spec.stages[0].buffer_capacity] + [buffer_capacity] * buffer_count, dtype=float)
+
+    def push(units, buffer_index):
+        # a buffer that can deadlock the line is not worth simulating, take the next larger one
+        while buffer_index < len(buffer_options) and not screen(
+                spec, units=np.asarray(units, dtype=float)[None, :],
+                buffer_capacities=capacities(buffer_options[buffer_index]))["feasible"][0]:
+            buffer_index += 1
+        if buffer_index == len(buffer_options):
+            return
+        key = (tuple(int(unit) for unit in units), buffer_index)
+        if key in seen:
+            return
+        seen.add(key)
+        candidate = make(*key)
+        heapq.heappush(frontier, (candidate.objective, buffer_index, len(seen), candidate))
+
+    def neighbors(candidate, buffer_index):
+        units = np.array(candidate.units)
+        shortfall = target_tons / max(np.mean(candidate.outputs), 1e-9)
+        capacity = screen(
+            spec, units=units[None, :], buffer_capacities=capacities(candidate.buffer_capacity))["capacity"][0]
+        # raise the two weakest stages by the shortfall
+        for stage in np.argsort(capacity)[:2]:
+            raised = units.copy()
+            raised[stage] = max(units[stage] + 1, math.ceil(units[stage] * shortfall))
+            push(raised, buffer_index)
+        # raise every stage that cannot carry the target once scaled by the shortfall
+        short = capacity < target_rate * shortfall
+        if short.any():
+            push(np.where(short, np.ceil(units * target_rate * shortfall / capacity), units), buffer_index)
+        if buffer_index + 1 < len(buffer_options):
+            push(units, buffer_index + 1)
+
+    seen = set()
+    frontier = []
+    push(minimal_units(spec, target_rate), 0)
+    evaluated = []
+    best = None
+    replications = 0
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        while frontier and len(evaluated) < max_candidates:
+            if best is not None and frontier[0][0] >= best.objective:
+                break
+            # race as many of the cheapest candidates as there are workers
+            racing = []
+            while frontier and len(racing) < max(1, workers // batch):
+                objective, buffer_index, _, candidate = heapq.heappop(frontier)
+                if best is not None and objective >= best.objective:
+                    break
+                racing.append((candidate, buffer_index))
+            candidate_specs = [apply_scenario(spec, candidate.scenario(stage_names)) for candidate, _ in racing]
+            while any(candidate.status is None for candidate, _ in racing):
+                tasks = []
+                for index, (candidate, _) in enumerate(racing):
+                    if candidate.status is None:
+                        done = len(candidate.outputs)
+                        for replication_seed in seeds[done:done + batch]:
+                            tasks.append((
+                                index, candidate_specs[index], horizon, replication_seed, pool_units, engine))
+                if executor is None:
+                    results = map(_race_round, tasks)
+                else:
+                    results = executor.map(_race_round, tasks)
+                for index, rate in results:
+                    racing[index][0].outputs.append(rate / LBS_PER_TON * hours_per_year)
+                replications += len(tasks)
+                for candidate, _ in racing:
+                    if candidate.status is not None:
+                        continue
+                    output = estimate(candidate.outputs, confidence)
+                    if output.low >= target_tons:
+                        candidate.status = "feasible"
+                    elif output.high < target_tons:
+                        candidate.status = "infeasible"
+                    elif len(candidate.outputs) >= max_replications:
+                        candidate.status = "feasible" if output.mean >= target_tons else "infeasible"
+            for candidate, buffer_index in racing:
+                evaluated.append(candidate)
+                if candidate.status == "feasible":
+                    if best is None or candidate.objective < best.objective:
+                        best = candidate
+                else:
+                    neighbors(candidate, buffer_index)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return OptimizationResult(best, evaluated, replications)
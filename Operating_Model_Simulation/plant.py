@@ -0,0 +1,110 @@
+from line import Line, LineSpec, StageSpec
+from specs import load_specs
+
+# defaults for the parameters the spec sheet does not give
+CYCLE_TIME_CV = 0.1
+YIELD_CV = 0.01
+BATCH_FAILURE_RATE = 0.05
+REPAIR_CV = 0.25
+
+
+def stage_from_spec(
+        spec,
+        units=None,
+        shifts=2,
+        cycle_time_cv=CYCLE_TIME_CV,
+        yield_cv=YIELD_CV,
+        batch_failure_rate=BATCH_FAILURE_RATE,
+        repair_cv=REPAIR_CV,
+        buffer_capacity=float('inf'),
+        calendar=None,
+        ):
+    """Turns a row of the spec sheet into a stage of the line
+
+    Parameters:
+    spec (specs.MachineSpec): The process step
+    units (int): The number of parallel machines, Number-Required when None
+    shifts (int): Take MTBF and maintenance times for one or two shifts
+    cycle_time_cv (float): The standard deviation of the cycle time relative to its mean
+    yield_cv (float): The standard deviation of the yielded amount relative to its mean
+    batch_failure_rate (float): The rate at which batches fail
+    repair_cv (float): The standard deviation of repair times relative to their mean
+    buffer_capacity (float): The capacity of the buffer feeding the stage
+    calendar (shifts.ShiftCalendar): The working hours, None to run 24/7,
+        e.g. shifts.shift_calendar(shifts) to work the shifts
+
+    Returns:
+    line.StageSpec: The stage
+    """
+    good_amount = spec.lbs_per_cycle * spec.yield_rate
+    mttr = spec.mmt(shifts)
+    return StageSpec(
+        name = spec.item,
+        units = spec.number_required if units is None else units,
+        cycle_time = spec.cycle_time,
+        cycle_time_sigma = spec.cycle_time * cycle_time_cv,
+        yield_rate = spec.yield_rate,
+        yield_sigma = good_amount * yield_cv,
+        batch_failure_rate = batch_failure_rate,
+        mtbf = spec.mtbf(shifts),
+        mttr = mttr,
+        repair_std_dev = mttr * repair_cv,
+        batch_size = spec.lbs_per_cycle,
+        buffer_capacity = buffer_capacity,
+        calendar = calendar,
+    )
+
+
+def plant_spec(
+        specs=None,
+        units=None,
+        buffer_capacities=None,
+        delivery_size=None,
+        delivery_time=1,
+        **stage_options,
+        ):
+    """Describes the whole serial plant from the spec sheet
+
+    Parameters:
+    specs (tuple): The MachineSpec records in process order, the default sheet when None
+    units (dict): Overrides the number of machines of a step, by step name
+    buffer_capacities (dict): The capacity of the buffer feeding a step, by step name
+    delivery_size (float): The pounds per delivery, enough to keep the first step busy when None
+    delivery_time (float): The time between deliveries
+    stage_options: Passed on to stage_from_spec for every step
+
+    Returns:
+    line.LineSpec: The plant
+    """
+    specs = load_specs() if specs is None else specs
+    units = units or {}
+    buffer_capacities = buffer_capacities or {}
+    stages = [
+        stage_from_spec(
+            spec,
+            units = units.get(spec.item),
+            buffer_capacity = buffer_capacities.get(spec.item, float('inf')),
+            **stage_options,
+        )
+        for spec in specs
+    ]
+    if delivery_size is None:
+        first = stages[0]
+        delivery_size = first.units * first.batch_size / first.cycle_time * delivery_time
+    return LineSpec(stages, delivery_size=delivery_size, delivery_time=delivery_time)
+
+
+def build_plant(env, spec=None, seed=None, event_log=None):
+    """Builds the simpy objects of the plant
+
+    Parameters:
+    env (simpy.Environment): The environment the plant runs in
+    spec (line.LineSpec): The plant, the full spec sheet plant when None
+    seed (int): The seed of the run
+    event_log (eventlog.EventLog): Where the plant reports events
+
+    Returns:
+    line.Line: The plant
+    """
+    spec = plant_spec() if spec is None else spec
+    return Line(env, spec, seed=seed, event_log=event_log)
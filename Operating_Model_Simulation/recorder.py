@@ -0,0 +1,118 @@
+from array import array
+import numpy as np
+from stats import QuantileSketch
+
+
+class LevelRecorder(object):
+    """Records the level of a buffer every time it changes
+    Each change appends the time and the new level to typed arrays, 16 bytes
+    per change, and updates running time weighted statistics so the average
+    level is available without going through the history
+
+    Attributes:
+        capacity            The capacity of the buffer
+        history             Whether the (time, level) history is kept
+        times               The times at which the level changed
+        levels              The level after each change
+        start_time          The time recording started
+        start_level         The level at start_time
+        last_time           The time of the last change
+        last_level          The level after the last change
+        max_level           The highest level seen
+        area                The integral of the level from start_time to last_time
+        time_at_capacity    The time spent full from start_time to last_time
+        time_empty          The time spent empty from start_time to last_time
+        sketch              The stats.QuantileSketch of the level weighted by the time it was held
+                            from start_time to last_time, None when not kept
+    """
+
+    def __init__(self, start_time, level, capacity, history=True, quantiles=False):
+        self.capacity = capacity
+        self.history = history
+        self.times = array('d')
+        self.levels = array('d')
+        self.start_time = start_time
+        self.start_level = level
+        self.last_time = start_time
+        self.last_level = level
+        self.max_level = level
+        self.area = 0.0
+        self.time_at_capacity = 0.0
+        self.time_empty = 0.0
+        self.sketch = QuantileSketch() if quantiles else None
+        if history:
+            self.times.append(start_time)
+            self.levels.append(level)
+
+    def update(self, time, level):
+        """Records that the level changed to level at time"""
+        elapsed = time - self.last_time
+        if elapsed:
+            last_level = self.last_level
+            self.area += last_level * elapsed
+            if last_level >= self.capacity:
+                self.time_at_capacity += elapsed
+            elif last_level <= 0:
+                self.time_empty += elapsed
+            if self.sketch is not None:
+                self.sketch.add(last_level, elapsed)
+            self.last_time = time
+        self.last_level = level
+        if level > self.max_level:
+            self.max_level = level
+        if self.history:
+            self.times.append(time)
+            self.levels.append(level)
+
+    def reset(self, now):
+        """Starts the statistics over at now, the history is kept"""
+        self.start_time = now
+        self.start_level = self.last_level
+        self.last_time = now
+        self.max_level = self.last_level
+        self.area = 0.0
+        self.time_at_capacity = 0.0
+        self.time_empty = 0.0
+        if self.sketch is not None:
+            self.sketch = QuantileSketch()
+
+    def _tail(self, now):
+        """Returns the time since the last change, which the counters do not include yet"""
+        return max(now - self.last_time, 0.0)
+
+    def mean(self, now):
+        """Returns the time weighted average level from the start of recording to now"""
+        duration = now - self.start_time
+        if duration <= 0:
+            return self.last_level
+        return (self.area + self.last_level * self._tail(now)) / duration
+
+    def full_time(self, now):
+        """Returns the time spent at capacity from the start of recording to now"""
+        if self.last_level >= self.capacity:
+            return self.time_at_capacity + self._tail(now)
+        return self.time_at_capacity
+
+    def empty_time(self, now):
+        """Returns the time spent empty from the start of recording to now"""
+        if self.last_level <= 0:
+            return self.time_empty + self._tail(now)
+        return self.time_empty
+
+    def level_sketch(self, now):
+        """Returns a stats.QuantileSketch of the level from the start of recording to now, the recorder must keep one"""
+        if self.sketch is None:
+            raise ValueError("the recorder keeps no level quantiles")
+        sketch = self.sketch.copy()
+        sketch.add(self.last_level, self._tail(now))
+        return sketch
+
+    def to_numpy(self):
+        """Returns a copy of the history as two numpy arrays of times and levels, safe to hold while the run goes on"""
+        return (
+            np.array(self.times, dtype=np.float64),
+            np.array(self.levels, dtype=np.float64),
+        )
+
+    def __len__(self):
+        return len(self.times)
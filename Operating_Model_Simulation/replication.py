@@ -0,0 +1,215 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from engine import make_environment
+from export import ChunkExporter
+from line import Line
+from metrics import machine_metrics
+from stats import RunningStats, QuantileSketch, estimate, merge_all
+
+
+def replication_seeds(seed, replications):
+    """Derives independent seeds for each replication from a single base seed
+
+    Parameters:
+    seed (int): The base seed of the experiment
+    replications (int): The number of replications
+
+    Returns:
+    list: One integer seed per replication
+    """
+    children = np.random.SeedSequence(seed).spawn(replications)
+    return [int(child.generate_state(1)[0]) for child in children]
+
+
+def buffer_statistics(buffer, horizon):
+    """Summarizes the level of a buffer over a run
+
+    Parameters:
+    buffer (entities.Buffer): The buffer to summarize
+    horizon (float): The time the run ended
+
+    Returns:
+    dict: The time weighted mean, max and final level, the change of level since the statistics
+    started, which for the End-Buffer is the output, and the fraction of time spent full,
+    with the stats.QuantileSketch of the time weighted level when the buffer keeps one
+    """
+    record = buffer.record
+    duration = horizon - record.start_time
+    statistics = {
+        "mean_level": record.mean(horizon),
+        "max_level": record.max_level,
+        "final_level": buffer.level,
+        "net_change": buffer.level - record.start_level,
+        "full_fraction": record.full_time(horizon) / duration if duration > 0 else 0.0,
+    }
+    if record.sketch is not None:
+        statistics["level"] = record.level_sketch(horizon)
+    return statistics
+
+
+def machine_results(machine, horizon):
+    """Summarizes the output, failures and state times of a machine over a run
+
+    Parameters:
+    machine (entities.Machine): The machine to summarize
+    horizon (float): The time the run ended
+
+    Returns:
+    dict: The output, failure counts, downtime, utilization and OEE, with the streaming
+    statistics of process times, times between pushes and pushed amounts when the machine keeps them
+    """
+    metrics = machine_metrics(machine, horizon)
+    results = {
+        "number_finished": machine.number_finished,
+        "failures": machine.batches_failed,
+        "breakdowns": machine.breakdowns,
+        "downtime": machine.downtime,
+        "utilization": metrics["utilization"],
+        "oee": metrics["oee"],
+    }
+    if machine.cycle_stats is not None:
+        results["cycle_time"] = machine.cycle_stats
+        results["inter_departure"] = machine.departure_stats
+        results["batch_yield"] = machine.yield_sketch
+    return results
+
+
+def run_replication(
+        spec, horizon, seed, event_log=None, history=True, antithetic=False, pool_units=None, engine="simpy",
+        summary=False):
+    """Builds the line in a fresh environment and runs it once
+
+    Parameters:
+    spec (line.LineSpec): The line to simulate
+    horizon (float): The time to run the simulation until
+    seed (int): The seed of the replication
+    event_log (eventlog.EventLog): Traces the replication when given
+    history (bool): Whether machines and buffers keep their histories in memory
+    antithetic (bool): Whether the replication draws the antithetic variates of its seed
+    pool_units (int): Stages of at least this many units run as one entities.MachinePool, None to never pool
+    engine (str): The event engine, "simpy" or "heap" for engine.Engine, both give the same results
+    summary (bool): Keep streaming statistics instead of histories, so memory does not grow with the horizon
+
+    Returns:
+    dict: The per machine and per buffer results of the run
+    """
+    env = make_environment(engine)
+    line = Line(
+        env, spec, seed=seed, event_log=event_log, history=history and not summary, antithetic=antithetic,
+        pool_units=pool_units, statistics=summary)
+    env.run(until=horizon)
+    return line_results(line, horizon)
+
+
+def line_results(line, horizon):
+    """Collects the per machine and per buffer results of a line that ran until horizon"""
+    return {
+        "machines": {
+            machine.name: machine_results(machine, horizon)
+            for machine in line.machines
+        },
+        "buffers": {
+            buffer.name: buffer_statistics(buffer, horizon)
+            for buffer in line.buffers
+        },
+    }
+
+
+def _run_replication(args):
+    """Unpacks the arguments of a replication for the process pool and exports its events if asked"""
+    spec, horizon, seed, export, pool_units, engine, summary = args
+    if export is None:
+        return run_replication(spec, horizon, seed, pool_units=pool_units, engine=engine, summary=summary)
+    # the exporter holds the events, so the line keeps no histories of its own
+    exporter = ChunkExporter(**export)
+    try:
+        return run_replication(
+            spec, horizon, seed, event_log=exporter, history=False, pool_units=pool_units, engine=engine,
+            summary=summary)
+    finally:
+        exporter.close()
+
+
+def summarize(results, confidence=0.95):
+    """Aggregates the results of many replications
+
+    Parameters:
+    results (list): The dictionaries returned by run_replication
+    confidence (float): The confidence level of the intervals
+
+    Returns:
+    dict: The same layout as a single result with an stats.Estimate for every value all results
+    have, and the streaming statistics of all replications merged into one
+    """
+    summary = {}
+    for group in ("machines", "buffers"):
+        summary[group] = {}
+        for name, values in results[0][group].items():
+            summary[group][name] = {}
+            for key, value in values.items():
+                # results stored by an older version may lack the newer keys
+                if any(key not in result[group][name] for result in results):
+                    continue
+                column = (result[group][name][key] for result in results)
+                if isinstance(value, (RunningStats, QuantileSketch)):
+                    summary[group][name][key] = merge_all(column)
+                else:
+                    summary[group][name][key] = estimate(column, confidence)
+    return summary
+
+
+def replicate(
+        spec,
+        horizon,
+        replications,
+        seed=0,
+        workers=None,
+        confidence=0.95,
+        export_directory=None,
+        scenario=0,
+        chunk_size=65536,
+        pool_units=None,
+        engine="simpy",
+        summary=False,
+        ):
+    """Runs independently seeded replications of a line in a process pool
+
+    Parameters:
+    spec (line.LineSpec): The line to simulate
+    horizon (float): The time to run each replication until
+    replications (int): The number of replications
+    seed (int): The base seed the replication seeds are derived from
+    workers (int): The number of worker processes, every core when None
+    confidence (float): The confidence level of the intervals
+    export_directory (str): The directory to stream the events of every replication to, see export.py
+    scenario (int): The scenario id of the exported events
+    chunk_size (int): The number of events per exported chunk
+    pool_units (int): Stages of at least this many units run as one entities.MachinePool, None to never pool
+    engine (str): The event engine, "simpy" or "heap" for engine.Engine
+    summary (bool): Keep streaming statistics instead of histories, see run_replication
+
+    Returns:
+    dict: The aggregated results, see summarize
+    """
+    seeds = replication_seeds(seed, replications)
+    tasks = []
+    for index, replication_seed in enumerate(seeds):
+        export = None
+        if export_directory is not None:
+            export = {
+                "directory": export_directory,
+                "scenario": scenario,
+                "replication": index,
+                "chunk_size": chunk_size,
+            }
+        tasks.append((spec, horizon, replication_seed, export, pool_units, engine, summary))
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        results = [_run_replication(task) for task in tasks]
+    else:
+        # hand each worker a few large chunks so pickling does not dominate short runs
+        chunksize = max(1, replications // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_run_replication, tasks, chunksize=chunksize))
+    return summarize(results, confidence)
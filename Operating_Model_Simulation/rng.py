@@ -0,0 +1,180 @@
+import zlib
+from array import array
+import numpy as np
+
+# blocks start small and double on every refill up to the max block size,
+# so idle machines hold a few variates and busy ones draw in large blocks
+MIN_BLOCK_SIZE = 16
+MAX_BLOCK_SIZE = 512
+
+
+def stream_key(value):
+    """Turns a stream name into a stable integer
+
+    Parameters:
+    value (str or int): A part of the stream name, e.g. the machine name
+
+    Returns:
+    int: A 32 bit integer that does not change between runs or processes
+    """
+    if isinstance(value, int):
+        return value
+    return zlib.crc32(str(value).encode())
+
+
+def stream_seed(seed, *key):
+    """Derives the seed of a named random stream from the seed of a run
+    Streams are keyed by name, so a machine draws the same variates no matter
+    how many other machines are in the line or the order they were built in
+
+    Parameters:
+    seed (int): The seed of the run, None for fresh entropy
+    key (tuple): The name of the stream, e.g. (machine name, "cycle_time")
+
+    Returns:
+    numpy.random.SeedSequence: The seed of the stream
+    """
+    return np.random.SeedSequence(seed, spawn_key=tuple(stream_key(part) for part in key))
+
+
+class VariateStream(object):
+    """Pre-draws variates from its own numpy generator in blocks
+    Drawing the next variate is an iterator step, and the seed and generator
+    are only derived the first time the stream is used, so building thousands
+    of machines stays cheap.
+
+    Streams are keyed by the role of their machine and the purpose of the
+    draws, so two scenarios run on the same seed see the same variates in
+    the same roles, which is what common random numbers need. An antithetic
+    stream turns every variate x into F^-1(1 - F(x)) for its distribution F,
+    the mirror image of the draws of the plain stream on the same seed
+
+    Attributes:
+        seed            The seed of the run
+        key             The name of the stream, see stream_seed
+        block_size      The number of variates drawn at the next refill
+        antithetic      Whether the stream returns the antithetic variates
+    """
+
+    typecode = 'd'
+
+    def __init__(self, seed, key):
+        self.seed = seed
+        self.key = key
+        self.block_size = MIN_BLOCK_SIZE
+        self.antithetic = False
+        self._generator = None
+        self._values = iter(())
+
+    def _draw(self, generator, size):
+        """Returns a numpy array of size variates, implemented by each stream"""
+        raise NotImplementedError
+
+    def _refill(self):
+        """Draws the next block of variates"""
+        if self._generator is None:
+            self._generator = np.random.Generator(np.random.PCG64(stream_seed(self.seed, *self.key)))
+        block = array(self.typecode)
+        block.frombytes(self._draw(self._generator, self.block_size).tobytes())
+        self.block_size = min(self.block_size * 2, MAX_BLOCK_SIZE)
+        self._values = iter(block)
+
+    def reseed(self, seed):
+        """Restarts the stream from another run seed, dropping the variates drawn so far"""
+        self.seed = seed
+        self.block_size = MIN_BLOCK_SIZE
+        self._generator = None
+        self._values = iter(())
+
+    def next(self):
+        """Returns the next variate of the stream"""
+        try:
+            return next(self._values)
+        except StopIteration:
+            self._refill()
+            return next(self._values)
+
+
+class NormalStream(VariateStream):
+    """A stream of normally distributed variates
+
+    Attributes:
+        mean        The mean of the distribution
+        sigma       The standard deviation of the distribution
+    """
+
+    def __init__(self, seed, key, mean, sigma):
+        super().__init__(seed, key)
+        self.mean = mean
+        self.sigma = sigma
+
+    def _draw(self, generator, size):
+        values = generator.normal(self.mean, self.sigma, size)
+        if self.antithetic:
+            # the normal distribution is symmetric about its mean
+            return 2 * self.mean - values
+        return values
+
+
+class BernoulliStream(VariateStream):
+    """A stream of 0/1 flags that are 1 with the given probability
+
+    Attributes:
+        probability The probability of drawing a 1
+    """
+
+    typecode = 'b'
+
+    def __init__(self, seed, key, probability):
+        super().__init__(seed, key)
+        self.probability = probability
+
+    def _draw(self, generator, size):
+        uniforms = generator.random(size)
+        if self.antithetic:
+            uniforms = 1 - uniforms
+        return (uniforms < self.probability).astype(np.int8)
+
+
+class ExponentialStream(VariateStream):
+    """A stream of exponentially distributed variates
+
+    Attributes:
+        mean        The mean of the distribution
+    """
+
+    def __init__(self, seed, key, mean):
+        super().__init__(seed, key)
+        self.mean = mean
+
+    def _draw(self, generator, size):
+        values = generator.exponential(self.mean, size)
+        if self.antithetic and self.mean > 0:
+            # F(x) = 1 - exp(-x / mean), so F^-1(1 - F(x)) = -mean log(1 - exp(-x / mean))
+            return -self.mean * np.log(-np.expm1(-values / self.mean))
+        return values
+
+
+class LogNormalStream(VariateStream):
+    """A stream of log-normally distributed variates with the given mean and standard deviation
+
+    Attributes:
+        mean        The mean of the distribution
+        sigma       The standard deviation of the distribution
+    """
+
+    def __init__(self, seed, key, mean, sigma):
+        super().__init__(seed, key)
+        self.mean = mean
+        self.sigma = sigma
+
+    def _draw(self, generator, size):
+        if self.mean <= 0:
+            return np.zeros(size)
+        # the parameters of the underlying normal that give the requested mean and deviation
+        log_variance = np.log1p((self.sigma / self.mean) ** 2)
+        log_mean = np.log(self.mean) - log_variance / 2
+        normals = generator.normal(log_mean, np.sqrt(log_variance), size)
+        if self.antithetic:
+            normals = 2 * log_mean - normals
+        return np.exp(normals)
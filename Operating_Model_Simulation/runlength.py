@@ -0,0 +1,265 @@
+import math
+import numpy as np
+from engine import make_environment
+from line import Line
+from stats import estimate
+
+# Instead of a hand picked horizon the run observes itself. Every interval
+# it records the finished goods, the output of each stage and the average
+# level of each buffer but the End-Buffer, which only ever fills. MSER-5 on
+# those series finds where the empty-start transient ends, and once the
+# outputs have settled the finished goods after the transient are cut into
+# batches whose means give a confidence interval on throughput. The run goes
+# on until the interval is as narrow as asked, or until the longest horizon
+# allowed. A buffer fed faster than it is drained fills without bound and
+# never settles, so by default the levels only lengthen the warm-up once
+# they settle and are reported when they do not.
+#
+# Once a warm-up is found the statistics of the line start over, and the
+# batch means are taken from that time on too, so the throughput interval and
+# what the line reports cover the same time after the transient. A later
+# check may find a series unsettled again, then the last warm-up found and
+# the statistics from it are kept, the run is marked unsettled and it does
+# not stop for precision until a check settles again. The
+# checks grow apart geometrically, which keeps the MSER work of a run linear
+# in its length, at the price of stopping up to a tenth later than an
+# every-interval check would.
+
+MSER_BATCH = 5
+MIN_MSER_BATCHES = 10
+CHECK_GROWTH = 1.1
+
+# why a run stopped
+PRECISION = "precision"
+MAX_HORIZON = "max_horizon"
+
+
+def mser(series, batch=MSER_BATCH):
+    """Finds the end of the transient of a series with the MSER rule
+
+    The series is averaged in batches of batch observations. Deleting the
+    first d batch means leaves the standard error estimate
+    MSER(d) = sum of (z_i - mean)^2 / (n - d)^2 over what is left, and the
+    d that minimizes it ends the transient. A minimum in the second half
+    of the series means it has not settled yet. The last MIN_MSER_BATCHES
+    batch means are never deleted, as the rule is erratic with few of them
+    left and would often find a spurious minimum there in a settled series
+
+    Parameters:
+    series (numpy.ndarray): The observations in time order
+    batch (int): The observations per batch mean, 5 for MSER-5
+
+    Returns:
+    int: The number of observations to delete, None when the series has not settled or is too short to tell
+    """
+    series = np.asarray(series, dtype=float)
+    batches = len(series) // batch
+    if batches < 2 * MIN_MSER_BATCHES:
+        return None
+    means = series[:batches * batch].reshape(batches, batch).mean(axis=1)
+    # sums over the batch means left after deleting the first d, for every d
+    kept = np.arange(batches, 0, -1, dtype=float)
+    sums = np.cumsum(means[::-1])[::-1]
+    squares = np.cumsum((means * means)[::-1])[::-1]
+    errors = np.maximum(squares - sums * sums / kept, 0.0) / (kept * kept)
+    deleted = int(np.argmin(errors[:batches - MIN_MSER_BATCHES + 1]))
+    if deleted > batches // 2:
+        return None
+    return deleted * batch
+
+
+def batch_means(values, batches, confidence=0.95):
+    """Estimates the mean of an autocorrelated series from the means of consecutive batches
+
+    Parameters:
+    values (numpy.ndarray): The observations after the transient, in time order
+    batches (int): The number of batches, the first observations that do not fill one are left out
+    confidence (float): The confidence level of the interval
+
+    Returns:
+    stats.Estimate: The mean and its confidence interval, treating the batch means as independent
+    """
+    values = np.asarray(values, dtype=float)
+    size = len(values) // batches
+    if size < 1:
+        raise ValueError(f'{len(values)} observations do not make {batches} batches')
+    # leave out the oldest observations, closest to the transient
+    values = values[len(values) - size * batches:]
+    return estimate(values.reshape(batches, size).mean(axis=1).tolist(), confidence)
+
+
+class RunLength(object):
+    """The outcome of a run that chose its own length
+
+    Attributes:
+        line            The line.Line as the run left it
+        interval        The time between observations
+        horizon         The time simulated
+        warmup          The time deleted as the transient by the last check that settled, None when none did
+        statistics_start The time the statistics of the line start over at, the first check past the warm-up,
+                        None when they cover the whole run
+        reason          Why the run stopped, PRECISION or MAX_HORIZON
+        precision       The relative half width asked for
+        throughput      The stats.Estimate of finished goods per hour from statistics_start on, None without one
+        batches         The number of batch means behind the throughput estimate
+        series          The observed series, a numpy array per name
+        truncations     The observations MSER-5 deletes from each series at the last check, None for those not settled
+        settled         Whether the last check found every series it waits for settled
+    """
+
+    def __init__(
+            self, line, interval, horizon, warmup, statistics_start, reason, precision, throughput, batches, series,
+            truncations, settled):
+        self.line = line
+        self.interval = interval
+        self.horizon = horizon
+        self.warmup = warmup
+        self.statistics_start = statistics_start
+        self.reason = reason
+        self.precision = precision
+        self.throughput = throughput
+        self.batches = batches
+        self.series = series
+        self.truncations = truncations
+        self.settled = settled
+
+    @property
+    def unsettled(self):
+        """The names of the series that never settled"""
+        return [name for name, deleted in self.truncations.items() if deleted is None]
+
+    def report(self):
+        """Returns how long the run went, why it stopped and what it found as printable lines"""
+        lines = [f'ran {self.horizon:,.0f} h in {self.interval:g} h intervals']
+        if self.warmup is None:
+            lines.append('no warm-up found before the run stopped')
+        else:
+            lines.append(f'warm-up: deleted the first {self.warmup:,.0f} h by MSER-{MSER_BATCH}')
+            if not self.settled:
+                lines.append('warm-up: the last check found the run unsettled again, the warm-up is from an earlier one')
+        if self.statistics_start is None:
+            lines.append('statistics: cover the whole run, transient included')
+        else:
+            lines.append(f'statistics: cover {self.statistics_start:,.0f} h to {self.horizon:,.0f} h')
+        if self.throughput is not None:
+            relative = self.throughput.half_width / abs(self.throughput.mean) if self.throughput.mean else math.inf
+            lines.append(
+                f'throughput: {self.throughput.mean:,.1f} +/- {self.throughput.half_width:,.1f} per h'
+                f' ({relative:.1%} of the mean, {self.throughput.confidence:.0%} confidence,'
+                f' {self.batches} batch means)')
+        if self.reason == PRECISION:
+            lines.append(f'stopped: the half width reached {self.precision:.1%} of the mean')
+        else:
+            lines.append(f'stopped: reached the longest horizon before a half width of {self.precision:.1%}')
+        if self.unsettled:
+            lines.append(f'never settled: {", ".join(self.unsettled)}')
+        return "\n".join(lines)
+
+
+def _observe(line, previous):
+    """Returns the totals a series is differenced from: the output of each stage, the finished goods
+    and the level integral of each buffer, together with the observations since the previous totals"""
+    now = line.env.now
+    totals = {}
+    for machines in line.stages:
+        if machines:
+            totals[f'output:{machines[0].type}'] = sum(machine.number_finished for machine in machines)
+    totals["finished"] = line.buffers[-1].level
+    for buffer in line.buffers[:-1]:
+        record = buffer.record
+        totals[f'level:{buffer.name}'] = record.mean(now) * (now - record.start_time)
+    return totals, {name: total - previous.get(name, 0.0) for name, total in totals.items()}
+
+
+def run_adaptive(
+        spec,
+        precision,
+        seed=0,
+        interval=24,
+        max_horizon=87600,
+        confidence=0.95,
+        batches=20,
+        levels=False,
+        pool_units=None,
+        engine="simpy",
+        event_log=None,
+        history=False,
+        ):
+    """Runs a line until the throughput after its transient is known to a relative precision
+
+    Parameters:
+    spec (line.LineSpec): The line to simulate
+    precision (float): The half width of the throughput interval to stop at, relative to the mean
+    seed (int): The seed of the run
+    interval (float): The time between observations
+    max_horizon (float): The longest the run may go
+    confidence (float): The confidence level of the interval
+    batches (int): The number of batch means the interval is built from
+    levels (bool): Whether the buffer levels must settle before the run may stop, not only the outputs
+    pool_units (int): Stages of at least this many units run as one entities.MachinePool, None to never pool
+    engine (str): The event engine, "simpy" or "heap" for engine.Engine
+    event_log (eventlog.EventLog): The log receiving every event, None for no log
+    history (bool): Whether machines and buffers keep their histories, the series need none
+
+    Returns:
+    RunLength: The line with its statistics counted from past the warm-up, how long it ran, why it stopped
+    and the throughput estimate
+    """
+    env = make_environment(engine)
+    line = Line(env, spec, seed=seed, event_log=event_log, history=history, pool_units=pool_units)
+    observations = {}
+    totals = {}
+    steps = int(math.floor(max_horizon / interval + 1e-9))
+    throughput = None
+    warmup = None
+    statistics_start = None
+    truncations = {}
+    reason = MAX_HORIZON
+    settled = False
+    next_check = 2 * MIN_MSER_BATCHES * MSER_BATCH
+    for step in range(1, steps + 1):
+        env.run(until=step * interval)
+        totals, observed = _observe(line, totals)
+        for name, value in observed.items():
+            observations.setdefault(name, []).append(value)
+        if step < next_check:
+            continue
+        next_check = max(step + MSER_BATCH, int(math.ceil(step * CHECK_GROWTH)))
+        truncations = {name: mser(values) for name, values in observations.items()}
+        required = [
+            deleted for name, deleted in truncations.items() if levels or not name.startswith("level:")]
+        settled = all(deleted is not None for deleted in required)
+        if settled:
+            deleted = max(deleted for deleted in truncations.values() if deleted is not None)
+            warmup = deleted * interval
+            if statistics_start is None or warmup > statistics_start:
+                # the line statistics start after the transient, the totals start over with them
+                line.reset_statistics()
+                statistics_start = env.now
+                first = step
+                totals, _ = _observe(line, {})
+                throughput = None
+        if statistics_start is None:
+            continue
+        # an unsettled check keeps the last warm-up, the estimate still covers what the line reports
+        finished = np.asarray(observations["finished"][first:], dtype=float) / interval
+        if len(finished) < 2 * batches:
+            continue
+        throughput = batch_means(finished, batches, confidence)
+        if settled and throughput.mean != 0 and throughput.half_width <= precision * abs(throughput.mean):
+            reason = PRECISION
+            break
+    return RunLength(
+        line,
+        interval,
+        env.now,
+        warmup,
+        statistics_start,
+        reason,
+        precision,
+        throughput,
+        batches,
+        {name: np.asarray(values, dtype=float) for name, values in observations.items()},
+        truncations,
+        settled,
+    )
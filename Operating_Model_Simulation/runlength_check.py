@@ -0,0 +1,92 @@
+"""Checks how runlength.run_adaptive keeps its warm-up across checks
+
+Usage:
+    python runlength_check.py
+
+Each case runs the strip caster line with the MSER rule replaced by a
+scripted one, so which checks settle is known in advance, and compares
+the warm-up, the statistics window, the estimate and the stop reason the
+run reports with what the script implies. The script exits with 1 when a
+case differs.
+"""
+import sys
+import runlength
+from process import process_line
+
+INTERVAL = 24
+MAX_HORIZON = 24 * 400
+SEED = 7
+# the observations the scripted rule deletes when it finds a series settled
+DELETED = 20
+
+
+def scripted(settled_until):
+    """Returns an MSER rule that finds every series settled at the checks up to settled_until observations"""
+    def rule(series, batch=runlength.MSER_BATCH):
+        return DELETED if len(series) <= settled_until else None
+    return rule
+
+
+def run(rule, precision):
+    """Runs the line with the MSER rule replaced, restoring it afterwards"""
+    original = runlength.mser
+    runlength.mser = rule
+    try:
+        return runlength.run_adaptive(
+            process_line(), precision, seed=SEED, interval=INTERVAL, max_horizon=MAX_HORIZON)
+    finally:
+        runlength.mser = original
+
+
+def settled_then_unsettled():
+    """The first check settles and every later one does not"""
+    first_check = 2 * runlength.MIN_MSER_BATCHES * runlength.MSER_BATCH
+    result = run(scripted(first_check), precision=1e-9)
+    problems = []
+    if result.warmup != DELETED * INTERVAL:
+        problems.append(f'warm-up {result.warmup}, expected the first check\'s {DELETED * INTERVAL}')
+    if result.statistics_start != first_check * INTERVAL:
+        problems.append(f'statistics start at {result.statistics_start}, expected {first_check * INTERVAL}')
+    if result.settled:
+        problems.append("reported settled after an unsettled check")
+    if result.reason != runlength.MAX_HORIZON:
+        problems.append(f'stopped for {result.reason} on an unsettled check')
+    if result.throughput is None:
+        problems.append("no throughput estimate from the kept warm-up")
+    if result.line.buffers[-1].record.start_time != result.statistics_start:
+        problems.append("the line statistics do not start at statistics_start")
+    if "unsettled again" not in result.report():
+        problems.append("the report does not say the last check was unsettled")
+    return problems
+
+
+def always_settled():
+    """Every check settles, so the run stops on precision"""
+    result = run(scripted(float("inf")), precision=0.05)
+    problems = []
+    if not result.settled:
+        problems.append("reported unsettled")
+    if result.reason != runlength.PRECISION:
+        problems.append(f'stopped for {result.reason}, expected {runlength.PRECISION}')
+    if result.warmup != DELETED * INTERVAL:
+        problems.append(f'warm-up {result.warmup}, expected {DELETED * INTERVAL}')
+    return problems
+
+
+CASES = (
+    ("settled-then-unsettled", settled_then_unsettled),
+    ("always-settled", always_settled),
+)
+
+
+def main():
+    failed = False
+    for name, case in CASES:
+        problems = case()
+        print(f'{"FAIL" if problems else "PASS"} {name}: {"; ".join(problems) or "ok"}')
+        failed = failed or bool(problems)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+import math
+
+HOURS_PER_DAY = 24
+DAYS_PER_WEEK = 7
+HOURS_PER_WEEK = HOURS_PER_DAY * DAYS_PER_WEEK
+TWO_SHIFT_HOURS_WORKED_PER_DAY = 16
+ONE_SHIFT_HOURS_WORKED_PER_DAY = 8
+WORK_DAYS_PER_WEEK = 5
+SHIFT_START_HOUR = 6
+
+
+class ShiftCalendar(object):
+    """The working hours of a machine, repeated every week
+    Work happens on the first days_per_week days of each week, from
+    start_hour for hours_per_day hours. Simulation time 0 is the start of
+    the first day.
+
+    Rather than waking machines at every shift boundary, the calendar maps
+    an amount of working time to the calendar time it ends at, so a cycle
+    or a failure clock that spans a night or a weekend is still one timeout
+
+    Attributes:
+        hours_per_day   The hours worked on a working day
+        days_per_week   The working days in a week
+        start_hour      The hour of the day work starts
+    """
+
+    def __init__(self, hours_per_day, days_per_week=WORK_DAYS_PER_WEEK, start_hour=SHIFT_START_HOUR):
+        if not 0 < hours_per_day <= HOURS_PER_DAY - start_hour:
+            raise ValueError("a shift has to fit in the day it starts in")
+        if not 0 < days_per_week <= DAYS_PER_WEEK:
+            raise ValueError("days_per_week must be between 1 and 7")
+        self.hours_per_day = hours_per_day
+        self.days_per_week = days_per_week
+        self.start_hour = start_hour
+        self.hours_per_week = hours_per_day * days_per_week
+
+    def worked(self, time):
+        """Returns the working time from time 0 to time"""
+        weeks = math.floor(time / HOURS_PER_WEEK)
+        rest = time - weeks * HOURS_PER_WEEK
+        day = int(rest // HOURS_PER_DAY)
+        worked = weeks * self.hours_per_week + min(day, self.days_per_week) * self.hours_per_day
+        if day < self.days_per_week:
+            into_day = rest - day * HOURS_PER_DAY - self.start_hour
+            worked += min(max(into_day, 0.0), self.hours_per_day)
+        return worked
+
+    def time_of(self, worked):
+        """Returns the earliest time at which the working time since time 0 reaches worked"""
+        weeks = math.floor(worked / self.hours_per_week)
+        rest = worked - weeks * self.hours_per_week
+        if rest == 0 and weeks > 0:
+            # finish at the end of the last shift rather than the start of the next
+            weeks -= 1
+            rest = self.hours_per_week
+        day = math.floor(rest / self.hours_per_day)
+        into_shift = rest - day * self.hours_per_day
+        if into_shift == 0 and day > 0:
+            day -= 1
+            into_shift = self.hours_per_day
+        return weeks * HOURS_PER_WEEK + day * HOURS_PER_DAY + self.start_hour + into_shift
+
+    def on_shift(self, time):
+        """Tells if time falls in a shift, works elementwise on numpy arrays of times"""
+        rest = time % HOURS_PER_WEEK
+        day = rest // HOURS_PER_DAY
+        into_day = rest - day * HOURS_PER_DAY - self.start_hour
+        return (day < self.days_per_week) & (into_day >= 0) & (into_day < self.hours_per_day)
+
+    def working_time(self, start, end):
+        """Returns the working time between two times"""
+        return self.worked(end) - self.worked(start)
+
+    def delay(self, now, work):
+        """Returns the time from now until work hours of working time are done"""
+        if work <= 0:
+            return 0.0
+        return max(self.time_of(self.worked(now) + work) - now, 0.0)
+
+    def annual_hours(self, weeks_per_year=52):
+        """Returns the working hours in a year"""
+        return self.hours_per_week * weeks_per_year
+
+    def __repr__(self):
+        return f'ShiftCalendar({self.hours_per_day}, days_per_week={self.days_per_week}, start_hour={self.start_hour})'
+
+
+# the spec sheet's annual hours, 4160 and 2080, are 52 five day weeks of these shifts
+ONE_SHIFT = ShiftCalendar(ONE_SHIFT_HOURS_WORKED_PER_DAY)
+TWO_SHIFT = ShiftCalendar(TWO_SHIFT_HOURS_WORKED_PER_DAY)
+
+
+def shift_calendar(shifts):
+    """Returns the calendar for one or two shifts, None for 24/7 operation"""
+    if shifts == 1:
+        return ONE_SHIFT
+    if shifts == 2:
+        return TWO_SHIFT
+    return None
@@ -0,0 +1,401 @@
+import csv
+import hashlib
+import os
+import math
+import pickle
+import warnings
+from functools import lru_cache
+
+SPEC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Machine_Specs.csv")
+WORKBOOK_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Phase2-Process Estimates - 24Jan2024.xlsx")
+WORKBOOK_SUFFIXES = (".xlsx", ".xlsm")
+
+# the workbook is the source of truth. The csv is an older export with a 95%
+# yield on every step, and its Number-Required column holds the tons per year
+# of one unit (826 for the Strip-Caster) rather than a unit count, so no
+# target column of the workbook reproduces it. The workbook counts are taken
+# for the 2,000 tons per year the plant is sized for
+DEFAULT_TARGET_TONS = 2000
+
+# the fields the simulation reads, compared between a csv export and the workbook
+COMPARED = ("cycle_time", "lbs_per_cycle", "yield_rate", "number_required", "mtbf_two_shift", "mmt_two_shift")
+
+# csv column -> (attribute, parser name, required)
+COLUMNS = {
+    "Item": ("item", "name", True),
+    "Cost": ("cost", "money", False),
+    "SQFT": ("sqft", "number", False),
+    "Tons-Per-Year": ("tons_per_year", "number", False),
+    "Cycle-Time": ("cycle_time", "number", True),
+    "Lbs-Per-Cycle": ("lbs_per_cycle", "number", True),
+    "Yield": ("yield_rate", "number", True),
+    "Lbs-Per-Hour": ("lbs_per_hour", "number", False),
+    "Tons-Per-Hour": ("tons_per_hour", "number", False),
+    "Number-Required": ("number_required", "integer", True),
+    "MTBF-Two-Shift": ("mtbf_two_shift", "number", True),
+    "MMT-Two-Shift": ("mmt_two_shift", "number", True),
+    "MTBF-One-Shift": ("mtbf_one_shift", "number", True),
+    "MMT-One-Shift": ("mmt_one_shift", "number", True),
+    "MBTF-Days": ("mtbf_days", "number", False),
+    "MMT-Days": ("mmt_days", "number", False),
+    "Two-Shift-Annual-Hours": ("two_shift_annual_hours", "number", True),
+    "One-Shift-Annual-Hours": ("one_shift_annual_hours", "number", True),
+}
+
+
+class MachineSpec(object):
+    """The validated parameters of one process step of the plant
+    Percentages are stored as fractions and money as plain numbers.
+    Values missing from the sheet are None
+
+    Attributes:
+        item                    The name of the process step (Strip-Caster, etc)
+        cost                    The capital cost of one unit in dollars
+        sqft                    The floor space of one unit
+        tons_per_year           The estimated annual output of one unit
+        cycle_time              The hours per cycle
+        lbs_per_cycle           The pounds processed per cycle
+        yield_rate              The fraction of a batch that comes out good
+        lbs_per_hour            The Lbs-Per-Hour column as exported
+        tons_per_hour           The Tons-Per-Hour column as exported
+        number_required         The number of units the estimate calls for
+        mtbf_two_shift          The mean hours between failures on two shifts
+        mmt_two_shift           The mean hours of maintenance per failure on two shifts
+        mtbf_one_shift          The mean hours between failures on one shift
+        mmt_one_shift           The mean hours of maintenance per failure on one shift
+        mtbf_days               The mean days between failures
+        mmt_days                The mean days of maintenance per failure
+        two_shift_annual_hours  The hours worked per year on two shifts
+        one_shift_annual_hours  The hours worked per year on one shift
+    """
+
+    __slots__ = tuple(attribute for attribute, _, _ in COLUMNS.values())
+
+    def __init__(self, **values):
+        for attribute in self.__slots__:
+            setattr(self, attribute, values.get(attribute))
+
+    def mtbf(self, shifts=2):
+        """Returns the mean hours between failures for one or two shifts"""
+        return self.mtbf_two_shift if shifts == 2 else self.mtbf_one_shift
+
+    def mmt(self, shifts=2):
+        """Returns the mean hours of maintenance for one or two shifts"""
+        return self.mmt_two_shift if shifts == 2 else self.mmt_one_shift
+
+    def annual_hours(self, shifts=2):
+        """Returns the hours worked per year for one or two shifts"""
+        return self.two_shift_annual_hours if shifts == 2 else self.one_shift_annual_hours
+
+    def __repr__(self):
+        return f'MachineSpec({self.item!r}, units={self.number_required})'
+
+
+def _parse_number(text):
+    """Parses '1,320', '95%' or '$2,500,000 ' into a float, an empty cell into None"""
+    text = text.strip()
+    if not text:
+        return None
+    percent = text.endswith("%")
+    value = float(text.rstrip("%").replace("$", "").replace(",", "").strip())
+    return value / 100 if percent else value
+
+
+def _parse_integer(text):
+    """Parses a whole number, rejecting fractions"""
+    value = _parse_number(text)
+    if value is None:
+        return None
+    if value != int(value):
+        raise ValueError(f'{text!r} is not a whole number')
+    return int(value)
+
+
+PARSERS = {
+    "name": lambda text: text.strip(),
+    "money": _parse_number,
+    "number": _parse_number,
+    "integer": _parse_integer,
+}
+
+
+def validate(spec):
+    """Checks the values of a MachineSpec are usable by the simulation
+
+    Parameters:
+    spec (MachineSpec): The parsed spec
+
+    Returns:
+    None, raises ValueError naming the step and the field that is wrong
+    """
+    if spec.cycle_time <= 0:
+        raise ValueError(f'{spec.item}: Cycle-Time must be positive, got {spec.cycle_time}')
+    if spec.lbs_per_cycle <= 0:
+        raise ValueError(f'{spec.item}: Lbs-Per-Cycle must be positive, got {spec.lbs_per_cycle}')
+    if not 0 < spec.yield_rate <= 1:
+        raise ValueError(f'{spec.item}: Yield must be within (0%, 100%], got {spec.yield_rate}')
+    if spec.number_required < 0:
+        raise ValueError(f'{spec.item}: Number-Required must not be negative, got {spec.number_required}')
+    for attribute in ("mtbf_two_shift", "mmt_two_shift", "mtbf_one_shift", "mmt_one_shift"):
+        if getattr(spec, attribute) < 0:
+            raise ValueError(f'{spec.item}: {attribute} must not be negative')
+
+
+def parse_specs(rows):
+    """Turns rows of the spec sheet into validated MachineSpec records
+
+    Parameters:
+    rows (iterable): Dictionaries of column name to cell text, like csv.DictReader gives
+
+    Returns:
+    tuple: One MachineSpec per row in process order
+    """
+    specs = []
+    for line_number, row in enumerate(rows, start=2):
+        values = {}
+        for column, (attribute, parser, required) in COLUMNS.items():
+            text = row.get(column)
+            try:
+                value = PARSERS[parser](text or "")
+            except ValueError as error:
+                raise ValueError(f'row {line_number}, column {column}: {error}') from None
+            if value is None and required:
+                raise ValueError(f'row {line_number}, column {column}: value is missing')
+            values[attribute] = value
+        spec = MachineSpec(**values)
+        validate(spec)
+        specs.append(spec)
+    return tuple(specs)
+
+
+# the workbook names some steps differently from the csv export
+WORKBOOK_ITEMS = {
+    "Sintering & Annealing Furnace": "Sintering-Annealing-Furnace",
+    "Plating (Electroplating)": "Electroplating",
+    "Quality Inpsection/CMM/other": "Quality-Inpsection",
+}
+
+# workbook header -> csv column of the values read straight from the process table
+WORKBOOK_COLUMNS = {
+    "Cost Estimate": "Cost",
+    "SQFT/Per": "SQFT",
+    "Tons/Year Estimate": "Tons-Per-Year",
+    "Cycle Time (hr)": "Cycle-Time",
+    "Lbs per Cycle": "Lbs-Per-Cycle",
+    "Yield": "Yield",
+    "MTBF (days)": "MBTF-Days",
+    "Maintenance Duration (days)": "MMT-Days",
+}
+
+# bump when parsing changes so old caches are not used
+CACHE_VERSION = 1
+DAYS_PER_YEAR = 365
+
+
+def _cell_text(value):
+    """Turns a workbook cell value into the text the csv parsers expect, '-' and blanks are empty"""
+    if value is None or (isinstance(value, str) and value.strip() in ("", "-")):
+        return ""
+    return str(value)
+
+
+def workbook_rows(path, target_tons=None):
+    """Reads the process table of the estimates workbook as rows of the csv export
+
+    Formula cells are read from the values Excel saved with the workbook.
+    Failure and maintenance days become hours with the available hours of
+    one and two shifts at the top of the sheet, like the csv export does
+
+    Parameters:
+    path (str): The xlsx workbook
+    target_tons (float): The Tons/Year column Number-Required is taken from, the last one when None
+
+    Returns:
+    list: Dictionaries of csv column name to cell text, one per process step
+    """
+    import openpyxl
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = [list(row) for row in workbook.worksheets[0].iter_rows(values_only=True)]
+    finally:
+        workbook.close()
+    one_shift_hours = two_shift_hours = None
+    header = None
+    for index, row in enumerate(rows):
+        if one_shift_hours is None and "Available Hours" in row:
+            column = row.index("Available Hours")
+            one_shift_hours, two_shift_hours = row[column + 1], row[column + 2]
+        if row and row[0] == "Item":
+            header = index
+            break
+    if header is None or one_shift_hours is None:
+        raise ValueError(f'{path}: no "Item" header row or "Available Hours" row found')
+    if not isinstance(two_shift_hours, (int, float)):
+        raise ValueError(f'{path}: the workbook has no saved values, open and save it in Excel first')
+    names = rows[header]
+    columns = {name: names.index(name) for name in WORKBOOK_COLUMNS if name in names}
+    targets = [(name, column) for column, name in enumerate(names) if isinstance(name, (int, float))]
+    if not targets:
+        raise ValueError(f'{path}: no Number-Required columns by Tons/Year target found')
+    if target_tons is None:
+        target_column = targets[-1][1]
+    else:
+        matches = [column for name, column in targets if name == target_tons]
+        if not matches:
+            raise ValueError(f'{path}: no Number-Required column for {target_tons} tons per year, '
+                             f'the workbook has {[name for name, _ in targets]}')
+        target_column = matches[0]
+
+    result = []
+    for row in rows[header + 1:]:
+        if not row or not isinstance(row[0], str) or not row[0].strip():
+            continue
+        item = row[0].strip()
+        values = {"Item": WORKBOOK_ITEMS.get(item, item.replace(" ", "-"))}
+        for name, column in columns.items():
+            values[WORKBOOK_COLUMNS[name]] = _cell_text(row[column])
+        values["Number-Required"] = _cell_text(row[target_column])
+        mtbf_days = _parse_number(values.get("MBTF-Days", "")) or 0.0
+        mmt_days = _parse_number(values.get("MMT-Days", "")) or 0.0
+        for shifts, hours in (("Two-Shift", two_shift_hours), ("One-Shift", one_shift_hours)):
+            values[f'MTBF-{shifts}'] = str(mtbf_days * hours / DAYS_PER_YEAR)
+            values[f'MMT-{shifts}'] = str(mmt_days * hours / DAYS_PER_YEAR)
+            values[f'{shifts}-Annual-Hours'] = str(hours)
+        result.append(values)
+    return result
+
+
+def _read_specs(path, target_tons=None):
+    """Parses a csv export or an xlsx workbook, whichever path names"""
+    if path.lower().endswith(WORKBOOK_SUFFIXES):
+        return parse_specs(workbook_rows(path, target_tons))
+    with open(path, newline="") as spec_file:
+        return parse_specs(csv.DictReader(spec_file))
+
+
+def cache_path(path, target_tons=None):
+    """Returns the file the parsed specs of a source are cached in, in the __pycache__ folder next to it"""
+    directory, name = os.path.split(path)
+    suffix = "" if target_tons is None else f'-{target_tons:g}'
+    return os.path.join(directory, "__pycache__", f'{name}{suffix}.specs.pickle')
+
+
+def _file_hash(path):
+    with open(path, "rb") as source:
+        return hashlib.sha256(source.read()).hexdigest()
+
+
+def load_cached_specs(path, target_tons=None):
+    """Parses a spec source through a pickle cache kept valid by its mtime and hash
+
+    The cache is used as it is when the source's mtime and size are the
+    ones it was written for. Otherwise the source is hashed, and an unchanged
+    hash only refreshes the stored mtime while a changed one reparses the
+    source, so an edited sheet is always picked up and an untouched one is
+    never parsed twice. A cache that cannot be read or written is ignored
+
+    Parameters:
+    path (str): The csv export or the xlsx workbook
+    target_tons (float): The Tons/Year column of a workbook Number-Required is taken from
+
+    Returns:
+    tuple: One MachineSpec per process step in process order
+    """
+    status = os.stat(path)
+    cached = cache_path(path, target_tons)
+    entry = None
+    try:
+        with open(cached, "rb") as cache_file:
+            entry = pickle.load(cache_file)
+        if entry.get("version") != CACHE_VERSION:
+            entry = None
+    except (OSError, pickle.PickleError, EOFError, AttributeError, TypeError):
+        entry = None
+    if entry is not None and entry["mtime_ns"] == status.st_mtime_ns and entry["size"] == status.st_size:
+        return entry["specs"]
+    digest = _file_hash(path)
+    if entry is None or entry["sha256"] != digest:
+        entry = {"version": CACHE_VERSION, "sha256": digest, "specs": _read_specs(path, target_tons)}
+    entry["mtime_ns"] = status.st_mtime_ns
+    entry["size"] = status.st_size
+    try:
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        # write to a temporary file first so a concurrent reader never sees half a cache
+        temporary = f'{cached}.{os.getpid()}.tmp'
+        with open(temporary, "wb") as cache_file:
+            pickle.dump(entry, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, cached)
+    except OSError:
+        pass
+    return entry["specs"]
+
+
+def divergences(specs, reference):
+    """Lists where two readings of the spec sheet disagree on what the simulation reads
+
+    Parameters:
+    specs (tuple): MachineSpec records, like a csv export gives
+    reference (tuple): The MachineSpec records to hold them against, like the workbook gives
+
+    Returns:
+    list: Printable differences, empty when the two agree
+    """
+    reference = {spec.item: spec for spec in reference}
+    differences = []
+    for spec in specs:
+        other = reference.get(spec.item)
+        if other is None:
+            differences.append(f'{spec.item}: missing from the reference')
+            continue
+        for attribute in COMPARED:
+            value, expected = getattr(spec, attribute), getattr(other, attribute)
+            if not math.isclose(value, expected, rel_tol=1e-6):
+                differences.append(f'{spec.item}: {attribute} is {value:g}, the reference has {expected:g}')
+    return differences
+
+
+@lru_cache(maxsize=None)
+def _load_specs(path, mtime_ns, size, target_tons):
+    specs = load_cached_specs(path, target_tons)
+    if not path.lower().endswith(WORKBOOK_SUFFIXES) and os.path.exists(WORKBOOK_PATH):
+        try:
+            differences = divergences(specs, load_specs(WORKBOOK_PATH))
+        except ImportError:
+            differences = []
+        if differences:
+            warnings.warn(
+                f'{path} disagrees with the workbook in {len(differences)} values, '
+                f'first {differences[0]}; the workbook is the default source', stacklevel=3)
+    return specs
+
+
+def load_specs(path=WORKBOOK_PATH, target_tons=DEFAULT_TARGET_TONS):
+    """Reads the machine spec sheet, the estimates workbook or a csv export of it
+
+    Within a process a source is parsed at most once per version of the
+    file, and between processes the parsed specs come from a binary cache,
+    see load_cached_specs. A csv that disagrees with the workbook next to it
+    is read as it is, with a warning listing the first difference
+
+    Parameters:
+    path (str): The xlsx workbook, or a csv exported from it
+    target_tons (float): The Tons/Year column of a workbook Number-Required is taken from, the last one when None,
+    ignored for a csv
+
+    Returns:
+    tuple: One MachineSpec per process step in process order
+    """
+    path = os.path.abspath(path)
+    if not path.lower().endswith(WORKBOOK_SUFFIXES):
+        target_tons = None
+    status = os.stat(path)
+    return _load_specs(path, status.st_mtime_ns, status.st_size, target_tons)
+
+
+def spec_by_item(specs, item):
+    """Finds the spec of a process step by name, ignoring surrounding spaces"""
+    item = item.strip()
+    for spec in specs:
+        if spec.item == item:
+            return spec
+    raise KeyError(item)
@@ -0,0 +1,317 @@
+import math
+from statistics import NormalDist
+
+
+def t_quantile(p, df):
+    """Returns the p quantile of Student's t distribution
+
+    Uses the exact forms for one and two degrees of freedom and a
+    Cornish-Fisher expansion around the normal quantile otherwise
+
+    Parameters:
+    p (float): The probability, between 0 and 1
+    df (int): The degrees of freedom
+
+    Returns:
+    float: The quantile
+    """
+    if df < 1:
+        raise ValueError("t_quantile needs at least one degree of freedom")
+    if df == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if df == 2:
+        return (2 * p - 1) / math.sqrt(2 * p * (1 - p))
+    z = NormalDist().inv_cdf(p)
+    z3 = z ** 3
+    z5 = z ** 5
+    z7 = z ** 7
+    z9 = z ** 9
+    return (
+        z
+        + (z3 + z) / (4 * df)
+        + (5 * z5 + 16 * z3 + 3 * z) / (96 * df ** 2)
+        + (3 * z7 + 19 * z5 + 17 * z3 - 15 * z) / (384 * df ** 3)
+        + (79 * z9 + 776 * z7 + 1482 * z5 - 1920 * z3 - 945 * z) / (92160 * df ** 4)
+    )
+
+
+class Estimate(object):
+    """A sample mean with a confidence interval
+
+    Attributes:
+        mean        The sample mean
+        std         The sample standard deviation
+        half_width  The half width of the confidence interval on the mean
+        n           The number of observations
+        confidence  The confidence level of the interval
+    """
+
+    def __init__(self, mean, std, half_width, n, confidence):
+        self.mean = mean
+        self.std = std
+        self.half_width = half_width
+        self.n = n
+        self.confidence = confidence
+
+    @property
+    def low(self):
+        """The lower bound of the confidence interval"""
+        return self.mean - self.half_width
+
+    @property
+    def high(self):
+        """The upper bound of the confidence interval"""
+        return self.mean + self.half_width
+
+    def __repr__(self):
+        return f'Estimate({self.mean:.6g} +/- {self.half_width:.3g}, n={self.n})'
+
+
+def estimate(values, confidence=0.95):
+    """Builds an Estimate from independent observations
+
+    Parameters:
+    values (iterable): The observations, one per replication
+    confidence (float): The confidence level of the interval
+
+    Returns:
+    Estimate: The mean and its t based confidence interval
+    """
+    values = list(values)
+    n = len(values)
+    if n == 0:
+        raise ValueError("estimate needs at least one observation")
+    mean = math.fsum(values) / n
+    if n == 1:
+        return Estimate(mean, 0.0, math.inf, n, confidence)
+    variance = math.fsum((value - mean) ** 2 for value in values) / (n - 1)
+    std = math.sqrt(variance)
+    half_width = t_quantile(0.5 + confidence / 2, n - 1) * std / math.sqrt(n)
+    return Estimate(mean, std, half_width, n, confidence)
+
+
+def estimate_columns(values, confidence=0.95):
+    """Builds an Estimate for every column of a (observations, columns) array
+
+    Parameters:
+    values (numpy.ndarray): One row per replication
+    confidence (float): The confidence level of the intervals
+
+    Returns:
+    list: One Estimate per column
+    """
+    import numpy as np
+    values = np.asarray(values, dtype=float)
+    means = values.mean(axis=0)
+    return estimate_moments(values.shape[0], means, ((values - means) ** 2).sum(axis=0), confidence)
+
+
+def estimate_moments(n, means, squares, confidence=0.95):
+    """Builds an Estimate for every column from its count, mean and sum of squared deviations,
+    which merge across blocks of observations without keeping them
+
+    Parameters:
+    n (int): The number of observations of every column
+    means (numpy.ndarray): The mean of each column
+    squares (numpy.ndarray): The sum of squared deviations from the mean of each column
+    confidence (float): The confidence level of the intervals
+
+    Returns:
+    list: One Estimate per column
+    """
+    import numpy as np
+    if n == 1:
+        return [Estimate(mean, 0.0, math.inf, n, confidence) for mean in means.tolist()]
+    stds = np.sqrt(squares / (n - 1))
+    factor = t_quantile(0.5 + confidence / 2, n - 1) / math.sqrt(n)
+    return [
+        Estimate(mean, std, factor * std, n, confidence)
+        for mean, std in zip(means.tolist(), stds.tolist())
+    ]
+
+
+class RunningStats(object):
+    """The count, mean, variance and range of a stream of values in constant memory
+    Values are added one at a time with Welford's update, and two streams
+    merge with the pairwise formula of Chan et al, so statistics kept in
+    worker processes combine into those of all the values in any grouping,
+    the same up to rounding as if one stream had seen them all
+
+    Attributes:
+        count       The number of values
+        mean        The mean of the values, 0 before the first
+        m2          The sum of squared deviations from the mean
+        min         The smallest value, inf before the first
+        max         The largest value, -inf before the first
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        """Adds a value"""
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        """Adds every value another RunningStats has seen and returns self"""
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2, self.min, self.max = other.count, other.mean, other.m2, other.min, other.max
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def copy(self):
+        """Returns an independent copy"""
+        return RunningStats().merge(self)
+
+    @property
+    def variance(self):
+        """The sample variance, 0 for fewer than two values"""
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self):
+        """The sample standard deviation"""
+        return math.sqrt(self.variance)
+
+    def __repr__(self):
+        return f'RunningStats(n={self.count}, mean={self.mean:.6g}, std={self.std:.3g})'
+
+
+class QuantileSketch(object):
+    """Quantiles of a stream of weighted values within a relative error in bounded memory
+    Each value adds its weight to a logarithmic bucket, so any quantile is
+    within relative_accuracy of a value of the stream. Unlike the markers
+    of the P-square algorithm, buckets merge exactly: merging adds the
+    weights bucket by bucket, which is associative and commutative. The
+    number of buckets grows with the range of the values, not their number,
+    about 1200 buckets for values from 0.001 to 1e9 at 1% accuracy
+
+    Attributes:
+        relative_accuracy   The relative error of every quantile
+        gamma               The ratio of the bounds of a bucket
+        positive            The weight of each bucket of positive values, by bucket index
+        negative            The weight of each bucket of negative values, by bucket index of the magnitude
+        zero                The weight of values within min_value of 0
+        min_value           The smallest magnitude told apart from 0
+        count               The total weight
+        total               The weighted sum of the values
+        min                 The smallest value, inf before the first
+        max                 The largest value, -inf before the first
+    """
+
+    def __init__(self, relative_accuracy=0.01, min_value=1e-9):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0.0
+        self.min_value = min_value
+        self.count = 0.0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value, weight=1.0):
+        """Adds a value with a weight, e.g. the time a level was held"""
+        if weight <= 0:
+            return
+        self.count += weight
+        self.total += value * weight
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value > self.min_value:
+            index = math.ceil(math.log(value) / self._log_gamma)
+            self.positive[index] = self.positive.get(index, 0.0) + weight
+        elif value < -self.min_value:
+            index = math.ceil(math.log(-value) / self._log_gamma)
+            self.negative[index] = self.negative.get(index, 0.0) + weight
+        else:
+            self.zero += weight
+
+    def merge(self, other):
+        """Adds every value of another sketch of the same accuracy and returns self"""
+        if other.gamma != self.gamma:
+            raise ValueError("only sketches of the same relative accuracy merge")
+        for buckets, others in ((self.positive, other.positive), (self.negative, other.negative)):
+            for index, weight in others.items():
+                buckets[index] = buckets.get(index, 0.0) + weight
+        self.zero += other.zero
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def copy(self):
+        """Returns an independent copy"""
+        return QuantileSketch(self.relative_accuracy, self.min_value).merge(self)
+
+    @property
+    def mean(self):
+        """The weighted mean of the values, nan before the first"""
+        return self.total / self.count if self.count > 0 else math.nan
+
+    def _value(self, index):
+        """Returns the value a bucket stands for, the point of least relative error"""
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    def quantile(self, q):
+        """Returns the q quantile of the values, nan before the first"""
+        if self.count <= 0:
+            return math.nan
+        rank = q * self.count
+        seen = 0.0
+        # from the most negative value up
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen >= rank:
+                return min(max(-self._value(index), self.min), self.max)
+        seen += self.zero
+        if seen >= rank and self.zero > 0:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen >= rank:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def quantiles(self, qs):
+        """Returns the quantile of each of qs"""
+        return [self.quantile(q) for q in qs]
+
+    def __repr__(self):
+        return f'QuantileSketch(n={self.count:.6g}, median={self.quantile(0.5):.6g})'
+
+
+def merge_all(values):
+    """Merges RunningStats or QuantileSketch objects into a new one, leaving them untouched"""
+    values = list(values)
+    if not values:
+        raise ValueError("merge_all needs at least one value")
+    merged = values[0].copy()
+    for value in values[1:]:
+        merged.merge(value)
+    return merged
@@ -0,0 +1,234 @@
+import copy
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from replication import replication_seeds, run_replication, summarize
+
+# Scenario keys name what they change:
+#   "delivery_size"              an attribute of the LineSpec
+#   "batch_failure_rate"         a StageSpec attribute, set on every stage
+#   "units:Jet-Mill"             a StageSpec attribute of one stage
+LINE_ATTRIBUTES = ("delivery_size", "delivery_size_sigma", "delivery_time", "delivery_time_sigma")
+
+
+def grid(**axes):
+    """Builds every combination of the values of each axis
+
+    Parameters:
+    axes: Scenario keys mapped to the list of values to try, pass stage keys
+          with a dict, e.g. grid(**{"units:Jet-Mill": [1, 2]})
+
+    Returns:
+    list: One scenario dictionary per combination
+    """
+    names = list(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*axes.values())]
+
+
+def apply_scenario(spec, scenario):
+    """Returns a copy of a line with the scenario's changes applied
+
+    Parameters:
+    spec (line.LineSpec): The base line
+    scenario (dict): The changes, see the key format above
+
+    Returns:
+    line.LineSpec: The changed line
+    """
+    spec = copy.deepcopy(spec)
+    stages = {stage.name: stage for stage in spec.stages}
+    for key, value in scenario.items():
+        attribute, _, stage_name = key.partition(":")
+        if not stage_name and attribute in LINE_ATTRIBUTES:
+            setattr(spec, attribute, value)
+            continue
+        targets = [stages[stage_name]] if stage_name else spec.stages
+        for stage in targets:
+            if not hasattr(stage, attribute):
+                raise KeyError(f'scenario key {key!r} does not name a stage attribute')
+            setattr(stage, attribute, value)
+    return spec
+
+
+def calendar_fingerprint(calendar):
+    """Returns a json-able description of a shifts.ShiftCalendar, None for a stage working 24/7"""
+    if calendar is None:
+        return None
+    return [calendar.hours_per_day, calendar.days_per_week, calendar.start_hour]
+
+
+def spec_fingerprint(spec):
+    """Returns a json-able description of every parameter of a line"""
+    line = {name: value for name, value in vars(spec).items() if name != "stages"}
+    line["stages"] = [
+        dict(vars(stage), calendar=calendar_fingerprint(getattr(stage, "calendar", None))) for stage in spec.stages]
+    return line
+
+
+def _digest(description):
+    """Hashes a json-able description, numpy numbers included"""
+    text = json.dumps(description, sort_keys=True, default=float)
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def line_key(spec):
+    """Hashes every parameter of a line, so results of different lines under one scenario name stay apart
+
+    Parameters:
+    spec (line.LineSpec): The line with the scenario applied
+
+    Returns:
+    str: The hex digest of spec_fingerprint
+    """
+    return _digest(spec_fingerprint(spec))
+
+
+def scenario_key(spec, horizon, seed):
+    """Hashes everything a replication's result depends on
+
+    Parameters:
+    spec (line.LineSpec): The line with the scenario applied
+    horizon (float): The run length
+    seed (int): The seed of the replication
+
+    Returns:
+    str: The hex digest keying the result in the store
+    """
+    return _digest({"line": spec_fingerprint(spec), "horizon": horizon, "seed": seed})
+
+
+class SweepStore(object):
+    """Keeps replication results in a SQLite file keyed by scenario_key
+    Results are committed in groups while a sweep runs so an interrupted
+    sweep loses at most the last group
+
+    Attributes:
+        path            The SQLite file
+        commit_every    The number of results written between commits
+        connection      The sqlite3 connection
+    """
+
+    def __init__(self, path, commit_every=100):
+        self.path = path
+        self.commit_every = commit_every
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, scenario TEXT, seed INTEGER, horizon REAL, result TEXT, line TEXT)"
+        )
+        # stores written before results were tagged with their line_key lack the column, their rows keep NULL
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(results)")]
+        if "line" not in columns:
+            self.connection.execute("ALTER TABLE results ADD COLUMN line TEXT")
+        self.connection.commit()
+        self._pending = 0
+
+    def done(self):
+        """Returns the set of keys already in the store"""
+        return {key for key, in self.connection.execute("SELECT key FROM results")}
+
+    def put(self, key, scenario, seed, horizon, result, line=None):
+        """Writes one replication result, line is the line_key of the line it ran on"""
+        self.connection.execute(
+            "INSERT OR REPLACE INTO results (key, scenario, seed, horizon, result, line) VALUES (?, ?, ?, ?, ?, ?)",
+            (key, json.dumps(scenario, sort_keys=True), seed, horizon, json.dumps(result), line),
+        )
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.commit()
+
+    def get(self, key):
+        """Returns the result stored under key, None when missing"""
+        row = self.connection.execute("SELECT result FROM results WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def commit(self):
+        """Makes the written results durable"""
+        self.connection.commit()
+        self._pending = 0
+
+    def close(self):
+        """Commits and closes the store"""
+        self.commit()
+        self.connection.close()
+
+
+def _run_point(args):
+    """Runs one (scenario, seed) point in a worker process"""
+    key, spec, horizon, seed = args
+    return key, run_replication(spec, horizon, seed)
+
+
+def sweep(
+        spec,
+        scenarios,
+        horizon,
+        replications=1,
+        seed=0,
+        store_path="sweep.sqlite",
+        workers=None,
+        confidence=0.95,
+        ):
+    """Runs every scenario in parallel, skipping points the store already holds
+
+    Every scenario uses the same replication seeds, so a point is identified
+    by its changed line, the horizon and the seed. Re-running a sweep, or
+    running it again after an interruption, only simulates missing points
+
+    Parameters:
+    spec (line.LineSpec): The base line
+    scenarios (list): The scenario dictionaries, e.g. from grid
+    horizon (float): The time to run each replication until
+    replications (int): The replications per scenario
+    seed (int): The base seed of the replication seeds
+    store_path (str): The SQLite file results are kept in
+    workers (int): The number of worker processes, every core when None
+    confidence (float): The confidence level of the summaries
+
+    Returns:
+    list: (scenario, summary) pairs in the order of scenarios, see replication.summarize
+    """
+    seeds = replication_seeds(seed, replications)
+    store = SweepStore(store_path)
+    try:
+        done = store.done()
+        points = []
+        todo = []
+        line_of = {}
+        for scenario in scenarios:
+            scenario_spec = apply_scenario(spec, scenario)
+            scenario_line = line_key(scenario_spec)
+            keys = []
+            for replication_seed in seeds:
+                key = scenario_key(scenario_spec, horizon, replication_seed)
+                keys.append(key)
+                if key not in done:
+                    done.add(key)
+                    line_of[key] = scenario_line
+                    todo.append((scenario, (key, scenario_spec, horizon, replication_seed)))
+            points.append((scenario, keys))
+        scenario_of = {task[0]: scenario for scenario, task in todo}
+        seed_of = {task[0]: task[3] for _, task in todo}
+        workers = workers or os.cpu_count() or 1
+        if workers == 1:
+            for _, task in todo:
+                key, result = _run_point(task)
+                store.put(key, scenario_of[key], seed_of[key], horizon, result, line_of[key])
+        elif todo:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_run_point, task) for _, task in todo]
+                for future in as_completed(futures):
+                    key, result = future.result()
+                    store.put(key, scenario_of[key], seed_of[key], horizon, result, line_of[key])
+        store.commit()
+        return [
+            (scenario, summarize([store.get(key) for key in keys], confidence))
+            for scenario, keys in points
+        ]
+    finally:
+        store.close()
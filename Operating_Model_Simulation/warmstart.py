@@ -0,0 +1,241 @@
+import os
+import pickle
+import traceback
+from collections import defaultdict
+from engine import make_environment
+from line import Line
+from replication import line_results, replication_seeds, summarize
+
+# A SimPy model is a web of generators and scheduled events that cannot be
+# pickled, so instead of serializing a warm line this module snapshots it
+# with os.fork. The parent runs the transient and every child starts from a
+# copy-on-write image of the warm line, reseeds the random streams with its
+# own replication seed and runs on to the horizon. Replications that branch
+# from one warm-up share its end state, so their spread misses the variance
+# of that state and an interval from them alone is too narrow. The parent
+# therefore warms up several snapshots from independent seeds and spreads the replications across them; with a
+# snapshot per replication every replication is independent. Statistics are
+# reset at the end of the warm-up, so counts, state times and level
+# statistics cover warmup to horizon only. A buffer's final_level is still
+# its level at the horizon, warm-up material included, while net_change is
+# the change from warmup to horizon: the End-Buffer's is the output after
+# the warm-up.
+#
+# Where os.fork is missing every replication runs its own warm-up instead.
+# Both ways give the same results, the fork only saves the repeated work.
+
+CAN_FORK = hasattr(os, "fork")
+# the warm-ups by default, fixed rather than one per core so a seed gives the same results on any machine
+SNAPSHOTS = 8
+
+
+def warm_line(spec, warmup, seed=None, history=False, pool_units=None, engine="simpy", summary=False):
+    """Builds a line and runs it through the warm-up
+
+    Parameters:
+    spec (line.LineSpec): The line to simulate
+    warmup (float): The time to run before statistics start
+    seed (int): The seed of the warm-up
+    history (bool): Whether machines and buffers keep their histories
+    pool_units (int): Stages of at least this many units run as one entities.MachinePool, None to never pool
+    engine (str): The event engine, "simpy" or "heap" for engine.Engine
+    summary (bool): Keep streaming statistics instead of histories, see replication.run_replication
+
+    Returns:
+    line.Line: The warm line with its statistics reset at the warm-up time
+    """
+    env = make_environment(engine)
+    line = Line(
+        env, spec, seed=seed, history=history and not summary, pool_units=pool_units, statistics=summary)
+    env.run(until=warmup)
+    line.reset_statistics()
+    return line
+
+
+def _continue(line, horizon, seed, variant):
+    """Runs a warm line on from the snapshot with its own seed and returns its results"""
+    line.reseed(seed)
+    if variant is not None:
+        variant(line)
+    line.env.run(until=horizon)
+    return line_results(line, horizon)
+
+
+def _start_child(line, horizon, seed, variant):
+    """Forks a child that continues the line and pickles its results into a pipe"""
+    read_end, write_end = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_end)
+        status = 0
+        try:
+            try:
+                payload = (True, _continue(line, horizon, seed, variant))
+            except BaseException:
+                payload = (False, traceback.format_exc())
+                status = 1
+            with os.fdopen(write_end, "wb") as pipe:
+                pickle.dump(payload, pipe, protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            # leave without running the parent's exit handlers or flushing its buffers
+            os._exit(status)
+    os.close(write_end)
+    return pid, read_end
+
+
+def _collect_child(pid, read_end):
+    """Reads the results of a child and waits for it to exit"""
+    with os.fdopen(read_end, "rb") as pipe:
+        data = pipe.read()
+    os.waitpid(pid, 0)
+    if not data:
+        raise RuntimeError(f'replication process {pid} died without results')
+    succeeded, payload = pickle.loads(data)
+    if not succeeded:
+        raise RuntimeError(f'replication process {pid} failed:\n{payload}')
+    return payload
+
+
+def snapshot_seeds(seed, replications, snapshots):
+    """Derives the seeds of the warm-ups, independent of the replication seeds of the same base seed
+
+    Parameters:
+    seed (int): The base seed of the experiment
+    replications (int): The number of replications the base seed also seeds
+    snapshots (int): The number of independent warm-ups
+
+    Returns:
+    list: One integer seed per warm-up
+    """
+    return replication_seeds(seed, replications + snapshots)[replications:]
+
+
+def _branch(
+        spec, warmup, horizon, tasks, warmup_seeds, workers, history, pool_units=None, engine="simpy", summary=False):
+    """Runs (snapshot, replication seed, variant) tasks, each from the warm-up of its snapshot
+
+    The parent warms up a snapshot only once the children of the one before
+    are started, so the warm-ups run alongside them
+
+    Returns:
+    list: The line_results of every task, in task order
+    """
+    if not CAN_FORK:
+        return [
+            _continue(
+                warm_line(spec, warmup, warmup_seeds[snapshot], history, pool_units, engine, summary),
+                horizon, replication_seed, variant)
+            for snapshot, replication_seed, variant in tasks
+        ]
+    by_snapshot = defaultdict(list)
+    for index, (snapshot, replication_seed, variant) in enumerate(tasks):
+        by_snapshot[snapshot].append((index, replication_seed, variant))
+    workers = workers or os.cpu_count() or 1
+    results = [None] * len(tasks)
+    running = []
+    try:
+        for snapshot, snapshot_tasks in sorted(by_snapshot.items()):
+            line = warm_line(spec, warmup, warmup_seeds[snapshot], history, pool_units, engine, summary)
+            for index, replication_seed, variant in snapshot_tasks:
+                if len(running) == workers:
+                    done, pid, read_end = running.pop(0)
+                    results[done] = _collect_child(pid, read_end)
+                running.append((index, *_start_child(line, horizon, replication_seed, variant)))
+        while running:
+            done, pid, read_end = running.pop(0)
+            results[done] = _collect_child(pid, read_end)
+    finally:
+        # after a failure the other children are still running, closing their pipes
+        # ends any that block on writing their results, and each is reaped
+        for _, pid, read_end in running:
+            os.close(read_end)
+            os.waitpid(pid, 0)
+    return results
+
+
+def _snapshots(snapshots, replications):
+    """Returns how many warm-ups to run, SNAPSHOTS by default and never more than replications"""
+    if snapshots is None:
+        snapshots = SNAPSHOTS
+    if snapshots < 1:
+        raise ValueError(f'snapshots must be at least 1, got {snapshots}')
+    return min(snapshots, replications)
+
+
+def fork_replications(
+        spec, warmup, horizon, replications, seed=0, workers=None, confidence=0.95, history=False, pool_units=None,
+        engine="simpy", summary=False, snapshots=None):
+    """Runs replications that branch off independent warm-ups of the line
+
+    Replication i starts from snapshot i modulo snapshots. The intervals
+    treat the replications as independent, which they are across snapshots,
+    so they are only conditional on the warm states when snapshots is small;
+    pass snapshots=replications for fully independent replications
+
+    Parameters:
+    spec (line.LineSpec): The line to simulate
+    warmup (float): The time simulated before the replications branch off
+    horizon (float): The time each replication runs until, statistics cover warmup to horizon,
+        final levels are the levels at the horizon
+    replications (int): The number of replications
+    seed (int): The base seed, the warm-up and replication seeds derive from it
+    workers (int): The number of child processes at a time, every core when None
+    confidence (float): The confidence level of the intervals
+    history (bool): Whether machines and buffers keep their histories
+    pool_units (int): Stages of at least this many units run as one entities.MachinePool, None to never pool
+    engine (str): The event engine, "simpy" or "heap" for engine.Engine
+    summary (bool): Keep streaming statistics instead of histories, see replication.run_replication
+    snapshots (int): The number of independent warm-ups, SNAPSHOTS when None
+
+    Returns:
+    dict: The aggregated results, see replication.summarize
+    """
+    snapshots = _snapshots(snapshots, replications)
+    tasks = [
+        (i % snapshots, replication_seed, None)
+        for i, replication_seed in enumerate(replication_seeds(seed, replications))]
+    results = _branch(
+        spec, warmup, horizon, tasks, snapshot_seeds(seed, replications, snapshots), workers, history, pool_units,
+        engine, summary)
+    return summarize(results, confidence)
+
+
+def fork_variants(
+        spec, warmup, horizon, variants, replications, seed=0, workers=None, confidence=0.95, history=False,
+        pool_units=None, engine="simpy", summary=False, snapshots=None):
+    """Runs what-if variants that branch off independent warm-ups of the line
+
+    Every variant sees the same snapshots and replication seeds, so the
+    variants differ only by the change they make to the warm line
+
+    Parameters:
+    spec (line.LineSpec): The line to simulate
+    warmup (float): The time simulated once before the variants branch off
+    horizon (float): The time each replication runs until
+    variants (dict): Functions that change a warm line.Line in place, keyed by name, None for no change
+    replications (int): The number of replications of each variant
+    seed (int): The base seed
+    workers (int): The number of child processes at a time, every core when None
+    confidence (float): The confidence level of the intervals
+    history (bool): Whether machines and buffers keep their histories
+    pool_units (int): Stages of at least this many units run as one entities.MachinePool, None to never pool
+    engine (str): The event engine, "simpy" or "heap" for engine.Engine
+    summary (bool): Keep streaming statistics instead of histories, see replication.run_replication
+    snapshots (int): The number of independent warm-ups, SNAPSHOTS when None
+
+    Returns:
+    dict: The aggregated results of each variant, keyed by name
+    """
+    snapshots = _snapshots(snapshots, replications)
+    seeds = replication_seeds(seed, replications)
+    names = list(variants)
+    tasks = [
+        (i % snapshots, replication_seed, variants[name])
+        for name in names for i, replication_seed in enumerate(seeds)]
+    results = _branch(
+        spec, warmup, horizon, tasks, snapshot_seeds(seed, replications, snapshots), workers, history, pool_units,
+        engine, summary)
+    return {
+        name: summarize(results[i * replications:(i + 1) * replications], confidence)
+        for i, name in enumerate(names)
+    }